@@ -1,28 +1,27 @@
-from typing import Dict, List
-from math import radians, sin, cos, sqrt, atan2
+from typing import Dict, List, Optional
 
-def haversine_km(loc1: Dict, loc2: Dict) -> float:
-    try:
-        lat1, lon1 = float(loc1["lat"]), float(loc1["lng"])
-        lat2, lon2 = float(loc2["lat"]), float(loc2["lng"])
-    except Exception:
-        return 9999
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
+from ..utils.context import PipelineContext
+from ..utils.geo import coords_array, distances_from
 
-def enrich_with_commute(user_loc: Dict, rooms: List[Dict]) -> List[Dict]:
+def enrich_with_commute(
+    user_loc: Dict,
+    rooms: List[Dict],
+    ctx: Optional[PipelineContext] = None,
+    user_key: Optional[str] = None,
+) -> List[Dict]:
     """Add distance_km and eta_minutes to each room. 
-    TODO: swap haversine with Google Routes API if available."""
-    enriched = []
-    for r in rooms:
-        if user_loc and r.get("geo"):
-            dist = haversine_km(user_loc, r["geo"])
-            r["distance_km"] = round(dist, 1)
-            # crude estimate: 30 km/h → minutes
-            r["eta_minutes"] = int((dist / 30.0) * 60)
-        enriched.append(r)
-    return enriched
+    TODO: swap haversine with Google Routes API if available.
+    With a ``ctx``, distances already measured for ``user_key`` are reused."""
+    rooms = list(rooms)
+    with_geo = [r for r in rooms if user_loc and r.get("geo")]
+    lats, lngs = coords_array(r["geo"] for r in with_geo)
+    if ctx is not None:
+        keys = [ctx.key(r, "geo", kind="listing") for r in with_geo]
+        dists = ctx.distances(user_key, user_loc, keys, lats, lngs)
+    else:
+        dists = distances_from(user_loc, lats, lngs)
+    for r, dist in zip(with_geo, dists.tolist()):
+        r["distance_km"] = round(dist, 1)
+        # crude estimate: 30 km/h → minutes
+        r["eta_minutes"] = int((dist / 30.0) * 60)
+    return rooms
@@ -36,11 +36,18 @@
 
 
 # app/agents/match_scorer.py
-from typing import Dict, Tuple, List, Optional, Iterable
-from math import radians, sin, cos, sqrt, atan2
+from typing import Any, Dict, Tuple, List, Optional, Iterable, Sequence, Union
 from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+import hashlib
 
+import numpy as np
+
+from ..utils.context import PipelineContext
+from ..utils.geo import coords, distances_from, haversine_km
 from ..utils.num import as_int
+from ..utils.topk import top_k_indices
 
 
 @dataclass
@@ -69,8 +76,98 @@ class MatchScoreConfig:
     )
 
 
+# Subscore columns returned by score_many, in score_pair's evaluation order.
+SUBSCORE_KEYS: Tuple[str, ...] = (
+    "city", "budget", "sleep", "cleanliness", "noise", "study", "smoking", "guests", "role", "anchor",
+)
+
+
+@dataclass(frozen=True, eq=False)
+class ScoringPlan:
+    """Immutable, compiled form of a :class:`MatchScoreConfig`.
+
+    Plans are built by :func:`compile_config` and cached by ``fingerprint``,
+    so equal configs share one plan.  Equality and hashing go through the
+    fingerprint.
+    """
+
+    fingerprint: str
+    weight_keys: Tuple[str, ...]            # weights dict order (score_pair's summation order)
+    weights: Dict[str, Any]                 # read-only view; missing keys score 0
+    weight_vector: np.ndarray               # aligned with SUBSCORE_KEYS
+    anchor_thresholds: np.ndarray           # bucket upper bounds (km), config order
+    anchor_points: np.ndarray               # int(round(anchor weight * multiplier)) per bucket
+    anchor_steps: Tuple[Tuple[float, int, str], ...]   # (threshold, points, reason) for score_pair
+    ceilings: Dict[str, Any]                # best obtainable subscore per SUBSCORE_KEYS entry
+    sum_order: Tuple[str, ...]              # SUBSCORE_KEYS in score_pair's summation order
+    nonnegative: bool
+
+    def weight(self, key: str) -> Any:
+        return self.weights.get(key, 0)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ScoringPlan) and other.fingerprint == self.fingerprint
+
+    def __hash__(self) -> int:
+        return hash(self.fingerprint)
+
+
+def _anchor_reason(threshold: float) -> str:
+    if threshold <= 2:
+        return "Same anchor location"
+    if threshold <= 5:
+        return f"Anchors very close (≤{threshold:g} km)"
+    return f"Anchors nearby (≤{threshold:g} km)"
+
+
+def _readonly(values: Sequence[Any], dtype: Any = None) -> np.ndarray:
+    arr = np.array(values, dtype=dtype)
+    arr.setflags(write=False)
+    return arr
+
+
+@lru_cache(maxsize=256)
+def _compile(key: Tuple[Tuple[Tuple[str, Any, type], ...], Tuple[Tuple[float, float], ...]]) -> ScoringPlan:
+    weight_items, buckets = key
+    weights = {k: w for k, w, _ in weight_items}
+    anchor_weight = weights.get("anchor", 0)
+    points = [int(round(anchor_weight * multiplier)) for _, multiplier in buckets]
+
+    ceilings: Dict[str, Any] = {k: max(weights.get(k, 0), 0) for k in SUBSCORE_KEYS}
+    ceilings["anchor"] = max([0] + points)
+
+    return ScoringPlan(
+        fingerprint=hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16],
+        weight_keys=tuple(weights),
+        weights=MappingProxyType(weights),
+        weight_vector=_readonly([weights.get(k, 0) for k in SUBSCORE_KEYS]),
+        anchor_thresholds=_readonly([float(t) for t, _ in buckets], dtype=float),
+        anchor_points=_readonly(points, dtype=np.int64),
+        anchor_steps=tuple((t, pts, _anchor_reason(t)) for (t, _), pts in zip(buckets, points)),
+        ceilings=MappingProxyType(ceilings),
+        sum_order=tuple([k for k in weights if k in SUBSCORE_KEYS] + [k for k in SUBSCORE_KEYS if k not in weights]),
+        nonnegative=all(w >= 0 for w in weights.values()) and all(m >= 0 for _, m in buckets),
+    )
+
+
+def compile_config(config: Union[MatchScoreConfig, ScoringPlan, None] = None) -> ScoringPlan:
+    """Return the cached :class:`ScoringPlan` for ``config`` (the active config when ``None``)."""
+
+    if isinstance(config, ScoringPlan):
+        return config
+    if config is None:
+        return _ACTIVE_PLAN
+    # The value type is part of the key: 10 and 10.0 hash alike but score differently typed.
+    key = (
+        tuple((k, w, type(w)) for k, w in config.weights.items()),
+        tuple((float(t), float(m)) for t, m in config.anchor_buckets),
+    )
+    return _compile(key)
+
+
 _DEFAULT_MATCH_CONFIG = MatchScoreConfig()
 _ACTIVE_MATCH_CONFIG = MatchScoreConfig()
+_ACTIVE_PLAN = compile_config(_ACTIVE_MATCH_CONFIG)
 
 
 def get_match_config() -> MatchScoreConfig:
@@ -85,13 +182,14 @@ def get_match_config() -> MatchScoreConfig:
 def set_match_config(config: MatchScoreConfig) -> None:
     """Override the active configuration."""
 
-    global _ACTIVE_MATCH_CONFIG
+    global _ACTIVE_MATCH_CONFIG, _ACTIVE_PLAN
     weights = dict(config.weights)
     anchor_buckets: Iterable[Tuple[float, float]] = config.anchor_buckets
     _ACTIVE_MATCH_CONFIG = MatchScoreConfig(
         weights=weights,
         anchor_buckets=tuple(anchor_buckets),
     )
+    _ACTIVE_PLAN = compile_config(_ACTIVE_MATCH_CONFIG)
 
 
 def reset_match_config() -> None:
@@ -99,32 +197,17 @@ def reset_match_config() -> None:
 
     set_match_config(_DEFAULT_MATCH_CONFIG)
 
-# ---------------- Helpers ----------------
-def haversine_km(loc1: Dict, loc2: Dict) -> float:
-    """Distance in km between two lat/lng dicts."""
-    try:
-        lat1, lon1 = float(loc1["lat"]), float(loc1["lng"])
-        lat2, lon2 = float(loc2["lat"]), float(loc2["lng"])
-    except Exception:
-        return 9999  # invalid coords = far away
-
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
-
 # ---------------- Core Scorer ----------------
 def score_pair(
     a: Dict,
     b: Dict,
-    config: Optional[MatchScoreConfig] = None,
+    config: Union[MatchScoreConfig, ScoringPlan, None] = None,
+    ctx: Optional[PipelineContext] = None,
 ) -> Tuple[int, List[str], Dict[str, int]]:
-    cfg = config or _ACTIVE_MATCH_CONFIG
-    weights = cfg.weights
+    plan = compile_config(config)
+    weights = plan.weights
 
-    s = {k: 0 for k in weights}
+    s = {k: 0 for k in plan.weight_keys}
     reasons = []
 
     # --- City ---
@@ -170,25 +253,253 @@ def score_pair(
 
     # --- Anchor location (distance-based) ---
     if a.get("anchor_location") and b.get("anchor_location"):
-        d = haversine_km(a["anchor_location"], b["anchor_location"])
-        anchor_weight = weights.get("anchor", 0)
-        matched_bucket = None
-        for threshold, multiplier in cfg.anchor_buckets:
+        d = ctx.pair_km(a, b) if ctx is not None else haversine_km(a["anchor_location"], b["anchor_location"])
+        for threshold, points, reason in plan.anchor_steps:
             if d <= threshold:
-                matched_bucket = (threshold, multiplier)
+                s["anchor"] = points
+                reasons.append(reason)
                 break
-
-        if matched_bucket:
-            threshold, multiplier = matched_bucket
-            s["anchor"] = int(round(anchor_weight * multiplier))
-            if threshold <= 2:
-                reasons.append("Same anchor location")
-            elif threshold <= 5:
-                reasons.append(f"Anchors very close (≤{threshold:g} km)")
-            else:
-                reasons.append(f"Anchors nearby (≤{threshold:g} km)")
         else:
             reasons.append("Anchors far apart")
 
     total = sum(s.values())
     return total, reasons, s
+
+
+# ---------------- Batch Scorer ----------------
+# subscore key -> profile field compared for equality
+_CATEGORICAL_FIELDS: Dict[str, str] = {
+    "city": "city",
+    "sleep": "sleep_schedule",
+    "cleanliness": "cleanliness",
+    "noise": "noise_tolerance",
+    "smoking": "smoking",
+    "guests": "guests_freq",
+    "role": "role",
+}
+
+_MISSING = -1
+_UNKNOWN = -2
+
+
+def _hashable(v: Any) -> Any:
+    try:
+        hash(v)
+        return v
+    except TypeError:
+        return repr(v)
+
+
+def _contains(haystack: Any, needle: str) -> bool:
+    try:
+        return needle in haystack
+    except TypeError:
+        return False
+
+
+@dataclass
+class PoolCodes:
+    """Integer-encoded candidate fields consumed by :func:`score_many`.
+
+    Encode once per snapshot and slice with :meth:`take` per request; the
+    vocabularies are shared between a block and its slices.
+    """
+
+    codes: Dict[str, np.ndarray]          # subscore key -> int32 codes (-1 = missing)
+    vocab: Dict[str, Dict[Any, int]]
+    budget: np.ndarray                    # int64, 0 when missing
+    has_study: np.ndarray
+    study_library: np.ndarray
+    study_home: np.ndarray
+    has_anchor: np.ndarray
+    anchor_lat: np.ndarray                # NaN when missing/invalid
+    anchor_lng: np.ndarray
+
+    @classmethod
+    def encode(cls, pool: Sequence[Dict[str, Any]]) -> "PoolCodes":
+        n = len(pool)
+        vocab: Dict[str, Dict[Any, int]] = {k: {} for k in _CATEGORICAL_FIELDS}
+        codes = {k: np.full(n, _MISSING, dtype=np.int32) for k in _CATEGORICAL_FIELDS}
+        budget = np.zeros(n, dtype=np.int64)
+        has_study = np.zeros(n, dtype=bool)
+        study_library = np.zeros(n, dtype=bool)
+        study_home = np.zeros(n, dtype=bool)
+        has_anchor = np.zeros(n, dtype=bool)
+        anchor_lat = np.full(n, np.nan)
+        anchor_lng = np.full(n, np.nan)
+
+        for i, b in enumerate(pool):
+            for key, fld in _CATEGORICAL_FIELDS.items():
+                v = b.get(fld)
+                if v:
+                    table = vocab[key]
+                    codes[key][i] = table.setdefault(_hashable(v), len(table))
+            budget[i] = as_int(b.get("budget_pkr")) or 0
+            study = b.get("study_habits")
+            if study:
+                has_study[i] = True
+                study_library[i] = _contains(study, "library")
+                study_home[i] = _contains(study, "home")
+            anchor = b.get("anchor_location")
+            if anchor:
+                has_anchor[i] = True
+                anchor_lat[i], anchor_lng[i] = coords(anchor) or (np.nan, np.nan)
+
+        return cls(codes, vocab, budget, has_study, study_library, study_home, has_anchor, anchor_lat, anchor_lng)
+
+    def __len__(self) -> int:
+        return len(self.budget)
+
+    def take(self, rows: np.ndarray) -> "PoolCodes":
+        return PoolCodes(
+            codes={k: c[rows] for k, c in self.codes.items()},
+            vocab=self.vocab,
+            budget=self.budget[rows],
+            has_study=self.has_study[rows],
+            study_library=self.study_library[rows],
+            study_home=self.study_home[rows],
+            has_anchor=self.has_anchor[rows],
+            anchor_lat=self.anchor_lat[rows],
+            anchor_lng=self.anchor_lng[rows],
+        )
+
+    def query_code(self, key: str, value: Any) -> int:
+        if not value:
+            return _MISSING
+        return self.vocab[key].get(_hashable(value), _UNKNOWN)
+
+
+def _subscore(
+    key: str,
+    a: Dict,
+    pool: PoolCodes,
+    rows: Optional[np.ndarray],
+    plan: ScoringPlan,
+    anchor_km: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """One subscore column of ``a`` against ``pool`` (or the given rows of it)."""
+    n = len(pool) if rows is None else len(rows)
+
+    def col(arr: np.ndarray) -> np.ndarray:
+        return arr if rows is None else arr[rows]
+
+    if key in _CATEGORICAL_FIELDS:
+        code = pool.query_code(key, a.get(_CATEGORICAL_FIELDS[key]))
+        hit = col(pool.codes[key]) == code if code != _MISSING else np.zeros(n, dtype=bool)
+    elif key == "budget":
+        ab = as_int(a.get("budget_pkr"))
+        if ab:
+            win = max(2000, int(0.2 * ab))
+            bb = col(pool.budget)
+            hit = (bb != 0) & (np.abs(ab - bb) <= win)
+        else:
+            hit = np.zeros(n, dtype=bool)
+    elif key == "study":
+        study = a.get("study_habits")
+        if study:
+            hit = col(pool.has_study) & (
+                (col(pool.study_library) & _contains(study, "library"))
+                | (col(pool.study_home) & _contains(study, "home"))
+            )
+        else:
+            hit = np.zeros(n, dtype=bool)
+    else:  # anchor
+        anchor = np.zeros(n, dtype=np.int64)
+        if a.get("anchor_location"):
+            if anchor_km is not None:
+                d = col(anchor_km)
+            else:
+                d = distances_from(a["anchor_location"], col(pool.anchor_lat), col(pool.anchor_lng))
+            if len(plan.anchor_thresholds):
+                # First bucket (in config order) whose threshold covers the distance.
+                within = d[:, None] <= plan.anchor_thresholds[None, :]
+                hit = col(pool.has_anchor) & within.any(axis=1)
+                anchor[hit] = plan.anchor_points[within[hit].argmax(axis=1)]
+        return anchor
+    return np.where(hit, plan.weight(key), 0)
+
+
+def score_many(
+    a: Dict,
+    pool: Union[PoolCodes, Sequence[Dict]],
+    config: Union[MatchScoreConfig, ScoringPlan, None] = None,
+    subscores: bool = False,
+    anchor_km: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Vectorized :func:`score_pair` totals of ``a`` against every profile in ``pool``.
+
+    Returns ``(totals, matrix)`` where ``matrix`` (only when ``subscores=True``)
+    has one column per :data:`SUBSCORE_KEYS` entry.  Totals equal
+    ``score_pair(a, b)[0]`` for every row; reasons are left to ``score_pair``
+    for the handful of rows that are actually returned.  ``anchor_km`` may
+    carry precomputed anchor distances, one per pool row.
+    """
+    plan = compile_config(config)
+    if not isinstance(pool, PoolCodes):
+        pool = PoolCodes.encode(pool)
+    return _score_rows(a, pool, None, plan, subscores, anchor_km)
+
+
+def _score_rows(
+    a: Dict,
+    pool: PoolCodes,
+    rows: Optional[np.ndarray],
+    plan: ScoringPlan,
+    subscores: bool = False,
+    anchor_km: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    values = {key: _subscore(key, a, pool, rows, plan, anchor_km) for key in SUBSCORE_KEYS}
+
+    # Sum in score_pair's dict order so float weights tie-break identically.
+    n = len(pool) if rows is None else len(rows)
+    totals = np.zeros(n, dtype=np.result_type(*[v.dtype for v in values.values()]))
+    for key in plan.sum_order:
+        totals = totals + values[key]
+
+    matrix = np.stack([values[k] for k in SUBSCORE_KEYS], axis=1) if subscores else None
+    return totals, matrix
+
+
+def top_k_many(
+    a: Dict,
+    pool: Union[PoolCodes, Sequence[Dict]],
+    k: int,
+    config: Union[MatchScoreConfig, ScoringPlan, None] = None,
+    anchor_km: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Positions of the ``k`` best rows of ``pool``, identical to a stable sort of :func:`score_many`.
+
+    Subscores are evaluated heaviest first.  After each one, a row whose
+    partial score plus the maximum still obtainable falls below the running
+    k-th best partial score can no longer make the cut and is dropped, so the
+    light subscores (and the anchor distance) only run for real contenders.
+    """
+    plan = compile_config(config)
+    if not isinstance(pool, PoolCodes):
+        pool = PoolCodes.encode(pool)
+    n = len(pool)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Bounds need non-negative subscores; anything else takes the exhaustive path.
+    if not plan.nonnegative:
+        totals, _ = _score_rows(a, pool, None, plan, anchor_km=anchor_km)
+        return top_k_indices(totals, k)
+
+    ceilings = plan.ceilings
+    remaining = sum(ceilings.values())
+    # Absorbs float rounding in the partial sums; zero for integer weights.
+    slack = 1e-9 * max(remaining, 1)
+    alive = np.arange(n)
+    partial = np.zeros(n)
+    for key in sorted(SUBSCORE_KEYS, key=lambda key: -ceilings[key]):
+        partial = partial + _subscore(key, a, pool, alive, plan, anchor_km)
+        remaining -= ceilings[key]
+        if len(alive) > k:
+            kth_best = np.partition(partial, len(partial) - k)[len(partial) - k]
+            keep = partial + remaining >= kth_best - slack
+            alive, partial = alive[keep], partial[keep]
+
+    # Exact totals (score_pair summation order) for the survivors only.
+    totals, _ = _score_rows(a, pool, alive, plan, anchor_km=anchor_km)
+    return alive[top_k_indices(totals, k)]
@@ -168,7 +168,21 @@ def _pick_budget(p: Dict) -> int | None:
             return as_int(p.get(k))
     return None
 
+class NormalizedProfile(dict):
+    """A profile dict already produced by :func:`normalize_profile`.
+
+    The data layer normalizes every document once; passing the result back
+    through :func:`normalize_profile` is then a no-op instead of a rebuild.
+    Treat instances as read-only – they are shared by the cached snapshot.
+    """
+
+    __slots__ = ()
+
+
 def normalize_profile(p: Dict[str, Any]) -> Dict[str, Any]:
+    if isinstance(p, NormalizedProfile):
+        return p
+
     sleep = _norm_enum(p.get("sleep_schedule"), _SLEEP_MAP)
     clean = _norm_enum(p.get("cleanliness"), _CLEAN_MAP)
     noise = _norm_enum(p.get("noise_tolerance"), _NOISE_MAP)
@@ -227,7 +241,7 @@ def normalize_profile(p: Dict[str, Any]) -> Dict[str, Any]:
         "geo": geo,
         "raw_text": raw_text,
     }
-    return out
+    return NormalizedProfile(out)
 
 
 def _optional_hook(name: str):
@@ -94,8 +94,11 @@
 #     return flags
 
 # app/agents/red_flag.py
-from typing import Dict, List, Any
-from math import radians, sin, cos, sqrt, atan2
+from dataclasses import dataclass
+from typing import Dict, List, Any, Callable, Iterable, Optional, Sequence, Tuple
+
+from ..utils.context import PipelineContext
+from ..utils.geo import haversine_km
 
 COMMUTE_COST_PER_KM = 40  # Rough PKR cost per km (one-way) for daily commute
 
@@ -108,151 +111,219 @@ def _score_gap(a: Dict, b: Dict, key: str) -> int:
         return 0
     return 0 if va == vb else 2
 
-def _budget_gap(a: Dict, b: Dict) -> float:
-    try:
-        qa = float(a.get("budget_pkr") or 0)
-        qb = float(b.get("budget_pkr") or 0)
-        if not qa or not qb:
-            return 0.0
-        return abs(qa - qb) / max(qa, qb)
-    except Exception:
+def _gap_ratio(qa: Optional[float], qb: Optional[float]) -> float:
+    """Relative gap of two parsed budgets; 0 when either is missing or unparseable."""
+    if not qa or not qb:
         return 0.0
+    return abs(qa - qb) / max(qa, qb)
+
+# ---------------- Rule table ----------------
+_EARLY = frozenset(("early_bird", "early riser"))
+_OFTEN = frozenset(("often", "daily", "frequent", "always"))
+_ROLE_LABELS = {"student": "student", "professional": "working professional"}
+
+# Study-text keyword bits; a clash needs both words of a pair across the two profiles.
+_STUDY_WORDS = ("late", "early", "group", "quiet")
+_STUDY_CLASHES = (1 | 2, 4 | 8)
+
+
+@dataclass(frozen=True)
+class FlagFields:
+    """The handful of fields the rules read, normalized once per profile."""
+
+    smoking: str
+    early: bool                      # early sleeper
+    often: bool                      # frequent guests
+    noise: str
+    cleanliness: str
+    study: int                       # _STUDY_WORDS bitmask
+    role: str
+    budget: Optional[float]          # None when unparseable
+    anchor: Optional[Dict[str, Any]]
+    anchor_city: Optional[str]       # first label segment, when labelled
+
+    @classmethod
+    def encode(cls, p: Dict[str, Any]) -> "FlagFields":
+        p = p or {}
+        study = _norm(p.get("study_habits"))
+        try:
+            budget: Optional[float] = float(p.get("budget_pkr") or 0)
+        except Exception:
+            budget = None
+        anchor = p.get("anchor_location")
+        if not isinstance(anchor, dict):
+            anchor = None
+        return cls(
+            smoking=_norm(p.get("smoking")),
+            early=_norm(p.get("sleep_schedule")) in _EARLY,
+            often=_norm(p.get("guests_freq")) in _OFTEN,
+            noise=_norm(p.get("noise_tolerance")),
+            cleanliness=_norm(p.get("cleanliness")),
+            study=sum(1 << i for i, word in enumerate(_STUDY_WORDS) if word in study),
+            role=_norm(p.get("role")),
+            budget=budget,
+            anchor=anchor,
+            anchor_city=anchor["label"].split(",")[0].strip().lower() if anchor and anchor.get("label") else None,
+        )
+
+
+class _Pair:
+    """One seeker/candidate pair; derived numbers are computed at most once."""
+
+    __slots__ = ("a", "b", "_gap", "_distance", "_measure")
+
+    def __init__(self, a: FlagFields, b: FlagFields, measure: Optional[Callable[[], float]] = None):
+        self.a, self.b = a, b
+        self._gap: Optional[float] = None
+        self._distance: Optional[float] = None
+        self._measure = measure
+
+    @property
+    def gap(self) -> float:
+        if self._gap is None:
+            self._gap = _gap_ratio(self.a.budget, self.b.budget)
+        return self._gap
+
+    @property
+    def distance(self) -> float:
+        if self._distance is None:
+            if self._measure is not None:
+                self._distance = self._measure()
+            else:
+                self._distance = haversine_km(self.a.anchor, self.b.anchor)
+        return self._distance
+
+    def labels(self) -> Tuple[str, str]:
+        return _anchor_label(self.a.anchor), _anchor_label(self.b.anchor)
+
+    def commute_cost(self) -> int:
+        # Two-way commute estimate (there and back)
+        return int(max(self.distance, 0) * 2 * COMMUTE_COST_PER_KM)
+
+
+def _anchor_label(anchor: Dict[str, Any]) -> str:
+    return anchor.get("label") or anchor.get("name") or "their anchor"
+
+
+def _opposed(x: str, y: str, one: str, other: str) -> bool:
+    return (x == one and y == other) or (x == other and y == one)
+
+
+def _anchored(p: _Pair) -> bool:
+    return p.a.anchor is not None and p.b.anchor is not None
+
+
+def _commute_notice(p: _Pair) -> str:
+    label_a, label_b = p.labels()
+    return f"Commute between {label_a} and {label_b} is ~{int(p.distance)} km (≈PKR {p.commute_cost()} / day)"
+
+
+def _commute_heavy(p: _Pair) -> str:
+    label_a, label_b = p.labels()
+    return f"Lengthy commute: {label_a} ↔ {label_b} ~{int(p.distance)} km (≈PKR {p.commute_cost()} / day)"
+
+
+def _too_far(p: _Pair) -> str:
+    label_a, label_b = p.labels()
+    return f"Anchors {label_a} and {label_b} are {int(p.distance)} km apart (≈PKR {p.commute_cost()} / day)"
+
+
+@dataclass(frozen=True)
+class FlagRule:
+    code: str                              # the flag's ``type``
+    severity: str
+    applies: Callable[[_Pair], bool]
+    details: Callable[[_Pair], str]
+
+
+# Evaluated in order; emitted flags keep this order.
+FLAG_RULES: Tuple[FlagRule, ...] = (
+    FlagRule(
+        "smoking_clash", "high",
+        lambda p: _opposed(p.a.smoking, p.b.smoking, "no", "yes"),
+        lambda p: "One smokes, the other does not",
+    ),
+    FlagRule(
+        "sleep_vs_guests", "medium",
+        lambda p: (p.a.early or p.b.early) and (p.a.often or p.b.often),
+        lambda p: "Early riser with frequent hosting",
+    ),
+    FlagRule(
+        "noise_mismatch", "medium",
+        lambda p: _opposed(p.a.noise, p.b.noise, "low", "high"),
+        lambda p: "Low noise tolerance vs high noise preference",
+    ),
+    FlagRule(
+        "cleanliness_mismatch", "medium",
+        lambda p: _opposed(p.a.cleanliness, p.b.cleanliness, "high", "low"),
+        lambda p: "High vs low cleanliness preference",
+    ),
+    FlagRule(
+        "study_routine_clash", "low",
+        lambda p: any((p.a.study | p.b.study) & clash == clash for clash in _STUDY_CLASHES),
+        lambda p: "Different study routines",
+    ),
+    FlagRule(
+        "role_lifestyle_gap", "medium",
+        lambda p: bool(p.a.role and p.b.role and p.a.role != p.b.role),
+        lambda p: f"Different routines: {_ROLE_LABELS.get(p.a.role, p.a.role)} vs {_ROLE_LABELS.get(p.b.role, p.b.role)}",
+    ),
+    FlagRule(
+        "budget_gap", "low",
+        lambda p: p.gap > 0.35,
+        lambda p: f"Budget gap ~{int(p.gap*100)}%",
+    ),
+    FlagRule(
+        "anchor_city_mismatch", "high",
+        lambda p: bool(p.a.anchor_city and p.b.anchor_city and p.a.anchor_city != p.b.anchor_city),
+        lambda p: f"Different anchor cities: {p.a.anchor['label']} vs {p.b.anchor['label']}",
+    ),
+    # Anchors within 10 km are considered fine and raise no flag.
+    FlagRule("anchor_commute_notice", "low", lambda p: _anchored(p) and 10 < p.distance <= 25, _commute_notice),
+    FlagRule("anchor_commute_heavy", "medium", lambda p: _anchored(p) and 25 < p.distance <= 50, _commute_heavy),
+    FlagRule("anchor_too_far", "high", lambda p: _anchored(p) and p.distance > 50, _too_far),
+)
+
+_RULES_BY_CODE: Dict[str, FlagRule] = {rule.code: rule for rule in FLAG_RULES}
+
+
+def _flag(rule: FlagRule, pair: _Pair) -> Dict[str, str]:
+    return {"type": rule.code, "severity": rule.severity, "details": rule.details(pair)}
+
+
+def _measure(ctx: Optional[PipelineContext], a: Dict, b: Dict) -> Optional[Callable[[], float]]:
+    return (lambda: ctx.pair_km(a, b)) if ctx is not None else None
+
+
+def red_flag_codes(
+    a: Dict, pool: Sequence[Dict], ctx: Optional[PipelineContext] = None
+) -> List[Tuple[str, ...]]:
+    """Flag codes of ``a`` against every profile in ``pool``; details are not rendered.
+
+    The batch entry point for callers that need flags for a whole pool (e.g.
+    to filter on them before ranking): the seeker is encoded once and no
+    detail strings are built.  ``run_pipeline`` flags only the returned
+    matches, so it calls :func:`red_flags` per match instead.
+    """
+    seeker = FlagFields.encode(a)
+    out = []
+    for b in pool:
+        pair = _Pair(seeker, FlagFields.encode(b), _measure(ctx, a, b))
+        out.append(tuple(rule.code for rule in FLAG_RULES if rule.applies(pair)))
+    return out
+
+
+def render_flags(
+    a: Dict, b: Dict, codes: Iterable[str], ctx: Optional[PipelineContext] = None
+) -> List[Dict[str, str]]:
+    """Expand codes from :func:`red_flag_codes` into ``{type, severity, details}`` dicts."""
+    pair = _Pair(FlagFields.encode(a), FlagFields.encode(b), _measure(ctx, a, b))
+    return [_flag(_RULES_BY_CODE[code], pair) for code in codes]
+
 
-def haversine_km(loc1: Dict, loc2: Dict) -> float:
-    try:
-        lat1, lon1 = float(loc1["lat"]), float(loc1["lng"])
-        lat2, lon2 = float(loc2["lat"]), float(loc2["lng"])
-    except Exception:
-        return 9999
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
-
-def red_flags(a: Dict, b: Dict) -> List[Dict[str, str]]:
+def red_flags(a: Dict, b: Dict, ctx: Optional[PipelineContext] = None) -> List[Dict[str, str]]:
     """
     Return a list of conflicts: [{type, severity, details}, ...]
     """
-    A = {k: _norm(v) for k, v in (a or {}).items()}
-    B = {k: _norm(v) for k, v in (b or {}).items()}
-    flags: List[Dict[str, str]] = []
-
-    def _role_label(role_key: str) -> str:
-        mapping = {
-            "student": "student",
-            "professional": "working professional",
-        }
-        return mapping.get(role_key, role_key or "")
-
-    # --- Smoking clash ---
-    if A.get("smoking") and B.get("smoking"):
-        if (A["smoking"] == "no" and B["smoking"] == "yes") or (A["smoking"] == "yes" and B["smoking"] == "no"):
-            flags.append({
-                "type": "smoking_clash",
-                "severity": "high",
-                "details": "One smokes, the other does not"
-            })
-
-    # --- Sleep vs guests / noise ---
-    sleep_pair = (A.get("sleep_schedule"), B.get("sleep_schedule"))
-    guests_pair = (A.get("guests_freq"), B.get("guests_freq"))
-    noise_pair  = (A.get("noise_tolerance"), B.get("noise_tolerance"))
-
-    def _often(x: str) -> bool:
-        return x in ("often", "daily", "frequent", "always")
-
-    if any(s in ("early_bird", "early riser") for s in sleep_pair) and any(_often(g) for g in guests_pair):
-        flags.append({
-            "type": "sleep_vs_guests",
-            "severity": "medium",
-            "details": "Early riser with frequent hosting"
-        })
-
-    if {"low", "high"} <= set([noise_pair[0] or "", noise_pair[1] or ""]):
-        flags.append({
-            "type": "noise_mismatch",
-            "severity": "medium",
-            "details": "Low noise tolerance vs high noise preference"
-        })
-
-    clean_pair = (A.get("cleanliness"), B.get("cleanliness"))
-    if {"high", "low"} <= set([clean_pair[0] or "", clean_pair[1] or ""]):
-        flags.append({
-            "type": "cleanliness_mismatch",
-            "severity": "medium",
-            "details": "High vs low cleanliness preference"
-        })
-
-    study_pair = (A.get("study_habits"), B.get("study_habits"))
-    study_txt = " / ".join([x for x in study_pair if x])
-    if ("late" in study_txt and "early" in study_txt) or ("group" in study_txt and "quiet" in study_txt):
-        flags.append({
-            "type": "study_routine_clash",
-            "severity": "low",
-            "details": "Different study routines"
-        })
-
-    # --- Role lifestyle gap (e.g., student vs professional) ---
-    role_a, role_b = A.get("role"), B.get("role")
-    if role_a and role_b and role_a != role_b:
-        flags.append({
-            "type": "role_lifestyle_gap",
-            "severity": "medium",
-            "details": f"Different routines: {_role_label(role_a)} vs {_role_label(role_b)}"
-        })
-
-    gap = _budget_gap(a, b)
-    if gap > 0.35:
-        flags.append({
-            "type": "budget_gap",
-            "severity": "low",
-            "details": f"Budget gap ~{int(gap*100)}%"
-        })
-
-    # --- Anchor conflicts ---
-    a_anchor, b_anchor = a.get("anchor_location"), b.get("anchor_location")
-    if isinstance(a_anchor, dict) and isinstance(b_anchor, dict):
-        def _label(anchor: Dict[str, Any]) -> str:
-            return anchor.get("label") or anchor.get("name") or "their anchor"
-
-        label_a = _label(a_anchor)
-        label_b = _label(b_anchor)
-
-        # Different cities in anchor labels
-        if a_anchor.get("label") and b_anchor.get("label"):
-            if a_anchor["label"].split(",")[0].strip().lower() != b_anchor["label"].split(",")[0].strip().lower():
-                flags.append({
-                    "type": "anchor_city_mismatch",
-                    "severity": "high",
-                    "details": f"Different anchor cities: {a_anchor['label']} vs {b_anchor['label']}"
-                })
-
-        def _commute_cost(distance_km: float) -> int:
-            # Two-way commute estimate (there and back)
-            return int(max(distance_km, 0) * 2 * COMMUTE_COST_PER_KM)
-
-        d = haversine_km(a_anchor, b_anchor)
-        if d > 0 and d <= 10:
-            pass  # Considered fine, no flag
-        elif 10 < d <= 25:
-            flags.append({
-                "type": "anchor_commute_notice",
-                "severity": "low",
-                "details": f"Commute between {label_a} and {label_b} is ~{int(d)} km (≈PKR {_commute_cost(d)} / day)"
-            })
-        elif 25 < d <= 50:
-            flags.append({
-                "type": "anchor_commute_heavy",
-                "severity": "medium",
-                "details": f"Lengthy commute: {label_a} ↔ {label_b} ~{int(d)} km (≈PKR {_commute_cost(d)} / day)"
-            })
-        elif d > 50:
-            flags.append({
-                "type": "anchor_too_far",
-                "severity": "high",
-                "details": f"Anchors {label_a} and {label_b} are {int(d)} km apart (≈PKR {_commute_cost(d)} / day)"
-            })
-
-    return flags
+    pair = _Pair(FlagFields.encode(a), FlagFields.encode(b), _measure(ctx, a, b))
+    return [_flag(rule, pair) for rule in FLAG_RULES if rule.applies(pair)]
@@ -76,12 +76,17 @@
 #         return pass1[:min(top_n, TOP_N_DEGRADED)], meta
 
 # app/agents/retrieval.py
-from typing import List, Dict, Tuple, Optional
+from typing import Callable, List, Dict, Tuple, Optional
 import os
-from math import radians, sin, cos, sqrt, atan2
 from dataclasses import dataclass
 
-from ..utils.keyword_filter import normalize_city
+import numpy as np
+
+from ..services.profile_index import ProfileIndex, pct_diff_many
+from ..utils.context import PipelineContext
+from ..utils.geo import haversine_km  # noqa: F401  (re-exported)
+from ..utils.keyword_filter import CITY_MAP, normalize_city
+from ..utils.topk import top_k_lexsort
 
 TOP_N_ONLINE = 120
 TOP_N_DEGRADED = 120          # pull a lot, then scorer sorts
@@ -137,31 +142,38 @@ def budget_close(a, b, tol):
         return True
     return _pct_diff(a, b) <= tol
 
-def haversine_km(loc1: Dict, loc2: Dict) -> float:
-    try:
-        lat1, lon1 = float(loc1["lat"]), float(loc1["lng"])
-        lat2, lon2 = float(loc2["lat"]), float(loc2["lng"])
-    except Exception:
-        return 9999
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
 
 class CandidateRetrieval:
     def __init__(self, datastore, config: Optional[RetrievalConfig] = None):
         self.ds = datastore
         self.config = config or _ACTIVE_RETRIEVAL_CONFIG
+        self._index: Optional[ProfileIndex] = None
+
+    @property
+    def index(self) -> ProfileIndex:
+        """The datastore's prebuilt index, or one built from its profiles on first use."""
+        if self._index is None:
+            index = getattr(self.ds, "profile_index", None)
+            self._index = index if index is not None else ProfileIndex.build(self.ds.fetch_all_profiles())
+        return self._index
+
+    def retrieve(
+        self, query: Dict, top_n: int = 50, mode: str = None, ctx: Optional[PipelineContext] = None
+    ) -> Tuple[List[Dict], Dict]:
+        """Returns (candidates, meta)."""
+        rows, meta = self.retrieve_rows(query, top_n=top_n, mode=mode, ctx=ctx)
+        return self.index.take(rows), meta
 
-    def _p_budget(self, p: Dict):
-        return p.get("budget_pkr") or p.get("budget_PKR") or p.get("budget")
+    def retrieve_rows(
+        self, query: Dict, top_n: int = 50, mode: str = None, ctx: Optional[PipelineContext] = None
+    ) -> Tuple[np.ndarray, Dict]:
+        """Like :meth:`retrieve` but returns rows of :attr:`index` instead of profile dicts.
 
-    def retrieve(self, query: Dict, top_n: int = 50, mode: str = None) -> Tuple[List[Dict], Dict]:
-        """Returns (candidates, meta)."""
+        With a ``ctx``, the anchor distances measured here are remembered for
+        the later pipeline stages.
+        """
         mode = (mode or os.getenv("MODE", "degraded")).lower()
-        profiles = list(self.ds.fetch_all_profiles())
+        index = self.index
         meta = {"method": "degraded_keyword"}
 
         q_city = normalize_city(query.get("city") or "")
@@ -174,63 +186,173 @@ class CandidateRetrieval:
             meta["method"] = "faiss"
             try:
                 ids = self.ds.faiss_search(query, k=TOP_N_ONLINE)
-                cands = [p for p in profiles if p.get("id") in ids]
-                return cands[:top_n], meta
+                rows = index.rows_for_ids(ids)
+                if rows.size:
+                    return rows[:top_n], meta
+                meta["fallback"] = "faiss_empty"
             except Exception as e:
                 meta["fallback"] = f"faiss_error:{e}"
 
         # ---------------- Degraded mode ----------------
-        pass1 = []
-        for p in profiles:
-            pc = normalize_city(p.get("city") or "")
-            pb = self._p_budget(p)
-            prole = p.get("role")
-            panchor = p.get("anchor_location")
-
-            # City + budget filter
-            if q_city and pc == q_city and budget_close(q_budget, pb, tol=self.config.budget_tol):
-                # Role check (prefer same role)
-                if not q_role or (q_role and prole == q_role):
-                    # Anchor proximity check
-                    if q_anchor and panchor:
-                        d = haversine_km(q_anchor, panchor)
-                        if d <= self.config.anchor_dist_km:
-                            pass1.append(p)
-                        else:
-                            continue
-                    else:
-                        pass1.append(p)
+        # Every pass resolves through the (city, role) buckets and their
+        # budget-sorted windows; no pass evaluates a predicate per profile.
+        n = len(index)
+        tol = self.config.budget_tol
+        city_code = index.city_code(q_city)
+        role_code = index.role_code(q_role)
+
+        # One grid lookup answers both the proximity filter and the rank bonus:
+        # anything anchored outside this radius fails the filter and earns no bonus.
+        anchor_radius = max([self.config.anchor_dist_km] + [t for t, _ in self.config.anchor_bonus_steps])
+
+        # City + budget filter, prefer same role, then anchor proximity
+        rows = np.zeros(0, dtype=np.int64)
+        dist = None
+        if q_city:
+            rows = index.budget_window(q_budget, tol, city_code, role_code if q_role else None)
+            if q_anchor and rows.size:
+                dist = index.anchor_distances(q_anchor, rows, anchor_radius)
+                keep = ~index.has_anchor[rows] | (dist <= self.config.anchor_dist_km)
+                rows, dist = rows[keep], dist[keep]
 
         # Broaden if nothing found
-        if not pass1:
-            pass2 = []
-            for p in profiles:
-                pc = normalize_city(p.get("city") or "")
-                pb = self._p_budget(p)
-                if (q_city and pc == q_city) or budget_close(q_budget, pb, tol=self.config.budget_tol):
-                    pass2.append(p)
-            if pass2:
+        if not rows.size:
+            dist = None
+            city_rows = index.city_rows(city_code) if q_city else rows
+            rows = np.union1d(city_rows, index.budget_window(q_budget, tol))
+            if rows.size:
                 meta["fallback"] = "broadened_city_or_budget"
-                pass1 = pass2
 
         # Last resort
-        if not pass1:
+        if not rows.size:
             meta["fallback"] = "pool_any"
-            pass1 = profiles[:TOP_N_DEGRADED]
+            rows = np.arange(min(n, TOP_N_DEGRADED))
 
         # ---------------- Ranking ----------------
-        def rank_key(p):
-            city_score = self.config.city_boost if (q_city and normalize_city(p.get("city") or "") == q_city) else 0.0
-            bud_pen = _pct_diff(q_budget, self._p_budget(p))
-            role_bonus = 0.5 if (q_role and p.get("role") == q_role) else 0.0
-            anchor_bonus = 0.0
-            if q_anchor and p.get("anchor_location"):
-                d = haversine_km(q_anchor, p["anchor_location"])
-                for threshold, bonus in self.config.anchor_bonus_steps:
-                    if d <= threshold:
-                        anchor_bonus = bonus
-                        break
-            return (city_score + role_bonus + anchor_bonus, -bud_pen)
-
-        pass1.sort(key=rank_key, reverse=True)
-        return pass1[:min(top_n, TOP_N_DEGRADED)], meta
+        same_city = index.city[rows] == city_code if q_city else np.zeros(rows.size, dtype=bool)
+        city_score = np.where(same_city, self.config.city_boost, 0.0)
+        role_bonus = np.where(index.role[rows] == role_code, 0.5, 0.0) if q_role else 0.0
+        anchor_bonus = np.zeros(rows.size)
+        if q_anchor:
+            if dist is None:
+                dist = index.anchor_distances(q_anchor, rows, anchor_radius)
+            if ctx is not None:
+                near = np.isfinite(dist)
+                ctx.remember(
+                    ctx.key(query, "anchor_location"),
+                    [ctx.key(index.profiles[r], "anchor_location") for r in rows[near].tolist()],
+                    dist[near],
+                )
+            pending = index.has_anchor[rows].copy()
+            for threshold, bonus in self.config.anchor_bonus_steps:
+                hit = pending & (dist <= threshold)
+                anchor_bonus[hit] = bonus
+                pending &= ~hit
+        score = city_score + role_bonus + anchor_bonus
+        bud_pen = pct_diff_many(q_budget, index.budget[rows]) if q_budget else np.ones(rows.size)
+
+        # Highest score first, smallest budget gap next, snapshot order on ties
+        order = top_k_lexsort((rows, bud_pen, -score), min(top_n, TOP_N_DEGRADED))
+        return rows[order], meta
+
+
+# ---------------- Firestore pushdown ----------------
+PUSHDOWN_LIMIT = int(os.getenv("RETRIEVAL_PUSHDOWN_LIMIT", "500"))   # rows per pushed-down query
+
+Filters = List[Tuple[str, str, object]]
+Query = Tuple[Filters, bool, int]   # filters, range field ordered descending, row limit
+
+
+def city_spellings(city: str) -> List[str]:
+    """Stored spellings that :func:`normalize_city` maps to ``city`` (for an ``in`` filter)."""
+    names = {city} | {k for k, v in CITY_MAP.items() if v == city}
+    return sorted({form for name in names for form in (name, name.title(), name.upper())})
+
+
+class PushdownRetrieval(CandidateRetrieval):
+    """:class:`CandidateRetrieval` over profiles fetched with the query's own predicates.
+
+    Instead of the whole collection, each retrieval pass is sent to Firestore
+    as an indexed query (city ``in`` its spellings, ``budget_pkr`` range)
+    capped at ``limit`` rows.  The usual in-memory passes then run on what
+    came back, so ranking and fallbacks behave as before; a broader query is
+    only issued when the narrower one leaves nothing to return.
+
+    A range filter makes Firestore order by ``budget_pkr``, so a capped
+    window would keep its cheapest rows.  The window is instead queried as
+    two halves sorted away from the query budget (``>= q`` ascending,
+    ``< q`` descending), each capped at ``limit // 2``: what the cap drops
+    is always the rows with the largest budget gap.
+
+    Role is left to the in-memory pass, which compares normalized roles:
+    every stored spelling of a role in every casing, times the city
+    spellings, is more than the 30 disjunctions Firestore allows per query.
+
+    Pushdown can only match stored values: a profile is found through its
+    city when the stored spelling is one ``CITY_MAP`` knows, and through its
+    budget only when ``budget_pkr`` is stored as a number.  Profiles without
+    one (which the in-memory window treats as "close") are therefore only
+    reached through the city passes.
+    """
+
+    def __init__(
+        self,
+        query_profiles: Optional[Callable[..., List[Tuple[str, Dict]]]] = None,
+        config: Optional[RetrievalConfig] = None,
+        limit: int = PUSHDOWN_LIMIT,
+    ):
+        super().__init__(datastore=None, config=config)
+        if query_profiles is None:
+            from ..services.firestore import query_profiles
+        self.query_profiles = query_profiles
+        self.limit = limit
+        self.queries = 0
+
+    def _passes(self, query: Dict) -> List[List[Query]]:
+        q_city = normalize_city(query.get("city") or "")
+        q_budget = query.get("budget_pkr")
+        tol = self.config.budget_tol
+        has_budget = isinstance(q_budget, (int, float)) and q_budget > 0
+        city: Filters = [("city", "in", city_spellings(q_city))] if q_city else []
+
+        def around_budget(extra: Filters) -> List[Query]:
+            half = max(1, self.limit // 2)
+            above = extra + [("budget_pkr", ">=", q_budget)]
+            if tol < 1.0:
+                above.append(("budget_pkr", "<=", q_budget / (1.0 - tol)))
+            below = extra + [("budget_pkr", ">=", q_budget * (1.0 - tol)), ("budget_pkr", "<", q_budget)]
+            return [(above, False, half), (below, True, half)]
+
+        passes: List[List[Query]] = []
+        if q_city:
+            passes.append(around_budget(city) if has_budget else [(city, False, self.limit)])
+        if has_budget:
+            # Broadened: same city or close budget.
+            passes.append(([(city, False, self.limit)] if q_city else []) + around_budget([]))
+        else:
+            # Without a budget every profile counts as close, as in ``budget_window``.
+            passes.append([([], False, self.limit)])
+        passes.append([([], False, self.limit)])             # last resort: any profiles
+        return passes
+
+    def retrieve_rows(
+        self, query: Dict, top_n: int = 50, mode: str = None, ctx: Optional[PipelineContext] = None
+    ) -> Tuple[np.ndarray, Dict]:
+        docs: Dict[str, Dict] = {}
+        passes = self._passes(query)
+        for level, queries in enumerate(passes):
+            for filters, descending, limit in queries:
+                self.queries += 1
+                docs.update(self.query_profiles(filters, limit, descending=descending))
+            # Document-id order matches a full collection scan.
+            self._index = ProfileIndex.build([docs[k] for k in sorted(docs)])
+            rows, meta = super().retrieve_rows(query, top_n=top_n, mode=mode, ctx=ctx)
+            fallback = meta.get("fallback")
+            if not fallback or level == len(passes) - 1:
+                break
+            if fallback == "broadened_city_or_budget" and level == len(passes) - 2:
+                break
+        meta["method"] = "firestore_pushdown"
+        meta["pushdown_queries"] = self.queries
+        meta["pushdown_rows"] = len(self.index)
+        return rows, meta
@@ -55,100 +55,209 @@
 
 
 # app/agents/room_hunter.py
-from typing import List, Dict, Any, Optional
-from math import radians, sin, cos, sqrt, atan2
+import os
+from typing import List, Dict, Any, Optional, Union
+
+import numpy as np
+
+from ..services.listing_index import ListingIndex, listing_city, normalize_amenities
+from ..utils.context import PipelineContext
+from ..utils.geo import coords, distances_from
 from ..utils.num import as_int
+from ..utils.topk import top_k_indices
 
-def _city(s: str) -> str:
-    return (s or "").strip().lower()
-
-def _is_available(L: Dict) -> bool:
-    """Check listing status + rooms availability."""
-    status = (L.get("availability") or L.get("status") or "available").strip().lower()
-    if status in ("unavailable", "occupied", "closed", "false", "0", "no"):
-        return False
-    if L.get("rooms_available") is not None and as_int(L.get("rooms_available")) <= 0:
-        return False
-    return True
-
-def _rent_val(L: Dict) -> int:
-    for k in ("monthly_rent_PKR", "rent_pkr", "rent", "price_pkr", "price"):
-        if k in L and L[k] is not None:
-            return as_int(L[k])
-    return 0
-
-def _haversine_km(loc1: Dict, loc2: Dict) -> float:
-    try:
-        lat1, lon1 = float(loc1["lat"]), float(loc1["lng"])
-        lat2, lon2 = float(loc2["lat"]), float(loc2["lng"])
-    except Exception:
-        return 9999
-    R = 6371.0
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1-a))
-    return R * c
-
-def rank_rooms(q: Dict, listings: List[Dict[str, Any]], k: int = 3) -> List[Dict]:
-    qcity = _city(q.get("city"))
+Listings = Union[List[Dict[str, Any]], ListingIndex]
+
+
+def _as_index(listings: Optional[Listings]) -> ListingIndex:
+    if isinstance(listings, ListingIndex):
+        return listings
+    return ListingIndex.build(listings or [])
+
+
+def _candidates(q: Dict, index: ListingIndex) -> np.ndarray:
+    """Positions of available listings inside the query's city and rent window."""
+    qcity = listing_city(q.get("city"))
     qbud  = as_int(q.get("budget_pkr")) or 0
     qgeo  = q.get("geo") or q.get("anchor_location")
+    # The city guard only applies when there is no location to rank by.
+    return index.window(qcity if not qgeo else None, qbud)
+
 
-    scored = []
-    for L in listings or []:
-        if not _is_available(L):
-            continue
-        if qcity and not qgeo:
-            if _city(L.get("city")) != qcity:
-                continue
-
-        rent = _rent_val(L)
-        if qbud and rent > max(qbud * 2, qbud + 5000):
-            continue
-
-        am = L.get("amenities") or []
-        must = set()  # (future UI filters)
-        j = len(must & set(a.strip().lower() for a in am))
-
-        price_diff = abs(rent - (qbud * 2 if qbud else rent))
-        score = j * 10 - (price_diff / 1000.0)
-
-        # ---------------- Distance scoring ----------------
-        dist_km, eta_minutes = None, None
-        if qgeo and L.get("geo"):
-            dist_km = _haversine_km(qgeo, L["geo"])
-            score -= dist_km / 2.0  # penalize far rooms
-            # placeholder: eta_minutes will be filled by Maps Planner Agent
-            eta_minutes = None
+def _rank_mode(rank_mode: Optional[str]) -> str:
+    mode = (rank_mode or os.getenv("ROOM_RANK_MODE", "rules")).lower()
+    return mode if mode in ("rules", "learned") else "rules"
 
+
+def _learned_scores(q: Dict, listings: List[Dict]) -> Optional[np.ndarray]:
+    """Batched scores from the optional learned listing ranker; ``None`` keeps the rule score."""
+    try:
+        from app_patches.room_hunter_patch import score_listings  # type: ignore
+    except Exception:  # pragma: no cover - optional dependency
+        return None
+    try:
+        scores = score_listings(q, listings)
+    except Exception:
+        return None
+    if scores is None or len(scores) != len(listings) or not np.all(np.isfinite(scores)):
+        return None
+    return np.asarray(scores, dtype=float)
+
+
+def rank_rooms(
+    q: Dict,
+    listings: Listings,
+    k: int = 3,
+    ctx: Optional[PipelineContext] = None,
+    rank_mode: Optional[str] = None,
+) -> List[Dict]:
+    """Top ``k`` rooms for ``q`` from a listing list or a prebuilt :class:`ListingIndex`.
+
+    ``rank_mode="learned"`` (or ``ROOM_RANK_MODE=learned``) scores the
+    candidates with the ``app_patches`` listing ranker in one batched call and
+    falls back to the rule score when no model is available.
+    """
+    index = _as_index(listings)
+    return _rank_positions(q, index, _candidates(q, index), k, ctx, learned=_rank_mode(rank_mode) == "learned")
+
+
+def _rank_positions(
+    q: Dict,
+    index: ListingIndex,
+    positions: np.ndarray,
+    k: int,
+    ctx: Optional[PipelineContext],
+    learned: bool = False,
+) -> List[Dict]:
+    qbud  = as_int(q.get("budget_pkr")) or 0
+    qgeo  = q.get("geo") or q.get("anchor_location")
+    must = 0  # (future UI filters) amenity bitmask
+
+    rent = index.rent[positions]
+    price_diff = np.abs(rent - (qbud * 2 if qbud else rent))
+    if must:
+        masks = index.amenity_masks
+        overlap = np.asarray([(must & masks[p]).bit_count() for p in positions.tolist()], dtype=np.int64)
+    else:
+        overlap = np.zeros(len(positions), dtype=np.int64)   # no filter: skip the per-listing popcount
+    score = None
+    if learned and len(positions):
+        # The model sees no distance, so the distance penalty below still applies.
+        score = _learned_scores(q, [index.listings[p] for p in positions.tolist()])
+    bounded = score is None   # ring expansion relies on the rule score's ceiling
+    if score is None:
+        score = overlap * 10 - (price_diff / 1000.0)
+
+    # ---------------- Distance scoring ----------------
+    # NaN = listing without geo, which takes no distance penalty.
+    dist = np.full(len(positions), np.nan)
+    evaluated = np.ones(len(positions), dtype=bool)
+    if qgeo:
+        q_key = ctx.key(q, "geo" if q.get("geo") else "anchor_location") if ctx is not None else None
+        if bounded and coords(qgeo) is not None and index.geo_grid is not None and k > 0:
+            evaluated = _expand_rings(qgeo, index, positions, score, dist, k, must, ctx, q_key)
+        else:
+            with_geo = np.flatnonzero(index.has_geo[positions])
+            lats, lngs = index.geo_lat[positions[with_geo]], index.geo_lng[positions[with_geo]]
+            if ctx is not None:
+                keys = [ctx.key(index.listings[p], "geo", kind="listing") for p in positions[with_geo].tolist()]
+                dist[with_geo] = ctx.distances(q_key, qgeo, keys, lats, lngs)
+            else:
+                dist[with_geo] = distances_from(qgeo, lats, lngs)
+    has_dist = ~np.isnan(dist)
+    score[has_dist] -= dist[has_dist] / 2.0  # penalize far rooms
+
+    # Ties keep listing order: positions are ascending.
+    cand = np.flatnonzero(evaluated)
+    best = cand[top_k_indices(score[cand], k)]
+
+    out_rooms = []
+    for i in best.tolist():
+        p = int(positions[i])
+        L = index.listings[p]
+        j = int(overlap[i])
+        pd = int(price_diff[i])
         out = {
             "listing_id": L.get("listing_id") or L.get("id") or "-",
             "city": L.get("city"),
             "area": L.get("area"),
-            "monthly_rent_PKR": rent,
-            "amenities": am,
-            "why_match": f"{L.get('city')}, {L.get('area')} - {j} amenity overlap; rent delta {price_diff}",
+            "monthly_rent_PKR": int(rent[i]),
+            "amenities": L.get("amenities") or [],
+            "why_match": f"{L.get('city')}, {L.get('area')} - {j} amenity overlap; rent delta {pd}",
             "rooms_available": L.get("rooms_available", 1),
             "reserved_by": L.get("reserved_by", []),
             "geo": L.get("geo"),
         }
-
-        if dist_km is not None:
-            out["distance_km"] = round(dist_km, 1)
-            out["eta_minutes"] = eta_minutes  # placeholder for Maps Planner
-
-        scored.append((score, out))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    return [x[1] for x in scored[:k]]
+        if has_dist[i]:
+            out["distance_km"] = round(float(dist[i]), 1)
+            out["eta_minutes"] = None  # placeholder for Maps Planner
+        out_rooms.append(out)
+    return out_rooms
+
+
+# Ring expansion starts here and doubles until the top-k is settled.
+_RING_START_KM = 5.0
+_RING_MAX_KM = 20100.0   # beyond half the Earth's circumference: every point
+
+
+def _expand_rings(
+    qgeo: Dict,
+    index: ListingIndex,
+    positions: np.ndarray,
+    score: np.ndarray,
+    dist: np.ndarray,
+    k: int,
+    must: int,
+    ctx: Optional[PipelineContext],
+    q_key: Optional[str],
+) -> np.ndarray:
+    """Measure listings outward from ``qgeo`` until no unmeasured one can reach the top ``k``.
+
+    Fills ``dist`` for the listings it reaches and returns the mask of
+    positions to rank.  A listing beyond radius ``r`` scores below
+    ``10 * |must| - r / 2`` (the rent term is never positive), so once the
+    k-th best evaluated score clears that bound the rest cannot make the cut.
+    Listings without usable geo are always evaluated.
+    """
+    in_grid = index.has_geo[positions] & ~np.isnan(index.geo_lat[positions]) & ~np.isnan(index.geo_lng[positions])
+    # Listings carrying an unusable geo still take the 9999 km penalty.
+    bad_geo = index.has_geo[positions] & ~in_grid
+    dist[bad_geo] = distances_from(qgeo, index.geo_lat[positions[bad_geo]], index.geo_lng[positions[bad_geo]])
+    evaluated = ~in_grid
+    remaining = int(in_grid.sum())
+    ceiling = 10 * must.bit_count()
+
+    in_window = np.zeros(len(index), dtype=bool)
+    in_window[positions] = True
+    radius = _RING_START_KM
+    while remaining:
+        rows, d = index.geo_grid.within(qgeo, radius)
+        keep = in_window[rows]
+        rows, d = rows[keep], d[keep]
+        slots = np.searchsorted(positions, rows)
+        fresh = ~evaluated[slots]
+        dist[slots[fresh]] = d[fresh]
+        evaluated[slots[fresh]] = True
+        remaining -= int(fresh.sum())
+        if ctx is not None:
+            ctx.remember(q_key, [ctx.key(index.listings[p], "geo", kind="listing") for p in rows[fresh].tolist()], d[fresh])
+        if not remaining or radius >= _RING_MAX_KM:
+            break
+        cand = np.flatnonzero(evaluated)
+        if len(cand) >= k:
+            penalized = score[cand] - np.where(np.isnan(dist[cand]), 0.0, dist[cand] / 2.0)
+            kth = np.partition(penalized, len(cand) - k)[len(cand) - k]
+            if kth > ceiling - radius / 2.0 + 1e-6:
+                break
+        radius *= 2.0
+    return evaluated
 
 
 def suggest_rooms(
     city: Optional[str],
     per_person_budget: Optional[int],
     needed_amenities: Optional[List[str]],
-    listings: Optional[List[Dict[str, Any]]],
+    listings: Optional[Listings],
     *,
     mode: str = "degraded",
     limit: int = 5,
@@ -181,32 +290,23 @@ def suggest_rooms(
     if user_geo:
         q["geo"] = user_geo
 
-    required = {
-        str(a).strip().lower()
-        for a in (needed_amenities or [])
-        if a is not None and str(a).strip()
-    }
+    required = normalize_amenities(needed_amenities)
 
-    pool: List[Dict[str, Any]] = []
-    for listing in listings or []:
-        if required:
-            amenities = {
-                str(a).strip().lower()
-                for a in (listing.get("amenities") or [])
-                if a is not None and str(a).strip()
-            }
-            if not required.issubset(amenities):
-                continue
-        pool.append(listing)
+    index = _as_index(listings)
+    pool = _candidates(q, index)
+    if required:
+        pool = index.with_amenities(pool, required)
 
-    ranked = rank_rooms(q, pool, k=top_k)
+    ctx = PipelineContext(seeker=q)
+    ranked = _rank_positions(q, index, pool, top_k, ctx, learned=_rank_mode(None) == "learned")
 
     user_loc = q.get("geo") or q.get("anchor_location")
     if user_loc and effective_mode == "online":
         try:
             from .maps_planner import enrich_with_commute
 
-            ranked = enrich_with_commute(user_loc, ranked)
+            user_key = ctx.key(q, "geo" if q.get("geo") else "anchor_location")
+            ranked = enrich_with_commute(user_loc, ranked, ctx=ctx, user_key=user_key)
         except Exception:
             # Never fail the suggestion endpoint if enrichment is unavailable.
             # The base ranking already returns useful matches; commute data is
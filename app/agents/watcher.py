@@ -16,7 +16,7 @@ from app.services.firestore import (
 )
 from app.services.notifier import NotificationPayload, Notifier
 from app.services.task_queue import celery_app
-from app.agents.match_scorer import MatchScoreConfig
+from app.agents.match_scorer import MatchScoreConfig, ScoringPlan, compile_config
 
 
 LOGGER = logging.getLogger(__name__)
@@ -104,7 +104,7 @@ def get_watcher_config(user_profile: Dict[str, Any], institution_id: Optional[st
     return WatcherConfig.from_dict(overrides)
 
 
-def _build_match_config(config: Optional[Dict[str, Any]]) -> Optional[MatchScoreConfig]:
+def _build_match_config(config: Optional[Dict[str, Any]]) -> Optional[ScoringPlan]:
     if not config:
         return None
     weights = config.get("weights")
@@ -114,7 +114,8 @@ def _build_match_config(config: Optional[Dict[str, Any]]) -> Optional[MatchScore
         kwargs["weights"] = dict(weights)
     if anchor_buckets:
         kwargs["anchor_buckets"] = tuple(tuple(bucket) for bucket in anchor_buckets)
-    return MatchScoreConfig(**kwargs)
+    # Scopes sharing the same overrides share one compiled plan.
+    return compile_config(MatchScoreConfig(**kwargs))
 
 
 def _run_auto_hunt_cycle(
@@ -77,80 +77,159 @@
 #     return {"mode": mode, "matches": top, "rooms": rooms, "trace": trace}
 
 # app/graph.py
+import os
+import time
 import uuid
-from typing import List, Dict, Any, Optional, Iterable, Set
+from typing import List, Dict, Any, Optional, Iterable, Set, Union
+
 from .agents.profile_reader import normalize_profile
-from .agents.retrieval import CandidateRetrieval, RetrievalConfig
-from .agents.match_scorer import score_pair, MatchScoreConfig
+from .agents.retrieval import CandidateRetrieval, PushdownRetrieval, RetrievalConfig
+from .agents.match_scorer import score_pair, score_many, top_k_many, compile_config, MatchScoreConfig, PoolCodes, ScoringPlan
 from .agents.red_flag import red_flags
 from .agents.wingman import wingman
 from .agents.room_hunter import rank_rooms
 from .agents.maps_planner import enrich_with_commute   # 👈 NEW
+from .services.listing_index import ListingIndex
+from .services.profile_index import ProfileIndex
+from .utils.context import PipelineContext
+from .utils.metrics import STAGE_METRICS, span_detail_enabled
+from .utils.stages import Stage, run_stages, shared_pool
+from .utils.topk import top_k_indices
 from .utils.num import as_int
 
 
+def match_codes(index: ProfileIndex) -> PoolCodes:
+    """Encoded match fields of every profile in ``index``, built once per snapshot."""
+    return index.derived("match_codes", lambda ps: PoolCodes.encode([normalize_profile(p) for p in ps]))
+
+
 def run_pipeline(
     input_profile: Dict[str, Any],
     candidates: List[Dict[str, Any]],
     listings: List[Dict[str, Any]],
     mode: str = "degraded",
     top_k: int = 5,
-    match_config: Optional[MatchScoreConfig] = None,
+    match_config: Union[MatchScoreConfig, ScoringPlan, None] = None,
     retrieval_config: Optional[RetrievalConfig] = None,
     notified_match_ids: Optional[Iterable[str]] = None,
+    profile_index: Optional[ProfileIndex] = None,
+    listing_index: Optional[ListingIndex] = None,
+    faiss_store: Optional[Any] = None,
+    score_mode: Optional[str] = None,
+    trace_spans: Optional[bool] = None,
+    retrieval_backend: Optional[str] = None,
 ) -> Dict[str, Any]:
 
     class _MemDS:
-        def __init__(self, profiles: List[Dict[str, Any]]):
+        def __init__(self, profiles: List[Dict[str, Any]], index: Optional[ProfileIndex] = None, faiss: Optional[Any] = None):
             self._profiles = profiles
-            self.faiss = None
+            self.profile_index = index
+            # Only a warmed store takes the online branch in CandidateRetrieval.
+            self.faiss = faiss if faiss is not None and faiss.ready() else None
         def fetch_all_profiles(self) -> List[Dict[str, Any]]:
             return self._profiles
+        def faiss_search(self, query: Dict[str, Any], k: int) -> List[str]:
+            return self.faiss.search_ids(query, k=k)
 
     # ---- Step 1: Normalize profile ----
+    started = time.perf_counter()
     q = normalize_profile(input_profile)
+    ctx = PipelineContext(seeker=q)
+    normalize_ms = (time.perf_counter() - started) * 1000.0
 
     # ---- Step 2: Candidate retrieval ----
-    ds = _MemDS(candidates)
-    retr = CandidateRetrieval(ds, config=retrieval_config)
-    pool, meta = retr.retrieve(q, top_n=max(top_k * 10, 100), mode=mode)
+    def _retrieve(done: Dict[str, Any]):
+        if retrieval_backend == "pushdown":
+            # Firestore answers the retrieval predicates; ``candidates`` is not consulted.
+            retr = PushdownRetrieval(config=retrieval_config)
+        else:
+            ds = _MemDS(candidates, profile_index, faiss_store)
+            retr = CandidateRetrieval(ds, config=retrieval_config)
+        rows, meta = retr.retrieve_rows(q, top_n=max(top_k * 10, 100), mode=mode, ctx=ctx)
+        return retr, rows, meta
 
-    # ---- Step 3–5: Match scoring, red flags, wingman ----
-    items: List[Dict[str, Any]] = []
-    notified_ids: Set[str] = set(filter(None, (notified_match_ids or [])))
-    for c in pool:
-        total, reasons, subscores = score_pair(q, normalize_profile(c), config=match_config)
-        flags = red_flags(q, c)
-        cand_budget = as_int(c.get("budget_pkr") or c.get("budget_PKR") or c.get("budget"))
-
-        match_id = c.get("id") or c.get("profile_id")
-        is_new = bool(match_id) and match_id not in notified_ids
-        notification_status = "new" if is_new else ("notified" if match_id in notified_ids else "unknown")
-
-        items.append({
-            "other_profile_id": c.get("id"),
-            "other_name": c.get("name"),
-            "score": total,
-            "reasons": reasons,
-            "conflicts": flags,
-            "subscores": subscores,
-            "city": c.get("city"),
-            "budget_pkr": cand_budget,
-            "tips": wingman(reasons, flags, profile=q, other=c),  # 👈 updated call
-            "is_new": is_new,
-            "notification_status": notification_status,
-        })
+    # ---- Step 3: Match scoring (vectorized over the pool) ----
+    def _score(done: Dict[str, Any]):
+        retr, rows, _ = done["retrieve"]
+        pool = retr.index.take(rows)
+        codes = match_codes(retr.index)
+        pool_codes = codes.take(rows)
+        anchor_km = None
+        if q.get("anchor_location"):
+            anchor_km = ctx.distances(
+                ctx.key(q, "anchor_location"),
+                q["anchor_location"],
+                [ctx.key(c, "anchor_location") for c in pool],
+                pool_codes.anchor_lat,
+                pool_codes.anchor_lng,
+            )
+        if score_mode == "bounded":
+            ranked = top_k_many(q, pool_codes, top_k, config=plan, anchor_km=anchor_km)
+        else:
+            totals, _ = score_many(q, pool_codes, config=plan, anchor_km=anchor_km)
+            ranked = top_k_indices(totals, top_k)
+        return pool, ranked
+
+    # ---- Step 4–5: Conflicts, reasons and wingman tips for the returned matches only ----
+    def _explain(done: Dict[str, Any]):
+        pool, ranked = done["score"]
+        top: List[Dict[str, Any]] = []
+        for pos in ranked:
+            c = pool[pos]
+            total, reasons, subscores = score_pair(q, normalize_profile(c), config=plan, ctx=ctx)
+            flags = red_flags(q, c, ctx=ctx)
+            cand_budget = as_int(c.get("budget_pkr") or c.get("budget_PKR") or c.get("budget"))
+
+            match_id = c.get("id") or c.get("profile_id")
+            is_new = bool(match_id) and match_id not in notified_ids
+            notification_status = "new" if is_new else ("notified" if match_id in notified_ids else "unknown")
 
-    items.sort(key=lambda x: x["score"], reverse=True)
-    top = items[:top_k]
+            top.append({
+                "other_profile_id": c.get("id"),
+                "other_name": c.get("name"),
+                "score": total,
+                "reasons": reasons,
+                "conflicts": flags,
+                "subscores": subscores,
+                "city": c.get("city"),
+                "budget_pkr": cand_budget,
+                "tips": wingman(reasons, flags, profile=q, other=c),  # 👈 updated call
+                "is_new": is_new,
+                "notification_status": notification_status,
+            })
+        return top
 
-    # ---- Step 6: Room Hunter ----
-    rooms = rank_rooms(q, listings, k=3)
+    # ---- Step 6: Room Hunter (independent of the matches) ----
+    def _rooms(done: Dict[str, Any]):
+        return rank_rooms(q, listing_index if listing_index is not None else listings, k=3, ctx=ctx)
 
     # ---- Step 7: Maps Planner Agent (commute enrichment) ----
     user_loc = q.get("geo") or q.get("anchor_location")
+
+    def _commute(done: Dict[str, Any]):
+        user_key = ctx.key(q, "geo" if q.get("geo") else "anchor_location")
+        return enrich_with_commute(user_loc, done["rooms"], ctx=ctx, user_key=user_key)
+
+    plan = compile_config(match_config)
+    score_mode = (score_mode or os.getenv("MATCH_SCORE_MODE", "exhaustive")).lower()
+    retrieval_backend = (retrieval_backend or os.getenv("RETRIEVAL_BACKEND", "memory")).lower()
+    notified_ids: Set[str] = set(filter(None, (notified_match_ids or [])))
+    stages = [
+        # The match chain runs on the request thread; only the room branch uses the pool.
+        Stage("retrieve", _retrieve, inline=True),
+        Stage("score", _score, after=("retrieve",), inline=True),
+        Stage("explain", _explain, after=("score",), inline=True),
+        Stage("rooms", _rooms),
+    ]
     if user_loc:
-        rooms = enrich_with_commute(user_loc, rooms)
+        stages.append(Stage("commute", _commute, after=("rooms",)))
+    done, stage_ms = run_stages(stages, shared_pool())
+    stage_ms = {"normalize": normalize_ms, **stage_ms}
+    total_ms = (time.perf_counter() - started) * 1000.0
+    _, _, meta = done["retrieve"]
+    pool, ranked = done["score"]
+    top = done["explain"]
+    rooms = done["commute"] if user_loc else done["rooms"]
 
     # ---- Trace (for explainability) ----
     def _flag_label(f):
@@ -201,4 +280,36 @@ def run_pipeline(
             },
         })
 
+    cache = trace["cache"] = ctx.stats()
+    trace["timings_ms"] = {name: round(ms, 3) for name, ms in stage_ms.items()}
+    trace["timings_ms"]["total"] = round(total_ms, 3)
+
+    # ---- Instrumentation ----
+    method = meta.get("method") or "unknown"
+    for name, ms in stage_ms.items():
+        STAGE_METRICS.observe(name, ms)
+    STAGE_METRICS.observe("total", total_ms)
+    STAGE_METRICS.incr("pipeline_requests")
+    STAGE_METRICS.incr(f"retrieval_method.{method}")
+    if meta.get("fallback"):
+        STAGE_METRICS.incr(f"retrieval_fallback.{meta['fallback']}")
+    STAGE_METRICS.incr("distance_hits", cache["distance_hits"])
+    STAGE_METRICS.incr("distance_misses", cache["distance_misses"])
+
+    if span_detail_enabled(trace_spans):
+        n_listings = len(listing_index) if listing_index is not None else len(listings or [])
+        spans = [
+            {"stage": "normalize", "agent": "ProfileReader", "in": 1, "out": 1},
+            {"stage": "retrieve", "agent": "CandidateRetrieval", "in": meta.get("pushdown_rows", len(candidates)), "out": len(pool),
+             "method": method, **({"fallback": meta.get("fallback")} if meta.get("fallback") else {})},
+            {"stage": "score", "agent": "MatchScorer", "in": len(pool), "out": len(ranked), "score_mode": score_mode},
+            {"stage": "explain", "agent": "RedFlag+Wingman", "in": len(ranked), "out": len(top)},
+            {"stage": "rooms", "agent": "RoomHunter", "in": n_listings, "out": len(done["rooms"])},
+        ]
+        if user_loc:
+            spans.append({"stage": "commute", "agent": "MapsPlanner", "in": len(done["rooms"]), "out": len(rooms)})
+        for span in spans:
+            span["ms"] = round(stage_ms[span["stage"]], 3)
+        trace["spans"] = spans
+
     return {"mode": mode, "matches": top, "rooms": rooms, "trace": trace}
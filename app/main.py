@@ -4,16 +4,31 @@ import os
 import threading
 import time
 import uuid
+from dataclasses import dataclass, replace
 from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, Header, Request
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 
 from .agents.room_hunter import suggest_rooms
-from .graph import run_pipeline
-from .services.firestore import fetch_all_listings, fetch_all_profiles
+from .graph import match_codes, run_pipeline
+from .agents.profile_reader import normalize_profile
+from .services import firestore
+from .services.firestore import (
+    LISTING_SERVING_FIELDS,
+    PROFILE_SERVING_FIELDS,
+    fetch_all_listings,
+    fetch_all_profiles,
+    fetch_by_id,
+    fetch_profile_fields,
+)
+from .services.firestore_sync import CollectionMirror
+from .services.listing_index import ListingIndex
+from .services.profile_index import ProfileIndex
+from .services.snapshot_cache import SnapshotCache
+from .utils.metrics import STAGE_METRICS
 
 PROJECT_ID = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT")
 SERVICE_NAME = os.getenv("SERVICE_NAME", "room-matcher-ai")
@@ -25,6 +40,13 @@ FAISS_ENABLED = (FAISS_ENV_FLAG or "false").lower() == "true"
 SERVER_DEFAULT_MODE = os.getenv("MODE", "online").lower()
 FIRESTORE_ENABLED = os.getenv("FIRESTORE_ENABLED", "true").lower() == "true"
 CACHE_TTL_SEC = int(os.getenv("CACHE_TTL_SEC", "120"))
+CACHE_BACKGROUND_REFRESH = os.getenv("CACHE_BACKGROUND_REFRESH", "true").lower() == "true"
+FIRESTORE_SYNC_MODE = os.getenv("FIRESTORE_SYNC_MODE", "full").lower()   # full | incremental
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "memory").lower()      # memory | pushdown
+# Load only the fields the hot path reads into the serving cache (raw_text etc. on demand).
+SERVING_PROJECTION = os.getenv("SERVING_PROJECTION", "true").lower() == "true"
+_PROFILE_FIELDS = PROFILE_SERVING_FIELDS if SERVING_PROJECTION else None
+_LISTING_FIELDS = LISTING_SERVING_FIELDS if SERVING_PROJECTION else None
 
 logger = logging.getLogger("room-matcher")
 if not logger.handlers:
@@ -34,11 +56,21 @@ if not logger.handlers:
     )
 logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 
-_profiles_cache: List[Dict[str, Any]] = []
-_listings_cache: List[Dict[str, Any]] = []
-_cache_at: float = 0.0
+
+@dataclass(frozen=True)
+class ServingSnapshot:
+    """Profiles, listings and their derived indexes, swapped in as one unit."""
+
+    profiles: List[Dict[str, Any]]
+    listings: List[Dict[str, Any]]
+    profile_index: ProfileIndex
+    listing_index: ListingIndex
+    # ``CollectionMirror.version`` of each collection this was built from (incremental sync only).
+    profiles_version: int = -1
+    listings_version: int = -1
+
+
 LAST_EFFECTIVE_MODE = SERVER_DEFAULT_MODE
-_CACHE_LOCK = threading.Lock()
 _METRICS_LOCK = threading.Lock()
 _REQUEST_METRICS: Dict[str, Any] = {
     "total_requests": 0,
@@ -110,6 +142,8 @@ def _warmup_faiss() -> bool:
         _emit_log(logging.WARNING, "faiss_initialization_failed", error=str(exc))
         return False
     if store.ready():
+        snap = _CACHE.snapshot
+        store.prime_profiles(snap.profiles if snap is not None else [])
         _FAISS_STORE = store
         index_size = getattr(getattr(store, "index", None), "ntotal", None)
         _emit_log(logging.INFO, "faiss_index_warmed", index_size=index_size)
@@ -118,28 +152,86 @@ def _warmup_faiss() -> bool:
     return False
 
 
-def _load_cached(force: bool = False) -> None:
-    global _profiles_cache, _listings_cache, _cache_at
-    now = time.time()
-    with _CACHE_LOCK:
-        if not force and now - _cache_at < CACHE_TTL_SEC and _profiles_cache and _listings_cache:
-            return
-        _profiles_cache = fetch_all_profiles()
-        _listings_cache = fetch_all_listings()
-        _cache_at = time.time()
+_PROFILE_MIRROR = CollectionMirror("profiles", normalize=normalize_profile, fields=_PROFILE_FIELDS)
+_LISTING_MIRROR = CollectionMirror("listings", fields=_LISTING_FIELDS)
+
+
+def _build_snapshot() -> ServingSnapshot:
+    if FIRESTORE_SYNC_MODE == "incremental" and firestore.USE_FIRESTORE:
+        return _sync_snapshot(_CACHE.snapshot)
+    # With pushdown retrieval the profiles stay in Firestore.
+    profiles = fetch_all_profiles(fields=_PROFILE_FIELDS) if RETRIEVAL_BACKEND != "pushdown" else []
+    listings = fetch_all_listings(fields=_LISTING_FIELDS)
+    return _index_snapshot(profiles, listings)
+
+
+def _sync_snapshot(prev: Optional[ServingSnapshot]) -> ServingSnapshot:
+    """Apply Firestore deltas; indexes are only rebuilt for a collection that changed.
+
+    Changes are detected from the mirror versions rather than from what
+    ``sync()`` returns: a delta applied by a refresh that failed later on is
+    already in the mirror and would otherwise never reach a snapshot.
+    """
+    if RETRIEVAL_BACKEND != "pushdown":
+        _PROFILE_MIRROR.sync()
+    _LISTING_MIRROR.sync()
+    profiles_version, listings_version = _PROFILE_MIRROR.version, _LISTING_MIRROR.version
+    profiles_changed = prev is None or prev.profiles_version != profiles_version
+    listings_changed = prev is None or prev.listings_version != listings_version
+    if not profiles_changed and not listings_changed:
+        return prev
+    snap = _index_snapshot(
+        _PROFILE_MIRROR.rows(),
+        _LISTING_MIRROR.rows(),
+        profile_index=None if profiles_changed else prev.profile_index,
+        listing_index=None if listings_changed else prev.listing_index,
+    )
+    return replace(snap, profiles_version=profiles_version, listings_version=listings_version)
+
+
+def _index_snapshot(
+    profiles: List[Dict[str, Any]],
+    listings: List[Dict[str, Any]],
+    profile_index: Optional[ProfileIndex] = None,
+    listing_index: Optional[ListingIndex] = None,
+) -> ServingSnapshot:
+    snap = ServingSnapshot(
+        profiles=profiles,
+        listings=listings,
+        # Both indexes define ``__len__``: an empty one is falsy but still valid.
+        profile_index=profile_index if profile_index is not None else ProfileIndex.build(profiles),
+        listing_index=listing_index if listing_index is not None else ListingIndex.build(listings),
+    )
+    if profile_index is None:
+        # Encode the scoring columns here, off the request path, not on the first match.
+        match_codes(snap.profile_index)
+        if _FAISS_STORE is not None:
+            _FAISS_STORE.prime_profiles(profiles)
+    _emit_log(logging.INFO, "cache_snapshot_built", profiles=len(profiles), listings=len(listings))
+    return snap
+
+
+_CACHE: SnapshotCache[ServingSnapshot] = SnapshotCache(_build_snapshot, CACHE_TTL_SEC)
+
+
+def _load_cached(force: bool = False) -> ServingSnapshot:
+    """The last good snapshot; stale ones are refreshed in the background, ``force`` rebuilds inline."""
+    if force:
+        return _CACHE.refresh()
+    return _CACHE.get()
 
 
 def warmup_caches(force: bool = False) -> Dict[str, Any]:
     global _LAST_WARMUP
     started = time.time()
-    _load_cached(force=force)
+    snap = _load_cached(force=force)
     faiss_ready = _warmup_faiss()
     duration_ms = (time.time() - started) * 1000.0
     _LAST_WARMUP = time.time()
     snapshot = {
         "duration_ms": round(duration_ms, 2),
-        "profiles_cached": len(_profiles_cache),
-        "listings_cached": len(_listings_cache),
+        "profiles_cached": len(snap.profiles),
+        "listings_cached": len(snap.listings),
         "faiss_ready": faiss_ready,
     }
     _emit_log(logging.INFO, "cache_warmup_completed", **snapshot)
@@ -214,6 +306,13 @@ async def on_startup() -> None:
         warmup_caches(force=True)
     except Exception as exc:  # pragma: no cover - startup defensive log
         _emit_log(logging.ERROR, "startup_warmup_failed", error=str(exc))
+    if CACHE_BACKGROUND_REFRESH:
+        _CACHE.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    _CACHE.stop()
 
 
 class Profile(BaseModel):
@@ -258,22 +357,34 @@ class RoomSuggestReq(BaseModel):
 
 @app.get("/healthz")
 def healthz():
+    snap = _CACHE.snapshot
     return {
         "status": "ok",
         "server_default_mode": SERVER_DEFAULT_MODE,
         "last_effective_mode": LAST_EFFECTIVE_MODE,
         "firestore_enabled": FIRESTORE_ENABLED,
         "project": PROJECT_ID,
-        "profiles_cached": len(_profiles_cache),
-        "listings_cached": len(_listings_cache),
-        "cache_age_sec": max(0, int(time.time() - _cache_at)) if _cache_at else None,
-        "cache_ttl_sec": CACHE_TTL_SEC,
+        "profiles_cached": len(snap.profiles) if snap is not None else 0,
+        "listings_cached": len(snap.listings) if snap is not None else 0,
+        **_CACHE.stats(),
+        "firestore_sync_mode": FIRESTORE_SYNC_MODE,
+        "retrieval_backend": RETRIEVAL_BACKEND,
+        "serving_projection": SERVING_PROJECTION,
+        **({"firestore_sync": {"profiles": _PROFILE_MIRROR.stats, "listings": _LISTING_MIRROR.stats}}
+           if FIRESTORE_SYNC_MODE == "incremental" else {}),
         "metrics": _metrics_snapshot(),
+        "stage_latency_ms": STAGE_METRICS.latency(),
         "last_warmup_at": _LAST_WARMUP or None,
         "faiss_enabled": FAISS_ENABLED,
     }
 
 
+@app.get("/metrics")
+def metrics():
+    """Request totals plus per-stage pipeline latency histograms and counters."""
+    return {"requests": _metrics_snapshot(), "pipeline": STAGE_METRICS.snapshot()}
+
+
 @app.post("/profiles/parse")
 def parse_profile(req: ParseReq, request: Request, x_mode: Optional[str] = Header(None)):
     """Parse freeform roommate text into structured attributes."""
@@ -291,17 +402,41 @@ def parse_profile(req: ParseReq, request: Request, x_mode: Optional[str] = Heade
     return {"profile": prof, "confidence": conf, "mode_used": mode}
 
 
+@app.get("/profiles/{profile_id}")
+def get_profile(profile_id: str, include_raw_text: bool = False):
+    """One profile from the serving cache; ``raw_text`` is fetched lazily on request."""
+    snap = _load_cached()
+    rows = snap.profile_index.rows_for_ids([profile_id])
+    if rows.size:
+        profile = dict(snap.profiles[int(rows[0])])
+    else:
+        profile = fetch_by_id(profile_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail="profile not found")
+        profile = dict(profile)
+    if include_raw_text and SERVING_PROJECTION and not profile.get("raw_text"):
+        heavy = fetch_profile_fields([profile_id]).get(profile_id) or {}
+        profile["raw_text"] = heavy.get("raw_text") or heavy.get("raw_profile_text") or ""
+    if not include_raw_text:
+        profile.pop("raw_text", None)
+    return {"profile": profile}
+
+
 @app.post("/match/top")
 def match_top(req: MatchTopReq, request: Request, x_mode: Optional[str] = Header(None)):
     """Full pipeline returning matches and enriched room suggestions."""
     mode = _mode(req.mode, x_mode)
-    _load_cached()
+    snap = _load_cached()
     result = run_pipeline(
         input_profile=req.profile.dict(),
-        candidates=_profiles_cache,
-        listings=_listings_cache,
+        candidates=snap.profiles,
+        listings=snap.listings,
         mode=mode,
         top_k=req.k,
+        profile_index=snap.profile_index,
+        listing_index=snap.listing_index,
+        faiss_store=_FAISS_STORE,
+        retrieval_backend=RETRIEVAL_BACKEND,
     )
     trace_id = (result.get("trace") or {}).get("trace_id")
     _emit_log(
@@ -319,12 +454,12 @@ def match_top(req: MatchTopReq, request: Request, x_mode: Optional[str] = Header
 @app.post("/rooms/suggest")
 def rooms_suggest(req: RoomSuggestReq, request: Request, x_mode: Optional[str] = Header(None)):
     mode = _mode(req.mode, x_mode)
-    _load_cached()
+    snap = _load_cached()
     out = suggest_rooms(
         req.city,
         req.per_person_budget,
         req.needed_amenities,
-        _listings_cache,
+        snap.listing_index,
         mode=mode,
         limit=5,
         anchor_location=req.anchor_location,
@@ -1,56 +1,111 @@
 import os, json
+import threading
 import numpy as np
 
 SNAPSHOT_PATH = os.getenv("FAISS_SNAPSHOT","/tmp/faiss_profiles.idx")
 META_PATH = os.getenv("FAISS_META","/tmp/faiss_profiles_meta.json")
 MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
+class _Snapshot:
+    """One loaded index with its id list and id -> profile map, swapped in as a unit."""
+    __slots__ = ("index", "meta", "profiles", "mtime")
+
+    def __init__(self, index, meta, profiles, mtime):
+        self.index, self.meta, self.profiles, self.mtime = index, meta, profiles, mtime
+
+_EMPTY = _Snapshot(None, None, {}, None)
+
 class FaissStore:
     def __init__(self, model_name: str = MODEL_NAME):
+        # Readers take ``self._snap`` once and use only that; reloads replace it whole.
+        self._snap = _EMPTY
+        self._reload_lock = threading.Lock()
+        self._primed = None   # last serving profiles handed to prime_profiles
         try:
             from sentence_transformers import SentenceTransformer
             import faiss
             self.faiss = faiss
             self.model = SentenceTransformer(model_name)
-            self.index, self.meta = self._load_or_build()
+            self._snap = self._load_or_build()
         except Exception:
             self.model = None
-            self.index = None
-            self.meta = None
+            self._snap = _EMPTY
+
+    @property
+    def index(self):
+        return self._snap.index
+
+    @property
+    def meta(self):
+        return self._snap.meta
 
     def ready(self):
         return self.index is not None and self.model is not None
 
     def _load_or_build(self):
-        import os, json
         from app.services.firestore import fetch_all_profiles
         if os.path.exists(SNAPSHOT_PATH) and os.path.exists(META_PATH):
+            mtime = os.path.getmtime(META_PATH)
             index = self.faiss.read_index(SNAPSHOT_PATH)
             with open(META_PATH,"r",encoding="utf-8") as f: meta=json.load(f)
-            return index, meta
+            return _Snapshot(index, meta, _id_map(meta, self._primed), mtime)
         profiles = fetch_all_profiles()
         texts = [self._profile_text(p) for p in profiles]
         X = self.model.encode(texts, batch_size=64, show_progress_bar=False, normalize_embeddings=True)
         index = self.faiss.IndexFlatIP(X.shape[1])
         index.add(np.array(X, dtype="float32"))
         self.faiss.write_index(index, SNAPSHOT_PATH)
-        with open(META_PATH,"w",encoding="utf-8") as f: json.dump({"ids":[p.get("id") for p in profiles]}, f)
-        return index, {"ids":[p.get("id") for p in profiles]}
+        meta = {"ids":[p.get("id") for p in profiles]}
+        with open(META_PATH,"w",encoding="utf-8") as f: json.dump(meta, f)
+        return _Snapshot(index, meta, _id_map(meta, profiles), os.path.getmtime(META_PATH))
 
-    def search_profile(self, q, k=50):
+    def _sync_snapshot(self):
+        """Reload index + id map when another process rewrote the snapshot."""
+        try:
+            mtime = os.path.getmtime(META_PATH)
+        except OSError:
+            return
+        if self._snap.mtime is None or mtime == self._snap.mtime:
+            return
+        with self._reload_lock:
+            if self._snap.mtime is not None and mtime != self._snap.mtime:
+                self._snap = self._load_or_build()
+
+    def prime_profiles(self, profiles):
+        """Seed the id -> profile map from an already loaded (normalized) snapshot.
+
+        The map is rebuilt, so ids gone from ``profiles`` are dropped, and it is
+        rebuilt again from the same profiles after a snapshot reload.
+        """
+        with self._reload_lock:
+            self._primed = profiles
+            snap = self._snap
+            if snap.meta:
+                self._snap = _Snapshot(snap.index, snap.meta, _id_map(snap.meta, profiles), snap.mtime)
+
+    def search_ids(self, q, k=50):
+        """Profile ids of the k nearest neighbours, best first."""
         if not self.ready(): return []
+        self._sync_snapshot()
+        return self._search(self._snap, q, k)
+
+    def _search(self, snap, q, k):
         qtext = self._profile_text(q)
         qv = self.model.encode([qtext], normalize_embeddings=True)
-        D, I = self.index.search(np.array(qv, dtype="float32"), k)
-        out=[]
-        ids = self.meta["ids"]
-        from app.services.firestore import fetch_by_id
-        for i in I[0]:
-            if i == -1: continue
-            pid = ids[i]
-            p = fetch_by_id(pid)
-            if p: out.append(p)
-        return out
+        D, I = snap.index.search(np.array(qv, dtype="float32"), k)
+        ids = snap.meta["ids"]
+        return [ids[i] for i in I[0] if 0 <= i < len(ids)]
+
+    def search_profile(self, q, k=50):
+        if not self.ready(): return []
+        self._sync_snapshot()
+        snap = self._snap
+        ids = self._search(snap, q, k)
+        missing = [pid for pid in ids if pid not in snap.profiles]
+        if missing:
+            from app.services.firestore import fetch_by_ids
+            snap.profiles.update(fetch_by_ids(missing))
+        return [snap.profiles[pid] for pid in ids if pid in snap.profiles]
 
     def _profile_text(self, p):
         return " ".join([
@@ -64,3 +119,7 @@ class FaissStore:
             "smoker" if p.get("smoking") else "non-smoker",
             str(p.get("guests_freq",""))
         ])
+
+def _id_map(meta, profiles):
+    known = set(meta["ids"]) if meta else set()
+    return {p.get("id"): p for p in profiles or [] if p.get("id") in known}
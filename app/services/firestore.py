@@ -1,7 +1,11 @@
+import functools
+import itertools
 import os
 import threading
-from typing import List, Dict, Optional, Tuple, Any
+import time
+from typing import List, Dict, Iterable, Optional, Sequence, Tuple, Any
 from app.agents.profile_reader import normalize_profile
+from app.utils.metrics import STAGE_METRICS
 
 USE_FIRESTORE = os.getenv("FIRESTORE_ENABLED", "false").lower() == "true"
 PROJECT_ID = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT")
@@ -17,9 +21,67 @@ _CONFIG_LOCK = threading.Lock()
 _LOCAL_CONFIG_CACHE: Dict[str, Dict[str, Any]] = {}
 _LOCAL_NOTIFIED_CACHE: Dict[Tuple[str, str], List[str]] = {}
 
+# -------------------------------
+# Client pool
+# -------------------------------
+# Each firestore.Client owns its gRPC channel, credentials and TLS session, so
+# clients are created lazily once per process and reused.  A pool of N clients
+# (FIRESTORE_CLIENT_POOL_SIZE) spreads concurrent calls over N channels.  The
+# pool is keyed by pid: a forked worker never reuses its parent's channels.
+_CLIENT_LOCK = threading.Lock()
+_CLIENT_POOL: List[Any] = []
+_CLIENT_PID: Optional[int] = None
+_CLIENT_CYCLE: Any = None
+
+def _pool_size() -> int:
+    return max(1, int(os.getenv("FIRESTORE_CLIENT_POOL_SIZE", "1")))
+
+def _reset_client_pool() -> None:
+    global _CLIENT_POOL, _CLIENT_PID, _CLIENT_CYCLE
+    _CLIENT_POOL, _CLIENT_PID, _CLIENT_CYCLE = [], None, None
+
+def _after_fork_in_child() -> None:
+    global _CLIENT_LOCK
+    # Another parent thread may have held the lock at fork time; the child
+    # inherits it locked with no thread left to release it.
+    _CLIENT_LOCK = threading.Lock()
+    _reset_client_pool()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
 def _client():
-    from google.cloud import firestore
-    return firestore.Client(project=PROJECT_ID)
+    global _CLIENT_POOL, _CLIENT_PID, _CLIENT_CYCLE
+    pid = os.getpid()
+    with _CLIENT_LOCK:
+        if _CLIENT_PID != pid or not _CLIENT_POOL:
+            from google.cloud import firestore
+            pool = []
+            for _ in range(_pool_size()):
+                started = time.perf_counter()
+                pool.append(firestore.Client(project=PROJECT_ID))
+                STAGE_METRICS.observe("firestore.client_create", (time.perf_counter() - started) * 1000.0)
+                STAGE_METRICS.incr("firestore.clients_created")
+            _CLIENT_POOL, _CLIENT_PID, _CLIENT_CYCLE = pool, pid, itertools.cycle(pool)
+        return next(_CLIENT_CYCLE)
+
+def _timed_rpc(fn):
+    """Report the wall time of Firestore-backed calls as ``firestore.<name>``."""
+    name = f"firestore.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not USE_FIRESTORE:
+            return fn(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            STAGE_METRICS.incr(f"{name}.errors")
+            raise
+        finally:
+            STAGE_METRICS.observe(name, (time.perf_counter() - started) * 1000.0)
+    return wrapper
 
 def _local_json(rel_path: str) -> List[Dict]:
     import json
@@ -27,20 +89,120 @@ def _local_json(rel_path: str) -> List[Dict]:
     with open(os.path.abspath(p), "r", encoding="utf-8") as f:
         return json.load(f)
 
+# -------------------------------
+# Field projections
+# -------------------------------
+# The serving cache only needs the fields matching, red flags, wingman and
+# room ranking read.  Loading with these masks skips heavy free text
+# (raw_text, contact details, ...); fetch_profile_fields() loads it on demand.
+PROFILE_SERVING_FIELDS: Tuple[str, ...] = (
+    "id", "name", "role", "city",
+    "budget_pkr", "budget", "budget_PKR", "monthly_budget", "rent_budget", "expected_budget",
+    "sleep_schedule", "cleanliness", "noise_tolerance", "study_habits", "food_pref",
+    "smoking", "guests_freq", "gender_pref", "languages", "anchor_location", "geo",
+)
+PROFILE_HEAVY_FIELDS: Tuple[str, ...] = ("raw_text", "raw_profile_text")
+LISTING_SERVING_FIELDS: Tuple[str, ...] = (
+    "id", "listing_id", "city", "area",
+    "monthly_rent_PKR", "monthly_rent_pkr", "rent_pkr", "rent", "price_pkr", "price",
+    "amenities", "availability", "status", "rooms_available", "reserved_by", "geo",
+)
+SYNC_FIELDS: Tuple[str, ...] = ("updated_at", "deleted")   # incremental sync bookkeeping
+
+def _project(doc: Dict, fields: Optional[Sequence[str]]) -> Dict:
+    if fields is None:
+        return doc
+    return {k: doc[k] for k in fields if k in doc}
+
+def _select(query, fields: Optional[Sequence[str]]):
+    # Firestore field mask: only these fields are sent over the wire.
+    return query.select(list(fields)) if fields is not None else query
+
 # -------------------------------
 # Profiles
 # -------------------------------
-def fetch_all_profiles() -> List[Dict]:
+@_timed_rpc
+def fetch_all_profiles(fields: Optional[Sequence[str]] = None) -> List[Dict]:
+    """All profiles, normalized; ``fields`` limits the stored fields loaded (see ``PROFILE_SERVING_FIELDS``)."""
     if not USE_FIRESTORE:
         # degraded: local JSON, but still normalize
         raw = _local_json("profiles_extended.json")
-        return [normalize_profile(d) for d in raw]
+        return [normalize_profile(_project(d, fields)) for d in raw]
 
     db = _client()
-    docs = db.collection("profiles").stream()
+    docs = _select(db.collection("profiles"), fields).stream()
     raw = [d.to_dict() for d in docs]
     return [normalize_profile(d) for d in raw]
 
+@_timed_rpc
+def fetch_profile_fields(pids: Iterable[str], fields: Sequence[str] = PROFILE_HEAVY_FIELDS) -> Dict[str, Dict]:
+    """Just ``fields`` of the given profiles (e.g. the ``raw_text`` left out of the serving cache)."""
+    wanted = set(filter(None, pids))
+    if not wanted:
+        return {}
+    if not USE_FIRESTORE:
+        return {d["id"]: _project(d, fields) for d in _local_json("profiles_extended.json") if d.get("id") in wanted}
+    db = _client()
+    refs = [db.collection("profiles").document(pid) for pid in sorted(wanted)]
+    return {doc.id: doc.to_dict() or {} for doc in db.get_all(refs, field_paths=list(fields)) if doc.exists}
+
+def _matches(doc: Dict, filters: List[Tuple[str, str, Any]]) -> bool:
+    """Evaluate Firestore-style ``(field, op, value)`` filters on a plain dict."""
+    for field_name, op, value in filters:
+        if field_name not in doc or doc[field_name] is None:
+            return False
+        v = doc[field_name]
+        try:
+            if op == "==" and not v == value:
+                return False
+            if op == "in" and v not in value:
+                return False
+            if op == ">=" and not v >= value:
+                return False
+            if op == "<=" and not v <= value:
+                return False
+            if op == ">" and not v > value:
+                return False
+            if op == "<" and not v < value:
+                return False
+        except TypeError:
+            return False  # Firestore never compares across value types
+    return True
+
+@_timed_rpc
+def query_profiles(
+    filters: List[Tuple[str, str, Any]],
+    limit: Optional[int] = None,
+    fields: Optional[Sequence[str]] = PROFILE_SERVING_FIELDS,
+    descending: bool = False,
+) -> List[Tuple[str, Dict]]:
+    """``(doc_id, normalized profile)`` for profiles matching every ``(field, op, value)`` filter.
+
+    Filters run server-side against the stored fields; a range filter orders
+    the results by that field (``descending`` flips it, so ``limit`` keeps the
+    high end), otherwise they come back in document-id order.
+    """
+    ranged = [f for f, op, _ in filters if op in (">=", "<=", ">", "<")]
+    if not USE_FIRESTORE:
+        raw = _local_json("profiles_extended.json")
+        docs = [(str(d.get("id") or i), d) for i, d in enumerate(raw) if _matches(d, filters)]
+        if ranged:
+            docs.sort(key=lambda kv: (kv[1][ranged[0]], kv[0]), reverse=descending)
+        else:
+            docs.sort(key=lambda kv: kv[0])
+        return [(doc_id, normalize_profile(_project(d, fields))) for doc_id, d in docs[:limit]]
+
+    db = _client()
+    query = _select(db.collection("profiles"), fields)
+    for field_name, op, value in filters:
+        query = query.where(field_name, op, value)
+    if ranged and descending:
+        query = query.order_by(ranged[0], direction="DESCENDING")
+    if limit:
+        query = query.limit(limit)
+    return [(d.id, normalize_profile(d.to_dict() or {})) for d in query.stream()]
+
+@_timed_rpc
 def fetch_by_id(pid: str) -> Optional[Dict]:
     if not USE_FIRESTORE:
         for p in fetch_all_profiles():
@@ -51,22 +213,57 @@ def fetch_by_id(pid: str) -> Optional[Dict]:
     doc = db.collection("profiles").document(pid).get()
     return normalize_profile(doc.to_dict()) if doc.exists else None
 
+@_timed_rpc
+def fetch_by_ids(pids: List[str]) -> Dict[str, Dict]:
+    """Batched :func:`fetch_by_id`: one pass (or one batched RPC) for many ids."""
+    wanted = set(filter(None, pids))
+    if not wanted:
+        return {}
+    if not USE_FIRESTORE:
+        return {p["id"]: p for p in fetch_all_profiles() if p.get("id") in wanted}
+    db = _client()
+    refs = [db.collection("profiles").document(pid) for pid in sorted(wanted)]
+    return {doc.id: normalize_profile(doc.to_dict()) for doc in db.get_all(refs) if doc.exists}
+
 # -------------------------------
 # Listings
 # -------------------------------
-def fetch_all_listings() -> List[Dict]:
+@_timed_rpc
+def fetch_all_listings(fields: Optional[Sequence[str]] = None) -> List[Dict]:
+    """All listings; ``fields`` limits the stored fields loaded (see ``LISTING_SERVING_FIELDS``)."""
     if not USE_FIRESTORE:
-        return _local_json("listings_extended.json")
+        return [_project(d, fields) for d in _local_json("listings_extended.json")]
 
     db = _client()
-    docs = db.collection("listings").stream()
+    docs = _select(db.collection("listings"), fields).stream()
     return [d.to_dict() for d in docs]
 
 
+# -------------------------------
+# Raw documents (incremental sync, see firestore_sync.py)
+# -------------------------------
+@_timed_rpc
+def stream_documents(collection: str, fields: Optional[Sequence[str]] = None) -> List[Tuple[str, Dict]]:
+    """Every ``(doc_id, data)`` in ``collection``, in document-id order."""
+    db = _client()
+    return [(d.id, d.to_dict() or {}) for d in _select(db.collection(collection), fields).stream()]
+
+
+@_timed_rpc
+def stream_changed_documents(
+    collection: str, field: str, since: Any, fields: Optional[Sequence[str]] = None
+) -> List[Tuple[str, Dict]]:
+    """``(doc_id, data)`` of documents whose ``field`` is ``>= since``, oldest change first."""
+    db = _client()
+    query = _select(db.collection(collection), fields).where(field, ">=", since).order_by(field)
+    return [(d.id, d.to_dict() or {}) for d in query.stream()]
+
+
 # -------------------------------
 # Watcher configuration + state
 # -------------------------------
 
+@_timed_rpc
 def fetch_watcher_config(scope: str) -> Dict[str, Any]:
     """Return watcher configuration for a tenant/institution scope."""
 
@@ -82,6 +279,7 @@ def fetch_watcher_config(scope: str) -> Dict[str, Any]:
     return doc.to_dict() if doc.exists else {}
 
 
+@_timed_rpc
 def upsert_watcher_config(scope: str, data: Dict[str, Any]) -> None:
     """Persist watcher configuration overrides."""
 
@@ -99,6 +297,7 @@ def upsert_watcher_config(scope: str, data: Dict[str, Any]) -> None:
     db.collection("watcher_configs").document(scope).set(data, merge=True)
 
 
+@_timed_rpc
 def fetch_notified_matches(scope: str, profile_key: str) -> List[str]:
     """Read the set of previously notified match ids for a profile."""
 
@@ -123,6 +322,7 @@ def fetch_notified_matches(scope: str, profile_key: str) -> List[str]:
     return list(payload.get("notified_match_ids", []))
 
 
+@_timed_rpc
 def store_notified_matches(scope: str, profile_key: str, match_ids: List[str]) -> None:
     """Persist the deduplicated list of match ids already notified."""
 
@@ -0,0 +1,133 @@
+# app/services/firestore_sync.py
+"""Incremental Firestore sync for the serving snapshot.
+
+``fetch_all_profiles`` / ``fetch_all_listings`` stream whole collections on
+every refresh.  A :class:`CollectionMirror` keeps an in-memory copy of one
+collection instead and, after an initial scan, only asks Firestore for the
+documents whose ``updated_at`` is at or past the highest value seen so far
+(the high-water mark).  Changed documents replace their rows, new ones are
+added, and documents carrying a truthy ``deleted`` field (tombstones) are
+dropped.  Rows are normalized once, when they change.
+
+A cursor cannot see hard deletes or documents written without
+``updated_at``, so the mirror falls back to a full scan every
+``FIRESTORE_FULL_SYNC_SEC`` seconds.  Rows are kept in document-id order,
+the order a full ``stream()`` returns, so ranking ties resolve exactly as
+they would after a full refresh.
+
+Works against the Firestore emulator unchanged (``FIRESTORE_EMULATOR_HOST``).
+"""
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Protocol, Sequence, Tuple
+
+from . import firestore
+
+FULL_SYNC_SEC = float(os.getenv("FIRESTORE_FULL_SYNC_SEC", "3600"))
+
+Doc = Tuple[str, Dict[str, Any]]
+
+
+class DocumentSource(Protocol):
+    def stream_documents(self, collection: str, fields: Optional[Sequence[str]] = None) -> List[Doc]: ...
+
+    def stream_changed_documents(
+        self, collection: str, field: str, since: Any, fields: Optional[Sequence[str]] = None
+    ) -> List[Doc]: ...
+
+
+class CollectionMirror:
+    """In-memory copy of one collection, kept current from ``updated_at`` deltas."""
+
+    def __init__(
+        self,
+        collection: str,
+        normalize: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+        source: DocumentSource = firestore,
+        cursor_field: str = "updated_at",
+        tombstone_field: str = "deleted",
+        full_sync_sec: float = FULL_SYNC_SEC,
+        fields: Optional[Sequence[str]] = None,
+    ):
+        self.collection = collection
+        # Field mask for the source; the sync bookkeeping fields are always loaded.
+        self.fields = None if fields is None else tuple(dict.fromkeys([*fields, cursor_field, tombstone_field]))
+        self.normalize = normalize
+        self.source = source
+        self.cursor_field = cursor_field
+        self.tombstone_field = tombstone_field
+        self.full_sync_sec = full_sync_sec
+        self.high_water: Any = None
+        self.last_full_sync: Optional[float] = None
+        self.version = 0   # bumped whenever the rows change
+        self.stats: Dict[str, int] = {"full_syncs": 0, "incremental_syncs": 0, "upserts": 0, "deletes": 0}
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._rows: Optional[List[Dict[str, Any]]] = None
+
+    def rows(self) -> List[Dict[str, Any]]:
+        """Current rows in document-id order (the same list object until the next change)."""
+        if self._rows is None:
+            self._rows = [self._docs[doc_id] for doc_id in sorted(self._docs)]
+        return self._rows
+
+    def sync(self, full: bool = False) -> bool:
+        """Pull changes from the source; ``True`` when the rows changed."""
+        now = time.time()
+        if (
+            full
+            or self.last_full_sync is None
+            or self.high_water is None
+            or now - self.last_full_sync >= self.full_sync_sec
+        ):
+            return self._full_sync(now)
+        docs = self.source.stream_changed_documents(self.collection, self.cursor_field, self.high_water, fields=self.fields)
+        self.stats["incremental_syncs"] += 1
+        changed = self._apply(docs)
+        if changed:
+            self._changed()
+        return changed
+
+    # ---------------- Internals ----------------
+    def _full_sync(self, now: float) -> bool:
+        docs = self.source.stream_documents(self.collection, fields=self.fields)
+        seen = {doc_id for doc_id, _ in docs}
+        changed = self._apply(docs)
+        for doc_id in [d for d in self._docs if d not in seen]:
+            del self._docs[doc_id]
+            self.stats["deletes"] += 1
+            changed = True
+        self.stats["full_syncs"] += 1
+        self.last_full_sync = now
+        if changed:
+            self._changed()
+        return changed
+
+    def _apply(self, docs: List[Doc]) -> bool:
+        changed = False
+        for doc_id, data in docs:
+            self._advance(data.get(self.cursor_field))
+            if data.get(self.tombstone_field):
+                if self._docs.pop(doc_id, None) is not None:
+                    self.stats["deletes"] += 1
+                    changed = True
+                continue
+            row = self.normalize(data) if self.normalize is not None else data
+            if self._docs.get(doc_id) != row:
+                # The ``>=`` cursor re-reads the boundary document; only real edits count.
+                self._docs[doc_id] = row
+                self.stats["upserts"] += 1
+                changed = True
+        return changed
+
+    def _advance(self, value: Any) -> None:
+        if value is None:
+            return
+        try:
+            if self.high_water is None or value > self.high_water:
+                self.high_water = value
+        except TypeError:
+            pass  # a value of another type than the mark is ignored
+
+    def _changed(self) -> None:
+        self._rows = None
+        self.version += 1
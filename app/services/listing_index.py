@@ -0,0 +1,189 @@
+# app/services/listing_index.py
+"""Query-independent view over the cached listing snapshot.
+
+``rank_rooms`` used to re-check availability, re-parse the rent, re-normalize
+the city and rebuild the amenity set of every listing on every request.
+``ListingIndex`` does that once per cache refresh: available listings are
+bucketed by normalized city and kept sorted by canonical rent, so a query
+only touches the rent window it can accept.  Results are handed back as
+snapshot positions in ascending order, which keeps ranking ties in the
+original listing order.
+
+Amenities are interned into one vocabulary per snapshot.  Every listing
+carries an integer bitmask over it and every amenity a posting list of the
+positions offering it, so "has all of these amenities" is a mask test on a
+small window or a posting-list intersection starting from the rarest one.
+
+Listing coordinates also go into an ``AnchorGrid`` so geo-anchored ranking
+can measure listings outward from the user instead of all of them.
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+from ..utils.geo import coords
+from ..utils.num import as_int
+from .profile_index import AnchorGrid
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def listing_city(s: Optional[str]) -> str:
+    return (s or "").strip().lower()
+
+
+def is_available(L: Dict) -> bool:
+    """Check listing status + rooms availability."""
+    status = (L.get("availability") or L.get("status") or "available").strip().lower()
+    if status in ("unavailable", "occupied", "closed", "false", "0", "no"):
+        return False
+    if L.get("rooms_available") is not None and as_int(L.get("rooms_available")) <= 0:
+        return False
+    return True
+
+
+def rent_value(L: Dict) -> int:
+    for k in ("monthly_rent_PKR", "rent_pkr", "rent", "price_pkr", "price"):
+        if k in L and L[k] is not None:
+            return as_int(L[k])
+    return 0
+
+
+def normalize_amenities(amenities: Optional[Iterable[Any]]) -> FrozenSet[str]:
+    return frozenset(
+        str(a).strip().lower()
+        for a in (amenities or [])
+        if a is not None and str(a).strip()
+    )
+
+
+class RentBucket:
+    """Positions of one city's available listings, sorted by rent."""
+
+    def __init__(self, positions: np.ndarray, rent: np.ndarray):
+        order = np.argsort(rent[positions], kind="stable")
+        self.positions = positions[order]
+        self.rent = rent[positions][order]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def upto(self, max_rent: Optional[float]) -> np.ndarray:
+        """Positions with rent ``<= max_rent`` (all when ``None``), ascending."""
+        if max_rent is None:
+            return np.sort(self.positions)
+        stop = np.searchsorted(self.rent, max_rent, side="right")
+        return np.sort(self.positions[:stop])
+
+
+@dataclass
+class ListingIndex:
+    listings: List[Dict[str, Any]]
+    rent: np.ndarray                  # int64 canonical rent per position (0 when missing)
+    amenity_codes: Dict[str, int]     # normalized amenity name -> bit
+    amenity_masks: List[int]          # per position, OR of its amenity bits
+    postings: List[np.ndarray]        # per amenity bit, positions offering it (ascending)
+    has_geo: np.ndarray               # bool, listing carries a (truthy) geo
+    geo_lat: np.ndarray               # float64, NaN when missing/invalid
+    geo_lng: np.ndarray
+    available: np.ndarray             # positions of available listings, ascending
+    by_city: Dict[str, RentBucket] = field(default_factory=dict)
+    everything: Optional[RentBucket] = None
+    geo_grid: Optional[AnchorGrid] = None
+
+    @classmethod
+    def build(cls, listings: List[Dict[str, Any]]) -> "ListingIndex":
+        listings = list(listings or [])
+        n = len(listings)
+        rent = np.zeros(n, dtype=np.int64)
+        has_geo = np.zeros(n, dtype=bool)
+        geo_lat = np.full(n, np.nan)
+        geo_lng = np.full(n, np.nan)
+        amenity_codes: Dict[str, int] = {}
+        amenity_masks: List[int] = []
+        postings: List[List[int]] = []
+        available: List[int] = []
+        cities: Dict[str, List[int]] = {}
+
+        for i, L in enumerate(listings):
+            rent[i] = rent_value(L) or 0
+            mask = 0
+            for name in normalize_amenities(L.get("amenities")):
+                code = amenity_codes.get(name)
+                if code is None:
+                    code = amenity_codes[name] = len(amenity_codes)
+                    postings.append([])
+                postings[code].append(i)
+                mask |= 1 << code
+            amenity_masks.append(mask)
+            if L.get("geo"):
+                has_geo[i] = True
+                geo_lat[i], geo_lng[i] = coords(L["geo"]) or (np.nan, np.nan)
+            if is_available(L):
+                available.append(i)
+                cities.setdefault(listing_city(L.get("city")), []).append(i)
+
+        index = cls(
+            listings=listings,
+            rent=rent,
+            amenity_codes=amenity_codes,
+            amenity_masks=amenity_masks,
+            postings=[np.asarray(rows, dtype=np.int64) for rows in postings],
+            has_geo=has_geo,
+            geo_lat=geo_lat,
+            geo_lng=geo_lng,
+            available=np.asarray(available, dtype=np.int64),
+        )
+        index.by_city = {c: RentBucket(np.asarray(rows, dtype=np.int64), rent) for c, rows in cities.items()}
+        index.everything = RentBucket(index.available, rent)
+        index.geo_grid = AnchorGrid(geo_lat, geo_lng)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.listings)
+
+    @staticmethod
+    def max_rent(budget: int) -> Optional[int]:
+        """Highest rent ``rank_rooms`` accepts for a per-person budget (``None`` = no cap)."""
+        return max(budget * 2, budget + 5000) if budget else None
+
+    def window(self, city: Optional[str], budget: int) -> np.ndarray:
+        """Available positions in ``city`` (any city when falsy) within the budget's rent cap."""
+        if city:
+            bucket = self.by_city.get(listing_city(city))
+            if bucket is None:
+                return _EMPTY
+        else:
+            bucket = self.everything
+        return bucket.upto(self.max_rent(budget))
+
+    def amenity_mask(self, names: Iterable[str]) -> Optional[int]:
+        """Bitmask of normalized amenity ``names``; ``None`` if one is unknown to the snapshot."""
+        mask = 0
+        for name in names:
+            code = self.amenity_codes.get(name)
+            if code is None:
+                return None
+            mask |= 1 << code
+        return mask
+
+    def with_amenities(self, positions: np.ndarray, required: Iterable[str]) -> np.ndarray:
+        """The ``positions`` (ascending) whose listing offers every ``required`` amenity."""
+        required = list(required)
+        if not required:
+            return positions
+        mask = self.amenity_mask(required)
+        if mask is None:
+            return _EMPTY
+        lists = sorted((self.postings[self.amenity_codes[name]] for name in required), key=len)
+        if len(positions) <= len(lists[0]):
+            # A small window is cheaper to test mask by mask.
+            masks = self.amenity_masks
+            return np.asarray([p for p in positions.tolist() if masks[p] & mask == mask], dtype=np.int64)
+        out = positions
+        for post in lists:
+            out = np.intersect1d(out, post, assume_unique=True)
+            if not out.size:
+                break
+        return out
@@ -0,0 +1,295 @@
+# app/services/profile_index.py
+"""Columnar view over the cached profile snapshot.
+
+Retrieval used to walk every profile dict on each request, re-normalizing the
+city and budget and computing anchor distances pair by pair.  ``ProfileIndex``
+does that work once per cache refresh and keeps the result as NumPy columns so
+``CandidateRetrieval`` can filter and rank with vectorized masks.
+
+On top of the columns sits an inverted index keyed by normalized city and
+(city, role).  Each bucket keeps its rows sorted by budget, so the relative
+``budget_close`` tolerance becomes a binary-searched budget window instead of
+a predicate evaluated on every profile.
+
+Anchors live in a fixed-degree grid (``AnchorGrid``).  "Profiles within R km of
+this anchor" is answered from the cells overlapping the query's bounding box,
+and the exact distances it returns are shared by the proximity filter and the
+anchor bonus.
+"""
+import threading
+from dataclasses import dataclass, field
+from math import floor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from ..utils.geo import bounding_box, coords, haversine_many_km
+from ..utils.keyword_filter import normalize_city
+from ..utils.num import as_int
+
+MISSING = -1     # code for an absent value
+UNKNOWN = -2     # code for a query value the snapshot has never seen
+
+ANCHOR_CELL_DEG = 0.1   # ~11 km of latitude per grid cell
+
+
+def _p_budget(p: Dict[str, Any]) -> Any:
+    # Firestore may store "budget_PKR" (capital) — support both
+    return p.get("budget_pkr") or p.get("budget_PKR") or p.get("budget")
+
+
+def pct_diff_many(a, budgets: np.ndarray) -> np.ndarray:
+    """Vectorized ``_pct_diff`` of one budget against many (0 = missing)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pct = np.abs(a - budgets) / np.maximum(a, budgets)
+    return np.where(budgets == 0, 1.0, pct)
+
+
+class BudgetBucket:
+    """Rows of one index bucket, sorted by budget for range lookups."""
+
+    def __init__(self, rows: np.ndarray, budget: np.ndarray):
+        rows = np.asarray(rows, dtype=np.int64)
+        b = budget[rows]
+        priced = b > 0
+        order = np.argsort(b[priced], kind="stable")
+        self.rows = rows
+        self.sorted_rows = rows[priced][order]
+        self.sorted_budget = b[priced][order]
+        # Missing budgets are always "close"; negative ones are checked exactly.
+        self.unpriced_rows = rows[b == 0]
+        self.irregular_rows = rows[b < 0]
+        self._budget = budget
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def window(self, q_budget, tol: float) -> np.ndarray:
+        """Rows whose budget passes ``budget_close(q_budget, b, tol)``, in row order."""
+        if not q_budget:
+            return self.rows
+        if q_budget < 0:
+            pct = pct_diff_many(q_budget, self._budget[self.rows])
+            return self.rows[(self._budget[self.rows] == 0) | (pct <= tol)]
+
+        # |q - b| / max(q, b) <= tol  <=>  q * (1 - tol) <= b <= q / (1 - tol)
+        lo = q_budget * (1.0 - tol)
+        hi = q_budget / (1.0 - tol) if tol < 1.0 else np.inf
+        # Widen by a hair and re-check exactly so float rounding never drops a row.
+        start = np.searchsorted(self.sorted_budget, lo * (1.0 - 1e-9), side="left")
+        stop = np.searchsorted(self.sorted_budget, hi * (1.0 + 1e-9), side="right")
+        rows = self.sorted_rows[start:stop]
+        rows = rows[pct_diff_many(q_budget, self.sorted_budget[start:stop]) <= tol]
+
+        extra = [self.unpriced_rows]
+        if self.irregular_rows.size:
+            irr = self.irregular_rows
+            extra.append(irr[pct_diff_many(q_budget, self._budget[irr]) <= tol])
+        return np.sort(np.concatenate([rows, *extra]))
+
+
+_EMPTY_BUCKET_ROWS = np.zeros(0, dtype=np.int64)
+
+
+class AnchorGrid:
+    """Fixed-degree grid over anchor coordinates for radius queries."""
+
+    def __init__(self, lats: np.ndarray, lngs: np.ndarray, cell_deg: float = ANCHOR_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.lats = lats
+        self.lngs = lngs
+        cells: Dict[Tuple[int, int], List[int]] = {}
+        valid = np.flatnonzero(~(np.isnan(lats) | np.isnan(lngs)))
+        for i, ci, cj in zip(valid.tolist(), self._cell(lats[valid]).tolist(), self._cell(lngs[valid]).tolist()):
+            cells.setdefault((ci, cj), []).append(i)
+        self.cells = {key: np.asarray(rows, dtype=np.int64) for key, rows in cells.items()}
+
+    def _cell(self, deg):
+        return np.floor(np.asarray(deg) / self.cell_deg).astype(np.int64)
+
+    def within(self, loc: Any, radius_km: float) -> Tuple[np.ndarray, np.ndarray]:
+        """``(rows, distances_km)`` of anchors within ``radius_km`` of ``loc``, rows ascending."""
+        try:
+            lat, lng = float(loc["lat"]), float(loc["lng"])
+        except Exception:
+            return _EMPTY_BUCKET_ROWS, np.zeros(0)
+        if np.isnan(lat) or np.isnan(lng) or not self.cells:
+            return _EMPTY_BUCKET_ROWS, np.zeros(0)
+
+        lat_lo, lat_hi, lng_lo, lng_hi = bounding_box(lat, lng, radius_km)
+        i_lo, i_hi = floor(lat_lo / self.cell_deg), floor(lat_hi / self.cell_deg)
+        if lng_hi - lng_lo >= 360.0:
+            in_box = [rows for (ci, _), rows in self.cells.items() if i_lo <= ci <= i_hi]
+        else:
+            j_lo, j_hi = floor(lng_lo / self.cell_deg), floor(lng_hi / self.cell_deg)
+            # Boxes crossing the antimeridian wrap around; compare modulo the grid width.
+            width = round(360.0 / self.cell_deg)
+            span = j_hi - j_lo + 1
+            if (i_hi - i_lo + 1) * span <= len(self.cells):
+                in_box = [
+                    self.cells[(ci, cj)]
+                    for ci in range(i_lo, i_hi + 1)
+                    for cj in self._wrapped(j_lo, j_hi, width)
+                    if (ci, cj) in self.cells
+                ]
+            else:
+                in_box = [
+                    rows for (ci, cj), rows in self.cells.items()
+                    if i_lo <= ci <= i_hi and (cj - j_lo) % width < span
+                ]
+        if not in_box:
+            return _EMPTY_BUCKET_ROWS, np.zeros(0)
+
+        rows = np.sort(np.concatenate(in_box))
+        d = haversine_many_km(lat, lng, self.lats[rows], self.lngs[rows])
+        keep = d <= radius_km
+        return rows[keep], d[keep]
+
+    @staticmethod
+    def _wrapped(j_lo: int, j_hi: int, width: int) -> List[int]:
+        cols = list(range(j_lo, j_hi + 1))
+        half = width // 2
+        # Map columns beyond +/-180 degrees back onto the stored range.
+        return [((cj + half) % width) - half for cj in cols]
+
+
+@dataclass
+class ProfileIndex:
+    profiles: List[Dict[str, Any]]
+    city: np.ndarray          # int32 code of normalize_city(city)
+    role: np.ndarray          # int32 code of the raw role value
+    budget: np.ndarray        # float64, 0.0 when missing
+    anchor_lat: np.ndarray    # float64, NaN when missing/invalid
+    anchor_lng: np.ndarray
+    has_anchor: np.ndarray    # bool, profile carries a (truthy) anchor_location
+    city_codes: Dict[str, int]
+    role_codes: Dict[Any, int]
+    by_city: Dict[int, BudgetBucket] = field(default_factory=dict)
+    by_city_role: Dict[Tuple[int, int], BudgetBucket] = field(default_factory=dict)
+    everything: Optional[BudgetBucket] = None
+    anchor_grid: Optional[AnchorGrid] = None
+    id_rows: Dict[str, int] = field(default_factory=dict)
+    _derived: Dict[str, Any] = field(default_factory=dict, repr=False)
+    _derived_lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if not self.id_rows:
+            for i, p in enumerate(self.profiles):
+                pid = p.get("id")
+                if pid is not None:
+                    self.id_rows.setdefault(pid, i)
+        if self.everything is None:
+            self._build_buckets()
+        if self.anchor_grid is None:
+            self.anchor_grid = AnchorGrid(self.anchor_lat, self.anchor_lng)
+
+    def _build_buckets(self) -> None:
+        self.everything = BudgetBucket(np.arange(len(self.profiles)), self.budget)
+        city_rows: Dict[int, List[int]] = {}
+        pair_rows: Dict[Tuple[int, int], List[int]] = {}
+        for i, (c, r) in enumerate(zip(self.city.tolist(), self.role.tolist())):
+            if c == MISSING:
+                continue
+            city_rows.setdefault(c, []).append(i)
+            pair_rows.setdefault((c, r), []).append(i)
+        self.by_city = {c: BudgetBucket(rows, self.budget) for c, rows in city_rows.items()}
+        self.by_city_role = {key: BudgetBucket(rows, self.budget) for key, rows in pair_rows.items()}
+
+    @classmethod
+    def build(cls, profiles: List[Dict[str, Any]]) -> "ProfileIndex":
+        profiles = list(profiles or [])
+        n = len(profiles)
+        city_codes: Dict[str, int] = {}
+        role_codes: Dict[Any, int] = {}
+        city = np.full(n, MISSING, dtype=np.int32)
+        role = np.full(n, MISSING, dtype=np.int32)
+        budget = np.zeros(n, dtype=np.float64)
+        anchor_lat = np.full(n, np.nan, dtype=np.float64)
+        anchor_lng = np.full(n, np.nan, dtype=np.float64)
+        has_anchor = np.zeros(n, dtype=bool)
+
+        for i, p in enumerate(profiles):
+            pc = normalize_city(p.get("city") or "")
+            if pc:
+                city[i] = city_codes.setdefault(pc, len(city_codes))
+            prole = p.get("role")
+            if prole:
+                role[i] = role_codes.setdefault(prole, len(role_codes))
+            budget[i] = as_int(_p_budget(p)) or 0
+            anchor = p.get("anchor_location")
+            if anchor:
+                has_anchor[i] = True
+                anchor_lat[i], anchor_lng[i] = coords(anchor) or (np.nan, np.nan)
+
+        return cls(
+            profiles=profiles,
+            city=city,
+            role=role,
+            budget=budget,
+            anchor_lat=anchor_lat,
+            anchor_lng=anchor_lng,
+            has_anchor=has_anchor,
+            city_codes=city_codes,
+            role_codes=role_codes,
+        )
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+    def city_code(self, city: Optional[str]) -> int:
+        pc = normalize_city(city or "")
+        if not pc:
+            return MISSING
+        return self.city_codes.get(pc, UNKNOWN)
+
+    def role_code(self, role: Any) -> int:
+        if not role:
+            return MISSING
+        return self.role_codes.get(role, UNKNOWN)
+
+    def city_rows(self, city_code: int) -> np.ndarray:
+        bucket = self.by_city.get(city_code)
+        return bucket.rows if bucket is not None else _EMPTY_BUCKET_ROWS
+
+    def budget_window(self, q_budget, tol: float, city_code: Optional[int] = None, role_code: Optional[int] = None) -> np.ndarray:
+        """Rows within the budget tolerance, optionally restricted to a city/(city, role) bucket."""
+        if city_code is None:
+            bucket = self.everything
+        elif role_code is None:
+            bucket = self.by_city.get(city_code)
+        else:
+            bucket = self.by_city_role.get((city_code, role_code))
+        if bucket is None:
+            return _EMPTY_BUCKET_ROWS
+        return bucket.window(q_budget, tol)
+
+    def anchor_distances(self, loc: Any, rows: np.ndarray, radius_km: float) -> np.ndarray:
+        """Anchor distance of each row to ``loc``; ``inf`` beyond ``radius_km`` or without coordinates."""
+        near, d = self.anchor_grid.within(loc, radius_km)
+        out = np.full(len(rows), np.inf)
+        if near.size and len(rows):
+            pos = np.minimum(np.searchsorted(near, rows), near.size - 1)
+            found = near[pos] == rows
+            out[found] = d[pos[found]]
+        return out
+
+    def rows_for_ids(self, ids: Iterable[Any]) -> np.ndarray:
+        """Rows of the given profile ids in the given order; unknown ids are skipped."""
+        rows = [self.id_rows.get(pid) for pid in ids]
+        return np.asarray([r for r in rows if r is not None], dtype=np.int64)
+
+    def derived(self, name: str, build: Callable[[List[Dict[str, Any]]], Any]) -> Any:
+        """Per-snapshot artefact built by other agents (e.g. encoded match fields), memoized by name.
+
+        Built once: concurrent callers wait for the first build instead of repeating it.
+        """
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build(self.profiles)
+        return value
+
+    def take(self, rows: np.ndarray) -> List[Dict[str, Any]]:
+        return [self.profiles[i] for i in rows]
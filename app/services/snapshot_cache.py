@@ -0,0 +1,156 @@
+# app/services/snapshot_cache.py
+"""Stale-while-revalidate holder for the serving snapshot.
+
+The API used to refresh profiles and listings inline: the first request after
+the TTL expired paid for the Firestore scans and index builds, and every
+request queued behind the cache lock waited with it.  ``SnapshotCache`` keeps
+the last good snapshot and rebuilds it off the request path, either from a
+periodic background thread or from a one-shot refresh kicked by a request
+that saw a stale snapshot.  A rebuilt snapshot replaces the old one with a
+single reference swap, so readers never observe a half-built state, and a
+failed rebuild keeps serving the previous one.
+
+Only the very first load, when there is nothing to serve yet, blocks the
+caller.
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class SnapshotCache(Generic[T]):
+    def __init__(self, build: Callable[[], T], ttl_sec: float, retry_sec: Optional[float] = None):
+        self._build = build
+        self.ttl_sec = ttl_sec
+        # After a failed rebuild, stale reads wait this long before trying again.
+        self.retry_sec = retry_sec if retry_sec is not None else min(ttl_sec, 30.0)
+        self._snapshot: Optional[T] = None
+        self._built_at = 0.0
+        self._refresh_lock = threading.Lock()   # one rebuild at a time
+        self._state_lock = threading.Lock()
+        self._refreshing = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refreshes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_duration_ms: Optional[float] = None
+        self.last_attempt_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    # ---------------- Reads ----------------
+    @property
+    def snapshot(self) -> Optional[T]:
+        return self._snapshot
+
+    def age_sec(self) -> Optional[float]:
+        return time.time() - self._built_at if self._snapshot is not None else None
+
+    def is_stale(self) -> bool:
+        age = self.age_sec()
+        return age is None or age >= self.ttl_sec
+
+    def get(self) -> T:
+        """The current snapshot; a stale one is served while a refresh runs in the background."""
+        snap = self._snapshot
+        if snap is None:
+            return self._refresh(only_if_stale=True)
+        if self.is_stale() and not self._backing_off():
+            self.refresh_async()
+        return snap
+
+    def _backing_off(self) -> bool:
+        last = self.last_attempt_at
+        return bool(self.consecutive_failures) and last is not None and time.time() - last < self.retry_sec
+
+    # ---------------- Refresh ----------------
+    def refresh(self) -> T:
+        """Rebuild now and swap the result in; raises only when there is no snapshot to fall back to."""
+        return self._refresh(only_if_stale=False)
+
+    def _refresh(self, only_if_stale: bool) -> T:
+        with self._refresh_lock:
+            if only_if_stale and not self.is_stale():
+                # Another caller rebuilt it while we waited for the lock.
+                return self._snapshot
+            started = time.perf_counter()
+            self.last_attempt_at = time.time()
+            try:
+                snap = self._build()
+            except Exception as exc:
+                with self._state_lock:
+                    self.failures += 1
+                    self.consecutive_failures += 1
+                    self.last_error = f"{type(exc).__name__}: {exc}"
+                    self.last_duration_ms = (time.perf_counter() - started) * 1000.0
+                if self._snapshot is None:
+                    raise
+                return self._snapshot
+            with self._state_lock:
+                self._snapshot = snap
+                self._built_at = time.time()
+                self.refreshes += 1
+                self.consecutive_failures = 0
+                self.last_error = None
+                self.last_duration_ms = (time.perf_counter() - started) * 1000.0
+            return snap
+
+    def refresh_async(self) -> bool:
+        """Start a one-shot background refresh unless one is already running."""
+        with self._state_lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="snapshot-refresh", daemon=True).start()
+        return True
+
+    def _refresh_in_background(self) -> None:
+        try:
+            self._refresh(only_if_stale=True)
+        except Exception:
+            pass  # recorded in the failure counters
+        finally:
+            with self._state_lock:
+                self._refreshing = False
+
+    # ---------------- Periodic refresher ----------------
+    def start(self, interval_sec: Optional[float] = None) -> None:
+        """Refresh every ``interval_sec`` (default: the TTL) on a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        interval = max(1.0, float(interval_sec if interval_sec is not None else self.ttl_sec))
+        self._stop.clear()
+
+        def _loop() -> None:
+            while not self._stop.wait(interval):
+                try:
+                    self.refresh()
+                except Exception:
+                    pass  # recorded in the failure counters
+
+        self._thread = threading.Thread(target=_loop, name="snapshot-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        age = self.age_sec()
+        with self._state_lock:
+            return {
+                "cache_age_sec": max(0, int(age)) if age is not None else None,
+                "cache_ttl_sec": self.ttl_sec,
+                "refreshes": self.refreshes,
+                "refresh_failures": self.failures,
+                "consecutive_refresh_failures": self.consecutive_failures,
+                "last_refresh_duration_ms": round(self.last_duration_ms, 2) if self.last_duration_ms is not None else None,
+                "last_refresh_attempt_at": self.last_attempt_at,
+                "last_refresh_error": self.last_error,
+                "refresh_in_flight": self._refreshing,
+                "background_refresher": self._thread is not None and self._thread.is_alive(),
+            }
@@ -0,0 +1,109 @@
+# app/utils/context.py
+"""Request-scoped state shared by the pipeline stages.
+
+A :class:`PipelineContext` lives for one ``run_pipeline`` call.  Retrieval,
+scoring, red flags, room ranking and commute enrichment all measure the same
+seeker-to-entity distances; the context memoizes them by entity id so each
+pair is computed once per request, and reports hit counts for the trace.
+Stages may run on different threads, so updates go through a lock.
+"""
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .geo import distances_from, haversine_km
+
+SEEKER = "seeker"
+
+
+@dataclass
+class PipelineContext:
+    seeker: Optional[Dict[str, Any]] = None
+    distance_hits: int = 0
+    distance_misses: int = 0
+    _km: Dict[Tuple[str, str], float] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    # ---------------- Keys ----------------
+    def key(self, entity: Optional[Dict[str, Any]], loc_field: str, kind: str = "profile") -> Optional[str]:
+        """Cache key for ``entity``'s location field; ``None`` when it has no usable id."""
+        if entity is None:
+            return None
+        if entity is self.seeker:
+            return f"{SEEKER}/{loc_field}"
+        if kind == "listing":
+            eid = entity.get("listing_id") or entity.get("id")
+        else:
+            eid = entity.get("id")
+        if not eid or eid == "-":
+            return None
+        return f"{kind}:{eid}/{loc_field}"
+
+    # ---------------- Distances ----------------
+    def distance(self, a_key: Optional[str], a_loc: Any, b_key: Optional[str], b_loc: Any) -> float:
+        """:func:`haversine_km` between two locations, memoized by their keys."""
+        if a_key is None or b_key is None:
+            with self._lock:
+                self.distance_misses += 1
+            return haversine_km(a_loc, b_loc)
+        pair = (a_key, b_key)
+        d = self._km.get(pair)
+        if d is not None:
+            with self._lock:
+                self.distance_hits += 1
+            return d
+        d = haversine_km(a_loc, b_loc)
+        with self._lock:
+            self.distance_misses += 1
+            self._km[pair] = d
+        return d
+
+    def pair_km(self, a: Dict[str, Any], b: Dict[str, Any], loc_field: str = "anchor_location") -> float:
+        """Distance between two profiles' ``loc_field`` locations."""
+        return self.distance(self.key(a, loc_field), a.get(loc_field), self.key(b, loc_field), b.get(loc_field))
+
+    def distances(
+        self,
+        a_key: Optional[str],
+        a_loc: Any,
+        b_keys: Sequence[Optional[str]],
+        lats: np.ndarray,
+        lngs: np.ndarray,
+    ) -> np.ndarray:
+        """Distances from one location to many; cached pairs are reused, the rest
+        are computed in a single kernel call and remembered."""
+        out = np.empty(len(b_keys))
+        missing: List[int] = []
+        for i, b_key in enumerate(b_keys):
+            d = self._km.get((a_key, b_key)) if a_key is not None and b_key is not None else None
+            if d is None:
+                missing.append(i)
+            else:
+                out[i] = d
+        with self._lock:
+            self.distance_hits += len(b_keys) - len(missing)
+            self.distance_misses += len(missing)
+        if missing:
+            idx = np.asarray(missing, dtype=np.int64)
+            out[idx] = distances_from(a_loc, lats[idx], lngs[idx])
+            self.remember(a_key, [b_keys[i] for i in missing], out[idx])
+        return out
+
+    def remember(self, a_key: Optional[str], b_keys: Iterable[Optional[str]], dists: Iterable[float]) -> None:
+        """Record distances computed elsewhere (e.g. by a spatial index)."""
+        if a_key is None:
+            return
+        with self._lock:
+            for b_key, d in zip(b_keys, dists):
+                if b_key is not None:
+                    self._km[(a_key, b_key)] = float(d)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "distance_hits": self.distance_hits,
+                "distance_misses": self.distance_misses,
+                "distances_cached": len(self._km),
+            }
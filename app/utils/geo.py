@@ -0,0 +1,104 @@
+# app/utils/geo.py
+"""Great-circle distances shared by every agent.
+
+``haversine_km`` is the scalar path used for single pairs; it keeps the
+historical contract of returning ``9999`` when either location lacks usable
+coordinates.  ``haversine_many_km`` (one-to-many) and ``haversine_matrix_km``
+(many-to-many) evaluate the same formula over NumPy arrays, with NaN marking
+invalid coordinates.  ``bounding_box`` / ``in_bbox`` give a cheap lat/lng
+prefilter so exact distances are only computed for points that can be within
+a radius.
+"""
+from math import asin, atan2, cos, degrees, radians, sin, sqrt
+from typing import Any, Iterable, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+INVALID_KM = 9999   # distance reported for missing/invalid coordinates
+
+
+def coords(loc: Any) -> Optional[Tuple[float, float]]:
+    """``(lat, lng)`` as floats, or ``None`` when ``loc`` has no usable coordinates."""
+    try:
+        return float(loc["lat"]), float(loc["lng"])
+    except Exception:
+        return None
+
+
+def coords_array(locs: Iterable[Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Latitude and longitude columns for ``locs``; NaN where coordinates are invalid."""
+    pairs = [coords(loc) or (np.nan, np.nan) for loc in locs]
+    if not pairs:
+        return np.zeros(0), np.zeros(0)
+    arr = np.asarray(pairs, dtype=float)
+    return arr[:, 0], arr[:, 1]
+
+
+def haversine_km(loc1: Any, loc2: Any) -> float:
+    """Distance in km between two lat/lng dicts (``9999`` if either is invalid)."""
+    p1, p2 = coords(loc1), coords(loc2)
+    if p1 is None or p2 is None:
+        return INVALID_KM
+    lat1, lon1 = p1
+    lat2, lon2 = p2
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+    return EARTH_RADIUS_KM * c
+
+
+def haversine_many_km(lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """Distances from one point to many; NaN where a coordinate is NaN."""
+    dlat = np.radians(lats - lat)
+    dlon = np.radians(lngs - lng)
+    a = np.sin(dlat/2)**2 + cos(radians(lat)) * np.cos(np.radians(lats)) * np.sin(dlon/2)**2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+
+def haversine_matrix_km(lats1: np.ndarray, lngs1: np.ndarray, lats2: np.ndarray, lngs2: np.ndarray) -> np.ndarray:
+    """``len(lats1) x len(lats2)`` distance matrix; NaN where a coordinate is NaN."""
+    lat1 = np.asarray(lats1, dtype=float)[:, None]
+    lng1 = np.asarray(lngs1, dtype=float)[:, None]
+    lat2 = np.asarray(lats2, dtype=float)[None, :]
+    lng2 = np.asarray(lngs2, dtype=float)[None, :]
+    dlat = np.radians(lat2 - lat1)
+    dlon = np.radians(lng2 - lng1)
+    a = np.sin(dlat/2)**2 + np.cos(np.radians(lat1)) * np.cos(np.radians(lat2)) * np.sin(dlon/2)**2
+    return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+
+def distances_from(loc: Any, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    """:func:`haversine_km` of ``loc`` against many points, ``9999`` where either side is invalid."""
+    p = coords(loc)
+    if p is None:
+        return np.full(len(lats), float(INVALID_KM))
+    d = haversine_many_km(p[0], p[1], lats, lngs)
+    return np.where(np.isnan(d), float(INVALID_KM), d)
+
+
+def bounding_box(lat: float, lng: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """``(lat_lo, lat_hi, lng_lo, lng_hi)`` enclosing every point within ``radius_km``.
+
+    Longitudes are not wrapped, so a box crossing the antimeridian extends
+    past +/-180; near the poles the longitude range covers the full circle.
+    """
+    # Slightly padded so float rounding at the box edge never hides a point.
+    ang = radius_km / EARTH_RADIUS_KM * (1 + 1e-9) + 1e-12
+    dlat = degrees(ang)
+    lat_lo, lat_hi = lat - dlat, lat + dlat
+    if lat_lo <= -90 or lat_hi >= 90 or ang >= np.pi / 2:
+        return lat_lo, lat_hi, -180.0, 180.0
+    dlng = degrees(asin(min(1.0, sin(ang) / cos(radians(lat)))))
+    return lat_lo, lat_hi, lng - dlng, lng + dlng
+
+
+def in_bbox(lats: np.ndarray, lngs: np.ndarray, box: Tuple[float, float, float, float]) -> np.ndarray:
+    """Mask of points inside ``box`` (from :func:`bounding_box`); NaN points are outside."""
+    lat_lo, lat_hi, lng_lo, lng_hi = box
+    inside = (lats >= lat_lo) & (lats <= lat_hi)
+    if lng_hi - lng_lo >= 360.0:
+        return inside & ~np.isnan(lngs)
+    # Compare modulo 360 so boxes crossing the antimeridian wrap around.
+    return inside & (np.mod(lngs - lng_lo, 360.0) <= lng_hi - lng_lo)
@@ -0,0 +1,94 @@
+# app/utils/metrics.py
+"""Process-wide pipeline instrumentation.
+
+Every ``run_pipeline`` call reports its per-stage wall times and a few
+counters (requests, retrieval methods, distance cache hits) to
+:data:`STAGE_METRICS`.  Latencies are kept in a bounded window of recent
+samples per stage, from which ``/healthz`` and ``/metrics`` read p50/p95/p99.
+Firestore client creation and calls report here too, as ``firestore.*``.
+
+Per-request span detail in the trace (counts in/out of each stage, retrieval
+method and fallback) is opt-in via ``TRACE_SPANS=true`` or the
+``trace_spans`` argument of ``run_pipeline``.
+"""
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+import numpy as np
+
+WINDOW = int(os.getenv("METRICS_WINDOW", "2048"))   # recent samples kept per stage
+
+
+def span_detail_enabled(flag: Optional[bool] = None) -> bool:
+    if flag is not None:
+        return flag
+    return os.getenv("TRACE_SPANS", "false").lower() == "true"
+
+
+class LatencyWindow:
+    """Recent latency samples of one stage plus lifetime count/total/max."""
+
+    def __init__(self, size: int = WINDOW):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def summary(self) -> Dict[str, Any]:
+        if self.samples:
+            p50, p95, p99 = np.percentile(np.fromiter(self.samples, dtype=float), (50, 95, 99))
+        else:
+            p50 = p95 = p99 = 0.0
+        return {
+            "count": self.count,
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class StageMetrics:
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._latency: Dict[str, LatencyWindow] = {}
+        self._counters: Dict[str, int] = {}
+
+    def observe(self, stage: str, ms: float) -> None:
+        with self._lock:
+            hist = self._latency.get(stage)
+            if hist is None:
+                hist = self._latency[stage] = LatencyWindow(self.window)
+            hist.observe(ms)
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def latency(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {stage: hist.summary() for stage, hist in sorted(self._latency.items())}
+
+    def snapshot(self) -> Dict[str, Any]:
+        latency = self.latency()
+        with self._lock:
+            counters = dict(sorted(self._counters.items()))
+        return {"latency_ms": latency, "counters": counters, "window": self.window}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._latency.clear()
+            self._counters.clear()
+
+
+STAGE_METRICS = StageMetrics()
@@ -0,0 +1,146 @@
+# app/utils/stages.py
+"""Tiny stage DAG executor for the matchmaking pipeline.
+
+``run_pipeline`` has two independent branches: retrieval -> scoring ->
+explanations for the matches, and room ranking -> commute enrichment for the
+listings.  :func:`run_stages` runs every stage as soon as the stages it
+depends on have finished and reports each stage's wall time.  Stages marked
+``inline`` (the request's critical chain) run on the calling thread; the
+others go to one bounded thread pool shared by all requests, so the pool
+size caps side work only, never how many requests make progress at once.
+
+Stages never wait on each other inside the pool: the calling thread submits
+a stage only once its dependencies are done, so a saturated pool queues work
+instead of deadlocking.  ``PIPELINE_WORKERS=0`` runs the stages one after
+another on the calling thread.
+"""
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+_POOL: Optional[ThreadPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def _after_fork_in_child() -> None:
+    # The inherited executor has no live threads (and will not start any), and
+    # the lock may have been held by another parent thread at fork time.
+    global _POOL, _POOL_LOCK
+    _POOL, _POOL_LOCK = None, threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def pipeline_workers() -> int:
+    return max(0, int(os.getenv("PIPELINE_WORKERS", "4")))
+
+
+def shared_pool() -> Optional[ThreadPoolExecutor]:
+    """The process-wide stage pool (``None`` when ``PIPELINE_WORKERS=0``)."""
+    global _POOL
+    workers = pipeline_workers()
+    if workers == 0:
+        return None
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pipeline-stage")
+        return _POOL
+
+
+@dataclass(frozen=True)
+class Stage:
+    """``fn(results)`` runs once every stage named in ``after`` is in ``results``.
+
+    ``inline`` stages run on the thread that called :func:`run_stages`.
+    """
+
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    after: Tuple[str, ...] = ()
+    inline: bool = False
+
+
+def _timed(stage: Stage, results: Dict[str, Any]) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    out = stage.fn(results)
+    return out, (time.perf_counter() - start) * 1000.0
+
+
+def run_stages(
+    stages: Sequence[Stage], pool: Optional[ThreadPoolExecutor] = None
+) -> Tuple[Dict[str, Any], Dict[str, float]]:
+    """Run ``stages`` respecting ``after``; returns ``(results, wall_ms)`` keyed by stage name.
+
+    The first exception raised by a stage propagates once the running stages
+    have finished; stages that have not started yet are dropped.
+    """
+    by_name = {s.name: s for s in stages}
+    for s in stages:
+        missing = [d for d in s.after if d not in by_name]
+        if missing:
+            raise ValueError(f"stage {s.name!r} depends on unknown stage(s) {missing}")
+
+    results: Dict[str, Any] = {}
+    wall_ms: Dict[str, float] = {}
+    pending: List[Stage] = list(stages)
+
+    def _ready() -> List[Stage]:
+        ready = [s for s in pending if all(d in results for d in s.after)]
+        for s in ready:
+            pending.remove(s)
+        return ready
+
+    if pool is None:
+        while pending:
+            ready = _ready()
+            if not ready:
+                raise ValueError(f"stage cycle among {[s.name for s in pending]}")
+            for s in ready:
+                results[s.name], wall_ms[s.name] = _timed(s, results)
+        return results, wall_ms
+
+    running: Dict[Future, Stage] = {}
+    error: Optional[BaseException] = None
+
+    def _collect(done) -> None:
+        nonlocal error
+        for fut in done:
+            s = running.pop(fut)
+            try:
+                results[s.name], wall_ms[s.name] = fut.result()
+            except BaseException as exc:  # noqa: BLE001 - re-raised below
+                error = error or exc
+
+    while True:
+        if error is None:
+            local: List[Stage] = []
+            for s in _ready():
+                if s.inline:
+                    local.append(s)
+                else:
+                    # Stages only read ``results`` for their finished dependencies.
+                    running[pool.submit(_timed, s, dict(results))] = s
+            if local:
+                # One inline stage at a time; the rest wait for the next round.
+                pending[:0] = local[1:]
+                s = local[0]
+                try:
+                    results[s.name], wall_ms[s.name] = _timed(s, results)
+                except BaseException as exc:  # noqa: BLE001 - re-raised below
+                    error = exc
+                _collect([fut for fut in running if fut.done()])
+                continue
+        if not running:
+            break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        _collect(done)
+    if error is not None:
+        raise error
+    if pending:
+        raise ValueError(f"stage cycle among {[s.name for s in pending]}")
+    return results, wall_ms
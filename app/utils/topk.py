@@ -0,0 +1,30 @@
+# app/utils/topk.py
+"""Partial top-k selection that matches a full stable sort.
+
+Ranking stages only ever return the first few items of a sorted list.  These
+helpers select those items in O(n) with NumPy ``partition`` and only sort
+the selection, while keeping exactly the order a stable sort would produce:
+ties keep their original position.
+"""
+from typing import Sequence
+
+import numpy as np
+
+
+def top_k_lexsort(keys: Sequence[np.ndarray], k: int) -> np.ndarray:
+    """``np.lexsort(keys)[:k]`` (last key primary, ascending) without sorting everything."""
+    primary = np.asarray(keys[-1])
+    n = len(primary)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k >= n:
+        return np.lexsort(keys)
+    kth = np.partition(primary, k - 1)[k - 1]
+    # Everything tied with the k-th primary value stays in play for the secondary keys.
+    cand = np.flatnonzero(~(primary > kth))
+    return cand[np.lexsort(tuple(np.asarray(key)[cand] for key in keys))][:k]
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """``np.argsort(-scores, kind="stable")[:k]``: highest first, ties by position."""
+    return top_k_lexsort((-np.asarray(scores),), k)
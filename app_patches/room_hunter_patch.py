@@ -1,4 +1,4 @@
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 from .model_registry import ModelRegistry
 
@@ -16,8 +16,32 @@ def features(profile: Dict, listing: Dict):
     price_ratio = (rent / (pb*2)) if pb else 1.5
     return np.array([float(pb), float(rent), float(j), float(same_city), float(price_ratio)], dtype="float32")
 
+def features_matrix(profile: Dict, listings: List[Dict]) -> np.ndarray:
+    """``features()`` for every listing at once: an ``(n, 5)`` float32 matrix."""
+    n = len(listings)
+    pb = profile.get("budget_pkr") or 0
+    rent = np.array([float(L.get("monthly_rent_PKR") or L.get("monthly_rent_pkr") or 0) for L in listings], dtype=float)
+    pam = set([x.lower() for x in (profile.get("amenities") or [])])
+    j = np.zeros(n)
+    if pam:
+        for i, L in enumerate(listings):
+            amen = set([x.lower() for x in L.get("amenities") or []])
+            j[i] = len(amen & pam) / (len(amen | pam) or 1)
+    qcity = profile.get("city")
+    if qcity:
+        qcity = qcity.lower()
+        same_city = np.array([1.0 if (L.get("city") and L["city"].lower() == qcity) else 0.0 for L in listings])
+    else:
+        same_city = np.zeros(n)
+    price_ratio = rent / (pb*2) if pb else np.full(n, 1.5)
+    return np.column_stack([np.full(n, float(pb)), rent, j, same_city, price_ratio]).astype("float32")
+
+def _predict(mdl, X: np.ndarray) -> np.ndarray:
+    # LightGBM and sklearn both return one score per row for a 2-D input.
+    return np.asarray(mdl.predict(X), dtype=float).reshape(-1)
+
 def score_listing(profile: Dict, listing: Dict) -> float:
-    mdl, meta = REG.listing_ranker()
+    mdl, _ = REG.listing_ranker()
     if mdl is None:
         # fallback rule
         rent = listing.get("monthly_rent_PKR") or 0
@@ -26,9 +50,25 @@ def score_listing(profile: Dict, listing: Dict) -> float:
         return -(price_pen/1000.0)
     x = features(profile, listing).reshape(1,-1)
     try:
-        if meta and meta.get("type")=="lightgbm":
-            return float(mdl.predict(x))
-        else:
-            return float(mdl.predict(x)[0])
+        return float(_predict(mdl, x)[0])
     except Exception:
         return 0.0
+
+def score_listings(profile: Dict, listings: List[Dict]) -> Optional[np.ndarray]:
+    """Learned scores for many listings with a single ``predict`` call.
+
+    Returns ``None`` when no ranker is installed or inference fails, so the
+    caller keeps its rule score.
+    """
+    mdl, _ = REG.listing_ranker()
+    if mdl is None:
+        return None
+    if not listings:
+        return np.zeros(0)
+    try:
+        scores = _predict(mdl, features_matrix(profile, listings))
+    except Exception:
+        return None
+    if len(scores) != len(listings):
+        return None
+    return scores
@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+
+from app.services import faiss_store
+from app.services.faiss_store import FaissStore
+
+
+class _Index:
+    def __init__(self, n):
+        self.ntotal = n
+
+    def search(self, qv, k):
+        return np.zeros((1, k)), np.array([list(range(min(k, self.ntotal)))])
+
+
+class _Faiss:
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def read_index(self, path):
+        return _Index(self.sizes[-1])
+
+
+class _Model:
+    def encode(self, texts, **kwargs):
+        return np.zeros((len(texts), 4))
+
+
+def _write_snapshot(ids, mtime):
+    with open(faiss_store.SNAPSHOT_PATH, "w") as f:
+        f.write("idx")
+    with open(faiss_store.META_PATH, "w") as f:
+        json.dump({"ids": ids}, f)
+    os.utime(faiss_store.META_PATH, (mtime, mtime))
+
+
+def test_reload_swaps_index_ids_and_profiles_together(tmp_path, monkeypatch):
+    monkeypatch.setattr(faiss_store, "SNAPSHOT_PATH", str(tmp_path / "p.idx"))
+    monkeypatch.setattr(faiss_store, "META_PATH", str(tmp_path / "meta.json"))
+    store = FaissStore()   # the optional deps are stubbed below
+    sizes = [3]
+    store.faiss, store.model = _Faiss(sizes), _Model()
+    _write_snapshot(["a", "b", "c"], 1000)
+    store._snap = store._load_or_build()
+
+    profiles = [{"id": "a"}, {"id": "b"}, {"id": "c"}]
+    store.prime_profiles(profiles)
+    assert store.search_profile({}, k=3) == profiles
+
+    # Another process rewrites the snapshot without "b"; the serving cache follows.
+    sizes.append(2)
+    _write_snapshot(["c", "a"], 2000)
+    assert store.search_ids({}, k=3) == ["c", "a"]
+    assert sorted(store._snap.profiles) == ["a", "c"]   # re-primed, not emptied
+    store.prime_profiles([{"id": "a"}])
+    assert sorted(store._snap.profiles) == ["a"]         # deleted ids are evicted
@@ -0,0 +1,158 @@
+from app.agents.profile_reader import NormalizedProfile, normalize_profile
+from app.agents.red_flag import red_flags
+from app.services.firestore import fetch_all_profiles, fetch_by_id, fetch_by_ids
+
+
+def test_fetch_by_ids_matches_single_fetches():
+    profiles = fetch_all_profiles()
+    wanted = [profiles[2]["id"], profiles[0]["id"], "does-not-exist", None]
+
+    batch = fetch_by_ids(wanted)
+
+    assert set(batch) == {profiles[0]["id"], profiles[2]["id"]}
+    for pid, profile in batch.items():
+        assert profile == fetch_by_id(pid)
+    assert fetch_by_ids([]) == {}
+
+
+def test_fetched_profiles_are_normalized_once():
+    profiles = fetch_all_profiles()
+    for p in profiles:
+        assert isinstance(p, NormalizedProfile)
+        assert normalize_profile(p) is p
+        # Re-normalizing a plain copy is a fixed point, so skipping it is safe.
+        assert normalize_profile(dict(p)) == p
+    assert red_flags(profiles[0], profiles[1]) == red_flags(dict(profiles[0]), dict(profiles[1]))
+
+
+def _fake_firestore_sdk(monkeypatch):
+    import sys
+    import types
+
+    created = []
+
+    class Client:
+        def __init__(self, project=None):
+            created.append(self)
+
+    sdk = types.ModuleType("google.cloud.firestore")
+    sdk.Client = Client
+    google = sys.modules.get("google") or types.ModuleType("google")
+    cloud = sys.modules.get("google.cloud") or types.ModuleType("google.cloud")
+    monkeypatch.setattr(google, "cloud", cloud, raising=False)
+    monkeypatch.setattr(cloud, "firestore", sdk, raising=False)
+    monkeypatch.setitem(sys.modules, "google", google)
+    monkeypatch.setitem(sys.modules, "google.cloud", cloud)
+    monkeypatch.setitem(sys.modules, "google.cloud.firestore", sdk)
+    return created
+
+
+def test_client_pool_is_created_once_per_process(monkeypatch):
+    from app.services import firestore
+    from app.utils.metrics import STAGE_METRICS
+
+    created = _fake_firestore_sdk(monkeypatch)
+    monkeypatch.setenv("FIRESTORE_CLIENT_POOL_SIZE", "2")
+    firestore._reset_client_pool()
+    STAGE_METRICS.reset()
+    try:
+        clients = [firestore._client() for _ in range(6)]
+        assert len(created) == 2
+        assert clients[:2] == created and clients[2:4] == created   # round-robin over the pool
+        assert STAGE_METRICS.snapshot()["counters"]["firestore.clients_created"] == 2
+
+        # A forked child (different pid) builds its own channels.
+        monkeypatch.setattr(firestore, "_CLIENT_PID", -1)
+        firestore._client()
+        assert len(created) == 4
+    finally:
+        firestore._reset_client_pool()
+
+
+def test_forked_child_gets_a_fresh_client_lock(monkeypatch):
+    import os
+    import time
+
+    import pytest
+
+    from app.services import firestore
+
+    if not hasattr(os, "fork"):
+        pytest.skip("needs os.fork")
+    created = _fake_firestore_sdk(monkeypatch)
+    firestore._reset_client_pool()
+    # Simulate another thread (e.g. the background refresher) inside _client() at fork time.
+    with firestore._CLIENT_LOCK:
+        pid = os.fork()
+        if pid == 0:  # child
+            try:
+                firestore._client()
+                os._exit(0 if len(created) == 1 else 1)
+            finally:
+                os._exit(2)
+    try:
+        deadline = time.time() + 5
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            if done:
+                break
+            if time.time() > deadline:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+                pytest.fail("forked child deadlocked on the inherited client lock")
+            time.sleep(0.01)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    finally:
+        firestore._reset_client_pool()
+
+
+def test_firestore_calls_are_timed(monkeypatch):
+    from app.services import firestore
+    from app.utils.metrics import STAGE_METRICS
+
+    class Doc:
+        exists = True
+        id = "scope"
+
+        def to_dict(self):
+            return {"min_score": 70}
+
+    class Ref:
+        def collection(self, name):
+            return self
+
+        def document(self, name):
+            return self
+
+        def get(self):
+            return Doc()
+
+    STAGE_METRICS.reset()
+    monkeypatch.setattr(firestore, "USE_FIRESTORE", True)
+    monkeypatch.setattr(firestore, "_client", lambda: Ref())
+    assert firestore.fetch_watcher_config("scope") == {"min_score": 70}
+    assert STAGE_METRICS.latency()["firestore.fetch_watcher_config"]["count"] == 1
+
+
+def test_serving_projection_keeps_pipeline_results_and_defers_raw_text():
+    from app.graph import run_pipeline
+    from app.services.firestore import (
+        LISTING_SERVING_FIELDS,
+        PROFILE_SERVING_FIELDS,
+        fetch_all_listings,
+        fetch_profile_fields,
+    )
+
+    full, lean = fetch_all_profiles(), fetch_all_profiles(fields=PROFILE_SERVING_FIELDS)
+    listings, lean_listings = fetch_all_listings(), fetch_all_listings(fields=LISTING_SERVING_FIELDS)
+    assert any(p["raw_text"] for p in full) and not any(p["raw_text"] for p in lean)
+    for a, b in zip(full, lean):
+        assert {**a, "raw_text": ""} == b
+
+    for seeker in full[:8]:
+        want = run_pipeline(seeker, full, listings, top_k=4)
+        got = run_pipeline(seeker, lean, lean_listings, top_k=4)
+        assert got["matches"] == want["matches"] and got["rooms"] == want["rooms"]
+
+    texts = fetch_profile_fields([full[0]["id"], "missing"])
+    assert list(texts) == [full[0]["id"]] and texts[full[0]["id"]]["raw_text"] == full[0]["raw_text"]
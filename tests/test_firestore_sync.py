@@ -0,0 +1,131 @@
+from app.agents.profile_reader import normalize_profile
+from app.services.firestore import PROFILE_SERVING_FIELDS, _project, fetch_all_profiles
+from app.services.firestore_sync import CollectionMirror
+
+
+class FakeCollection:
+    """In-memory stand-in for the Firestore document source."""
+
+    def __init__(self):
+        self.docs = {}
+        self.clock = 0
+        self.scans = 0
+        self.queries = []
+
+    def put(self, doc_id, data, stamp=True):
+        if stamp:
+            self.clock += 1
+            data = {**data, "updated_at": self.clock}
+        self.docs[doc_id] = data
+
+    def stream_documents(self, collection, fields=None):
+        self.scans += 1
+        return [(k, _project(v, fields)) for k, v in sorted(self.docs.items())]
+
+    def stream_changed_documents(self, collection, field, since, fields=None):
+        self.queries.append(since)
+        changed = [(k, v) for k, v in self.docs.items() if v.get(field) is not None and v[field] >= since]
+        return [(k, _project(v, fields)) for k, v in sorted(changed, key=lambda kv: kv[1][field])]
+
+
+def _expected(source):
+    return [normalize_profile(d) for _, d in sorted(source.docs.items()) if not d.get("deleted")]
+
+
+def test_mirror_applies_only_changed_documents():
+    source = FakeCollection()
+    for i, p in enumerate(fetch_all_profiles()[:12]):
+        source.put(f"p{i:02d}", dict(p))
+    mirror = CollectionMirror("profiles", normalize=normalize_profile, source=source)
+
+    assert mirror.sync() and mirror.rows() == _expected(source)
+    assert source.scans == 1 and mirror.high_water == 12
+    untouched = mirror.rows()[5]
+
+    # Nothing new: the boundary document is re-read but is not a change.
+    assert not mirror.sync()
+    assert source.queries == [12] and source.scans == 1
+
+    source.put("p03", {**source.docs["p03"], "city": "Quetta"})
+    source.put("p99", {"id": "new", "city": "Lahore", "budget_pkr": "20k"})
+    source.put("p07", {**source.docs["p07"], "deleted": True})
+    assert mirror.sync()
+    assert mirror.rows() == _expected(source)
+    assert mirror.rows()[5] is untouched           # unchanged rows are not re-normalized
+    assert mirror.high_water == 15 and source.scans == 1
+    assert mirror.stats["deletes"] == 1
+
+
+def test_full_resync_catches_hard_deletes_and_unstamped_writes():
+    source = FakeCollection()
+    source.put("a", {"id": "a", "city": "Lahore"})
+    source.put("b", {"id": "b", "city": "Karachi"})
+    mirror = CollectionMirror("profiles", normalize=normalize_profile, source=source, full_sync_sec=3600)
+    mirror.sync()
+
+    del source.docs["a"]
+    source.put("c", {"id": "c"}, stamp=False)
+    assert not mirror.sync()                        # invisible to the cursor
+    assert mirror.sync(full=True)
+    assert mirror.rows() == _expected(source)
+
+
+def test_incremental_snapshot_reuses_unchanged_indexes(monkeypatch):
+    import app.main as main
+
+    profiles, listings = FakeCollection(), FakeCollection()
+    for i, p in enumerate(fetch_all_profiles()[:8]):
+        profiles.put(f"p{i}", dict(p))
+    listings.put("l1", {"id": "l1", "city": "Lahore", "monthly_rent_PKR": 20000})
+    monkeypatch.setattr(main, "_PROFILE_MIRROR", CollectionMirror("profiles", normalize=normalize_profile, source=profiles))
+    monkeypatch.setattr(main, "_LISTING_MIRROR", CollectionMirror("listings", source=listings))
+
+    first = main._sync_snapshot(None)
+    assert main._sync_snapshot(first) is first
+    listings.put("l2", {"id": "l2", "city": "Karachi", "monthly_rent_PKR": 15000})
+    second = main._sync_snapshot(first)
+    assert second.profile_index is first.profile_index
+    assert [L["id"] for L in second.listings] == ["l1", "l2"] and len(second.listing_index) == 2
+
+
+def test_mirror_loads_only_projected_fields():
+    source = FakeCollection()
+    for i, p in enumerate(fetch_all_profiles()[:5]):
+        source.put(f"p{i}", {**p, "raw_text": "long free text " * 50})
+    mirror = CollectionMirror("profiles", normalize=normalize_profile, source=source, fields=PROFILE_SERVING_FIELDS)
+    mirror.sync()
+    assert all(row["raw_text"] == "" for row in mirror.rows())
+    source.put("p1", {**source.docs["p1"], "city": "Multan"})
+    assert mirror.sync() and mirror.high_water == 6    # the cursor field survives the mask
+    assert mirror.rows()[1]["city"] == "Multan"
+
+
+def test_delta_from_a_failed_refresh_reaches_the_next_snapshot(monkeypatch):
+    import pytest
+
+    import app.main as main
+
+    profiles, listings = FakeCollection(), FakeCollection()
+    for i, p in enumerate(fetch_all_profiles()[:4]):
+        profiles.put(f"p{i}", dict(p))
+    listings.put("l1", {"id": "l1", "city": "Lahore", "monthly_rent_PKR": 20000})
+    monkeypatch.setattr(main, "_PROFILE_MIRROR", CollectionMirror("profiles", normalize=normalize_profile, source=profiles))
+    monkeypatch.setattr(main, "_LISTING_MIRROR", CollectionMirror("listings", source=listings))
+    first = main._sync_snapshot(None)
+
+    # The profile delta is applied, then the listing sync fails.
+    profiles.put("p9", {"id": "late", "city": "Lahore", "budget_pkr": "20k"})
+    real_changed = listings.stream_changed_documents
+
+    def unavailable(*args, **kwargs):
+        raise ConnectionError("firestore unavailable")
+
+    monkeypatch.setattr(listings, "stream_changed_documents", unavailable)
+    with pytest.raises(ConnectionError):
+        main._sync_snapshot(first)
+
+    monkeypatch.setattr(listings, "stream_changed_documents", real_changed)
+    second = main._sync_snapshot(first)
+    assert second is not first and "late" in {p["id"] for p in second.profiles}
+    assert second.listing_index is first.listing_index
+    assert main._sync_snapshot(second) is second
@@ -0,0 +1,53 @@
+import random
+
+import numpy as np
+
+from app.utils.geo import (
+    INVALID_KM,
+    bounding_box,
+    coords_array,
+    distances_from,
+    haversine_km,
+    haversine_many_km,
+    haversine_matrix_km,
+    in_bbox,
+)
+
+
+def _points(n, seed=3):
+    rng = random.Random(seed)
+    pts = [{"lat": rng.uniform(-80, 80), "lng": rng.uniform(-180, 180)} for _ in range(n)]
+    return pts + [{"lat": 10.0, "lng": 179.99}, {"lat": 10.0, "lng": -179.99}]
+
+
+def test_kernels_match_scalar_haversine():
+    pts = _points(60)
+    lats, lngs = coords_array(pts)
+    matrix = haversine_matrix_km(lats, lngs, lats, lngs)
+    for i, p in enumerate(pts):
+        row = haversine_many_km(p["lat"], p["lng"], lats, lngs)
+        want = [haversine_km(p, o) for o in pts]
+        assert np.allclose(row, want, rtol=1e-12, atol=1e-9)
+        assert np.allclose(matrix[i], want, rtol=1e-12, atol=1e-9)
+
+
+def test_invalid_coordinates():
+    locs = [{"lat": 31.5, "lng": 74.3}, {"lat": None, "lng": 74.3}, "nowhere", None, {"lat": "31.6", "lng": "74.4"}]
+    lats, lngs = coords_array(locs)
+    assert np.isnan(lats[1:4]).all() and lats[4] == 31.6
+    assert haversine_km(locs[0], locs[1]) == INVALID_KM
+    d = distances_from(locs[0], lats, lngs)
+    assert d.tolist()[1:4] == [INVALID_KM] * 3
+    assert d[4] == haversine_km(locs[0], locs[4])
+    assert (distances_from({"lat": None}, lats, lngs) == INVALID_KM).all()
+    assert coords_array([])[0].size == 0
+
+
+def test_bounding_box_never_drops_points_within_radius():
+    pts = _points(2000, seed=11)
+    lats, lngs = coords_array(pts)
+    for center in ({"lat": 31.5, "lng": 74.3}, {"lat": 10.0, "lng": 179.95}, {"lat": 89.5, "lng": 0.0}):
+        for radius in (5.0, 300.0, 2500.0):
+            inside = in_bbox(lats, lngs, bounding_box(center["lat"], center["lng"], radius))
+            near = distances_from(center, lats, lngs) <= radius
+            assert not (near & ~inside).any()
@@ -0,0 +1,162 @@
+import random
+
+import numpy as np
+import pytest
+
+from app.agents.room_hunter import rank_rooms, suggest_rooms
+from app.services.firestore import fetch_all_listings
+from app.services.listing_index import ListingIndex
+from app.utils.geo import haversine_km
+from app.utils.num import as_int
+
+
+def _reference_rank_rooms(q, listings, k=3):
+    """Listing-by-listing ranking kept as the behavioural reference."""
+
+    def _city(s):
+        return (s or "").strip().lower()
+
+    def _available(L):
+        status = (L.get("availability") or L.get("status") or "available").strip().lower()
+        if status in ("unavailable", "occupied", "closed", "false", "0", "no"):
+            return False
+        return not (L.get("rooms_available") is not None and as_int(L.get("rooms_available")) <= 0)
+
+    def _rent(L):
+        for key in ("monthly_rent_PKR", "rent_pkr", "rent", "price_pkr", "price"):
+            if key in L and L[key] is not None:
+                return as_int(L[key])
+        return 0
+
+    qcity = _city(q.get("city"))
+    qbud = as_int(q.get("budget_pkr")) or 0
+    qgeo = q.get("geo") or q.get("anchor_location")
+    scored = []
+    for L in listings:
+        if not _available(L) or (qcity and not qgeo and _city(L.get("city")) != qcity):
+            continue
+        rent = _rent(L)
+        if qbud and rent > max(qbud * 2, qbud + 5000):
+            continue
+        score = -abs(rent - (qbud * 2 if qbud else rent)) / 1000.0
+        if qgeo and L.get("geo"):
+            score -= haversine_km(qgeo, L["geo"]) / 2.0
+        scored.append((score, L.get("listing_id") or L.get("id") or "-"))
+    scored.sort(key=lambda x: x[0], reverse=True)
+    return [listing_id for _, listing_id in scored[:k]]
+
+
+def _listings():
+    rng = random.Random(9)
+    out = list(fetch_all_listings())
+    for i in range(150):
+        out.append({
+            "id": f"L{i}",
+            "city": rng.choice(["Lahore", " lahore ", "Karachi", "Islamabad", None]),
+            rng.choice(["monthly_rent_PKR", "rent", "price"]): rng.choice([15000, 20000, 30000, 45000, "25k", None]),
+            "status": rng.choice(["available", "occupied", "Available", None]),
+            "rooms_available": rng.choice([None, 0, 1, 2]),
+            "amenities": rng.sample(["WiFi", "AC", "Gym", "parking"], rng.randint(0, 3)),
+            "geo": rng.choice([None, {"lat": rng.uniform(24, 34), "lng": rng.uniform(67, 75)}, {"lat": None, "lng": None}]),
+        })
+    return out
+
+
+@pytest.mark.parametrize("k", [1, 3, 25])
+def test_rank_rooms_matches_reference(k):
+    listings = _listings()
+    index = ListingIndex.build(listings)
+    for query in (
+        {"city": "Lahore", "budget_pkr": 12000},
+        {"city": "karachi"},
+        {"city": "Lahore", "budget_pkr": 20000, "geo": {"lat": 31.5, "lng": 74.3}},
+        {"budget_pkr": 3000, "anchor_location": {"lat": 24.9, "lng": 67.1}},
+        {"city": "Quetta", "budget_pkr": 20000},
+        {},
+    ):
+        want = _reference_rank_rooms(query, listings, k=k)
+        assert [r["listing_id"] for r in rank_rooms(query, index, k=k)] == want, query
+        assert [r["listing_id"] for r in rank_rooms(query, listings, k=k)] == want, query
+
+
+def test_suggest_rooms_filters_amenities_from_the_index():
+    listings = _listings()
+    index = ListingIndex.build(listings)
+    got = suggest_rooms("Lahore", 15000, ["wifi", " AC "], index, limit=50)
+    assert got == suggest_rooms("Lahore", 15000, ["wifi", " AC "], listings, limit=50)
+    for room in got:
+        assert {"wifi", "ac"} <= {a.strip().lower() for a in room["amenities"]}
+        assert room["city"].strip().lower() == "lahore"
+        assert room["monthly_rent_PKR"] <= 30000
+
+
+def test_amenity_filter_matches_subset_check():
+    listings = _listings()
+    index = ListingIndex.build(listings)
+    names = [{str(a).strip().lower() for a in (L.get("amenities") or [])} for L in listings]
+    everyone = np.arange(len(listings))
+    for required in ([], ["wifi"], ["wifi", "ac"], ["gym", "parking", "ac"], ["pool"], ["wifi", "pool"]):
+        for positions in (everyone, everyone[::7], everyone[:3]):
+            want = [p for p in positions.tolist() if set(required) <= names[p]]
+            assert index.with_amenities(positions, required).tolist() == want, (required, len(positions))
+
+
+@pytest.mark.parametrize("k", [1, 3, 10, 400])
+def test_geo_ranking_expands_to_the_same_top_k(k):
+    rng = random.Random(17)
+    listings = _listings()
+    for i in range(300):
+        listings.append({
+            "id": f"G{i}",
+            "city": "Lahore",
+            "rent": rng.choice([18000, 22000, 40000]),
+            "geo": {"lat": 31.5 + rng.gauss(0, 0.2), "lng": 74.3 + rng.gauss(0, 0.2)},
+        })
+    index = ListingIndex.build(listings)
+    for loc in ({"lat": 31.52, "lng": 74.35}, {"lat": 24.9, "lng": 67.1}, {"lat": -33.9, "lng": 151.2}, {"lat": "x", "lng": 1}):
+        for budget in (None, 9000, 20000):
+            query = {"city": "Lahore", "budget_pkr": budget, "geo": loc}
+            want = _reference_rank_rooms(query, listings, k=k)
+            got = rank_rooms(query, index, k=k)
+            assert [r["listing_id"] for r in got] == want, (loc, budget)
+            for r in got:
+                if r["geo"]:
+                    assert r["distance_km"] == round(haversine_km(loc, r["geo"]), 1)
+
+
+def test_learned_rank_mode_scores_candidates_in_one_batch(monkeypatch):
+    from app.agents import room_hunter
+
+    listings = _listings()
+    index = ListingIndex.build(listings)
+    query = {"city": "Lahore", "budget_pkr": 20000}
+    rules = [r["listing_id"] for r in rank_rooms(query, index, k=5)]
+
+    # No ranker installed: learned mode keeps the rule ranking.
+    monkeypatch.setattr(room_hunter, "_learned_scores", lambda q, batch: None)
+    assert [r["listing_id"] for r in rank_rooms(query, index, k=5, rank_mode="learned")] == rules
+
+    calls = []
+
+    def cheapest_first(q, batch):
+        calls.append(len(batch))
+        return -np.asarray([float(index.rent[listings.index(L)]) for L in batch])
+
+    monkeypatch.setattr(room_hunter, "_learned_scores", cheapest_first)
+    got = rank_rooms(query, index, k=5, rank_mode="learned")
+    window = index.window("Lahore", 20000)
+    assert calls == [len(window)]
+    assert [r["monthly_rent_PKR"] for r in got] == sorted(index.rent[window].tolist())[:5]
+
+    monkeypatch.setenv("ROOM_RANK_MODE", "learned")
+    assert [r["listing_id"] for r in rank_rooms(query, index, k=5)] == [r["listing_id"] for r in got]
+
+
+def test_features_matrix_matches_per_listing_features():
+    pytest.importorskip("joblib")
+    from app_patches.room_hunter_patch import features, features_matrix
+
+    listings = [L for L in _listings() if not isinstance(L.get("monthly_rent_PKR"), str)]
+    for profile in ({"city": "Lahore", "budget_pkr": 15000, "amenities": ["WiFi", "gym"]}, {}):
+        want = np.stack([features(profile, L) for L in listings])
+        assert np.array_equal(features_matrix(profile, listings), want)
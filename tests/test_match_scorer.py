@@ -0,0 +1,113 @@
+import pytest
+
+from app.agents.match_scorer import (
+    SUBSCORE_KEYS,
+    MatchScoreConfig,
+    PoolCodes,
+    ScoringPlan,
+    compile_config,
+    get_match_config,
+    reset_match_config,
+    score_many,
+    score_pair,
+    set_match_config,
+    top_k_many,
+)
+from app.agents.profile_reader import normalize_profile
+from app.services.firestore import fetch_all_profiles
+
+
+_CONFIGS = [
+    MatchScoreConfig(),
+    MatchScoreConfig(weights=dict(city=0, budget=30, sleep=5, anchor=20, custom=3)),
+    MatchScoreConfig(
+        weights=dict(city=2.5, budget=10.25, sleep=1.5, cleanliness=3, anchor=7.5),
+        anchor_buckets=((1.0, 1.0), (50.0, 0.25)),
+    ),
+]
+
+
+def _pool():
+    profiles = fetch_all_profiles()
+    extras = [
+        normalize_profile({"id": "x1", "city": "Lahore", "budget_pkr": "18k", "study_habits": "home and library"}),
+        normalize_profile({"id": "x2", "anchor_location": {"lat": None, "lng": None}}),
+        normalize_profile({"id": "x3", "smoking": True, "role": "job"}),
+        {"id": "raw", "study_habits": ["library"], "budget_pkr": -100},
+    ]
+    return profiles + extras
+
+
+@pytest.mark.parametrize("config", _CONFIGS)
+def test_score_many_matches_score_pair(config):
+    pool = _pool()
+    codes = PoolCodes.encode(pool)
+    for seeker in pool:
+        totals, matrix = score_many(seeker, codes, config=config, subscores=True)
+        for i, cand in enumerate(pool):
+            total, _, subscores = score_pair(seeker, cand, config=config)
+            assert totals[i] == total
+            for j, key in enumerate(SUBSCORE_KEYS):
+                assert matrix[i, j] == subscores.get(key, 0)
+
+
+def test_score_many_accepts_plain_lists_and_slices():
+    pool = _pool()
+    seeker = pool[0]
+    codes = PoolCodes.encode(pool)
+    full, _ = score_many(seeker, pool)
+    sliced, matrix = score_many(seeker, codes.take([3, 1, 2]))
+    assert matrix is None
+    assert sliced.tolist() == [full[3], full[1], full[2]]
+    empty, _ = score_many(seeker, [])
+    assert empty.size == 0
+
+
+@pytest.mark.parametrize("config", _CONFIGS + [MatchScoreConfig(weights=dict(city=5, budget=-3, anchor=4))])
+@pytest.mark.parametrize("k", [1, 3, 10, 1000])
+def test_top_k_many_matches_exhaustive_ranking(config, k):
+    pool = _pool()
+    codes = PoolCodes.encode(pool)
+    for seeker in pool:
+        totals, _ = score_many(seeker, codes, config=config)
+        want = sorted(range(len(pool)), key=lambda i: totals[i], reverse=True)[:k]
+        assert top_k_many(seeker, codes, k, config=config).tolist() == want
+    assert top_k_many(pool[0], codes, 0, config=config).size == 0
+
+
+def test_pipeline_bounded_mode_matches_exhaustive():
+    from app.graph import run_pipeline
+    from app.services.firestore import fetch_all_listings
+
+    profiles = fetch_all_profiles()
+    listings = fetch_all_listings()
+    for seeker in profiles[:10]:
+        a = run_pipeline(seeker, profiles, listings, top_k=4, score_mode="exhaustive")
+        b = run_pipeline(seeker, profiles, listings, top_k=4, score_mode="bounded")
+        assert a["matches"] == b["matches"]
+
+
+def test_compiled_plans_are_cached_by_fingerprint():
+    a = compile_config(MatchScoreConfig(weights=dict(city=4, budget=6), anchor_buckets=((3, 1.0),)))
+    b = compile_config(MatchScoreConfig(weights=dict(city=4, budget=6), anchor_buckets=((3.0, 1.0),)))
+    c = compile_config(MatchScoreConfig(weights=dict(city=4.0, budget=6), anchor_buckets=((3, 1.0),)))
+    assert a is b and isinstance(a, ScoringPlan)
+    assert c != a and c.fingerprint != a.fingerprint
+    assert compile_config(a) is a
+    assert len({a, b, c}) == 2
+    assert a.weight_vector.tolist()[:2] == [4, 6] and not a.weight_vector.flags.writeable
+    with pytest.raises(TypeError):
+        a.weights["city"] = 1
+
+
+def test_active_plan_follows_set_match_config():
+    pool = _pool()
+    try:
+        custom = MatchScoreConfig(weights=dict(city=1, role=50))
+        set_match_config(custom)
+        assert compile_config() is compile_config(custom)
+        assert get_match_config().weights == custom.weights
+        assert score_pair(pool[0], pool[1]) == score_pair(pool[0], pool[1], config=custom)
+    finally:
+        reset_match_config()
+    assert compile_config() is compile_config(MatchScoreConfig())
@@ -31,3 +31,163 @@ def test_trace_marks_new_vs_notified():
     notifier_step = next(step for step in rerun["trace"]["steps"] if step["agent"] == "MatchNotifier")
     assert notifier_step["outputs"]["previously_notified"] >= 1
     assert rerun["trace"].get("trace_id"), "expected pipeline trace to include a stable trace_id"
+
+
+class _FakeFaiss:
+    def __init__(self, ids):
+        self.ids = ids
+        self.calls = 0
+
+    def ready(self):
+        return True
+
+    def search_ids(self, q, k=50):
+        self.calls += 1
+        return self.ids[:k]
+
+
+def test_online_mode_uses_warmed_faiss_store():
+    profiles = fetch_all_profiles()
+    listings = fetch_all_listings()
+    store = _FakeFaiss([profiles[3]["id"], "missing-id", profiles[1]["id"]])
+
+    result = run_pipeline(profiles[0], profiles, listings, mode="online", top_k=5, faiss_store=store)
+
+    assert store.calls == 1
+    retrieval = next(s for s in result["trace"]["steps"] if s["agent"] == "CandidateRetrieval")
+    assert retrieval["inputs"]["method"] == "faiss"
+    assert "fallback" not in retrieval["outputs"]
+    assert {m["other_profile_id"] for m in result["matches"]} == {profiles[3]["id"], profiles[1]["id"]}
+
+
+def test_conflicts_computed_only_for_returned_matches(monkeypatch):
+    import app.graph as graph
+
+    calls = []
+    real = graph.red_flags
+    monkeypatch.setattr(graph, "red_flags", lambda a, b, ctx=None: calls.append(b.get("id")) or real(a, b, ctx=ctx))
+
+    profiles = fetch_all_profiles()
+    result = run_pipeline(profiles[0], profiles, fetch_all_listings(), top_k=3)
+
+    assert calls == [m["other_profile_id"] for m in result["matches"]]
+    for m in result["matches"]:
+        other = next(p for p in profiles if p["id"] == m["other_profile_id"])
+        assert m["conflicts"] == real(profiles[0], other)
+
+
+def test_trace_reports_distance_cache_hits():
+    profiles = fetch_all_profiles()
+    seeker = next(p for p in profiles if p.get("anchor_location"))
+    result = run_pipeline(seeker, profiles, fetch_all_listings(), top_k=5)
+
+    cache = result["trace"]["cache"]
+    # Retrieval measures the anchors it ranks; scoring, reasons and flags reuse them.
+    assert cache["distance_hits"] > 0
+    assert cache["distances_cached"] > 0
+
+
+def test_pipeline_context_computes_each_pair_once():
+    from app.utils.context import PipelineContext
+    from app.utils.geo import coords_array, haversine_km
+
+    seeker = {"id": "s", "anchor_location": {"lat": 31.5, "lng": 74.3}}
+    others = [
+        {"id": "a", "anchor_location": {"lat": 31.6, "lng": 74.4}},
+        {"id": None, "anchor_location": {"lat": 31.7, "lng": 74.2}},
+        {"id": "c", "anchor_location": {"lat": None, "lng": None}},
+    ]
+    ctx = PipelineContext(seeker=seeker)
+    lats, lngs = coords_array(o["anchor_location"] for o in others)
+    keys = [ctx.key(o, "anchor_location") for o in others]
+    first = ctx.distances(ctx.key(seeker, "anchor_location"), seeker["anchor_location"], keys, lats, lngs)
+    assert ctx.stats() == {"distance_hits": 0, "distance_misses": 3, "distances_cached": 2}
+
+    for o, d in zip(others, first):
+        assert abs(ctx.pair_km(seeker, o) - haversine_km(seeker["anchor_location"], o["anchor_location"])) < 1e-9
+        assert abs(d - haversine_km(seeker["anchor_location"], o["anchor_location"])) < 1e-9
+    # The id-less candidate is never cached.
+    assert ctx.stats()["distance_hits"] == 2
+
+
+def test_rooms_run_alongside_matching_and_are_timed(monkeypatch):
+    import threading
+
+    import app.graph as graph
+
+    started = threading.Event()
+    real_rank_rooms = graph.rank_rooms
+
+    def slow_rooms(*args, **kwargs):
+        started.set()
+        return real_rank_rooms(*args, **kwargs)
+
+    def retrieve_after_rooms(self, *args, **kwargs):
+        # Only completes if the room branch is running on another thread.
+        assert started.wait(5)
+        return real_retrieve_rows(self, *args, **kwargs)
+
+    real_retrieve_rows = graph.CandidateRetrieval.retrieve_rows
+    monkeypatch.setattr(graph, "rank_rooms", slow_rooms)
+    monkeypatch.setattr(graph.CandidateRetrieval, "retrieve_rows", retrieve_after_rooms)
+
+    profiles = fetch_all_profiles()
+    seeker = next(p for p in profiles if p.get("anchor_location"))
+    result = run_pipeline(seeker, profiles, fetch_all_listings(), top_k=3)
+
+    assert set(result["trace"]["timings_ms"]) == {"normalize", "retrieve", "score", "explain", "rooms", "commute", "total"}
+    assert all(ms >= 0 for ms in result["trace"]["timings_ms"].values())
+
+
+def test_spans_and_stage_histograms(monkeypatch):
+    from app.utils.metrics import STAGE_METRICS
+
+    STAGE_METRICS.reset()
+    profiles = fetch_all_profiles()
+    listings = fetch_all_listings()
+    seeker = next(p for p in profiles if p.get("anchor_location"))
+
+    monkeypatch.delenv("TRACE_SPANS", raising=False)
+    assert "spans" not in run_pipeline(seeker, profiles, listings, top_k=3)["trace"]
+    monkeypatch.setenv("TRACE_SPANS", "true")
+    trace = run_pipeline(seeker, profiles, listings, top_k=3)["trace"]
+    assert "spans" not in run_pipeline(seeker, profiles, listings, top_k=3, trace_spans=False)["trace"]
+
+    spans = {s["stage"]: s for s in trace["spans"]}
+    assert spans["retrieve"]["in"] == len(profiles) and spans["retrieve"]["method"]
+    assert spans["retrieve"]["out"] == spans["score"]["in"]
+    assert spans["score"]["out"] == spans["explain"]["in"] == min(3, spans["score"]["in"])
+    assert spans["rooms"]["in"] == len(listings) and spans["commute"]["in"] == spans["rooms"]["out"]
+
+    snapshot = STAGE_METRICS.snapshot()
+    assert snapshot["counters"]["pipeline_requests"] == 3
+    for stage in ("normalize", "retrieve", "score", "explain", "rooms", "commute", "total"):
+        hist = snapshot["latency_ms"][stage]
+        assert hist["count"] == 3
+        assert 0 <= hist["p50_ms"] <= hist["p95_ms"] <= hist["p99_ms"] <= hist["max_ms"]
+
+
+def test_concurrent_pipelines_do_not_queue_behind_the_stage_pool(monkeypatch):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    import app.graph as graph
+
+    # A single pool worker: both requests' retrievals must still run at once.
+    stage_pool = ThreadPoolExecutor(1)
+    monkeypatch.setattr(graph, "shared_pool", lambda: stage_pool)
+    both = threading.Barrier(2, timeout=5)
+    real_retrieve_rows = graph.CandidateRetrieval.retrieve_rows
+
+    def retrieve_together(self, *args, **kwargs):
+        both.wait()
+        return real_retrieve_rows(self, *args, **kwargs)
+
+    monkeypatch.setattr(graph.CandidateRetrieval, "retrieve_rows", retrieve_together)
+
+    profiles = fetch_all_profiles()
+    listings = fetch_all_listings()
+    with ThreadPoolExecutor(2) as requests:
+        futures = [requests.submit(run_pipeline, p, profiles, listings, top_k=3) for p in profiles[:2]]
+        results = [f.result(timeout=10) for f in futures]
+    assert all("retrieve" in r["trace"]["timings_ms"] for r in results)
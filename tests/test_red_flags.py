@@ -1,6 +1,6 @@
 import unittest
 
-from app.agents.red_flag import red_flags
+from app.agents.red_flag import red_flag_codes, red_flags, render_flags
 
 
 class RedFlagRuleTests(unittest.TestCase):
@@ -59,6 +59,29 @@ class RedFlagRuleTests(unittest.TestCase):
         self.assertTrue(city_flags)
         self.assertTrue(all("lahore" in f["details"].lower() for f in city_flags))
 
+    def test_batch_codes_render_to_the_same_flags(self):
+        seeker = {
+            "smoking": "no",
+            "sleep_schedule": "early_bird",
+            "study_habits": "late night",
+            "budget_pkr": 20000,
+            "anchor_location": {"lat": 31.5, "lng": 74.3, "label": "Lahore"},
+        }
+        pool = [
+            {"smoking": "yes", "guests_freq": "often", "study_habits": "Early mornings", "budget_pkr": 40000},
+            {"role": "student", "anchor_location": {"lat": 31.74, "lng": 74.34, "label": "Lahore, DHA"}},
+            {"anchor_location": {"lat": None, "lng": None}},
+            {},
+        ]
+        codes = red_flag_codes(seeker, pool)
+        self.assertEqual(codes[0], ("smoking_clash", "sleep_vs_guests", "study_routine_clash", "budget_gap"))
+        self.assertEqual(codes[1], ("anchor_commute_heavy",))
+        self.assertEqual(codes[2], ("anchor_too_far",))
+        self.assertEqual(codes[3], ())
+        for other, other_codes in zip(pool, codes):
+            self.assertEqual(render_flags(seeker, other, other_codes), red_flags(seeker, other))
+
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,233 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from app.agents.profile_reader import normalize_profile
+from app.agents.retrieval import (
+    CandidateRetrieval,
+    PushdownRetrieval,
+    RetrievalConfig,
+    TOP_N_DEGRADED,
+    _pct_diff,
+    budget_close,
+    city_spellings,
+    haversine_km,
+)
+from app.services.firestore import _matches, fetch_all_profiles
+from app.services.profile_index import ProfileIndex
+from app.utils.keyword_filter import normalize_city
+
+
+class _DS:
+    def __init__(self, profiles, index=None):
+        self._profiles = profiles
+        self.profile_index = index
+        self.faiss = None
+
+    def fetch_all_profiles(self):
+        return self._profiles
+
+
+def _reference_retrieve(query, profiles, config, top_n):
+    """Row-by-row retrieval kept as the behavioural reference."""
+
+    def _budget(p):
+        return p.get("budget_pkr") or p.get("budget_PKR") or p.get("budget")
+
+    q_city = normalize_city(query.get("city") or "")
+    q_budget = query.get("budget_pkr")
+    q_role = query.get("role")
+    q_anchor = query.get("anchor_location")
+    meta = {"method": "degraded_keyword"}
+
+    pass1 = []
+    for p in profiles:
+        pc = normalize_city(p.get("city") or "")
+        if q_city and pc == q_city and budget_close(q_budget, _budget(p), tol=config.budget_tol):
+            if not q_role or p.get("role") == q_role:
+                if q_anchor and p.get("anchor_location"):
+                    if haversine_km(q_anchor, p["anchor_location"]) <= config.anchor_dist_km:
+                        pass1.append(p)
+                else:
+                    pass1.append(p)
+    if not pass1:
+        pass2 = [
+            p for p in profiles
+            if (q_city and normalize_city(p.get("city") or "") == q_city)
+            or budget_close(q_budget, _budget(p), tol=config.budget_tol)
+        ]
+        if pass2:
+            meta["fallback"] = "broadened_city_or_budget"
+            pass1 = pass2
+    if not pass1:
+        meta["fallback"] = "pool_any"
+        pass1 = profiles[:TOP_N_DEGRADED]
+
+    def rank_key(p):
+        city_score = config.city_boost if (q_city and normalize_city(p.get("city") or "") == q_city) else 0.0
+        role_bonus = 0.5 if (q_role and p.get("role") == q_role) else 0.0
+        anchor_bonus = 0.0
+        if q_anchor and p.get("anchor_location"):
+            d = haversine_km(q_anchor, p["anchor_location"])
+            for threshold, bonus in config.anchor_bonus_steps:
+                if d <= threshold:
+                    anchor_bonus = bonus
+                    break
+        return (city_score + role_bonus + anchor_bonus, -_pct_diff(q_budget, _budget(p)))
+
+    pass1.sort(key=rank_key, reverse=True)
+    return pass1[:min(top_n, TOP_N_DEGRADED)], meta
+
+
+def _ids(profiles):
+    return [p.get("id") for p in profiles]
+
+
+@pytest.mark.parametrize("config", [RetrievalConfig(), RetrievalConfig(budget_tol=0.1, anchor_dist_km=3.0)])
+def test_matches_reference_for_every_seeker(config):
+    profiles = fetch_all_profiles()
+    index = ProfileIndex.build(profiles)
+    retr = CandidateRetrieval(_DS(profiles, index), config=config)
+    for seeker in profiles:
+        got, meta = retr.retrieve(seeker, top_n=10, mode="degraded")
+        want, want_meta = _reference_retrieve(seeker, profiles, config, top_n=10)
+        assert _ids(got) == _ids(want)
+        assert meta == want_meta
+
+
+def test_fallback_chain_and_missing_fields():
+    profiles = [
+        normalize_profile({"id": "a", "city": "Lahore", "budget_pkr": 20000, "role": "student"}),
+        normalize_profile({"id": "b", "city": "lhr", "budget_pkr": 60000, "role": "student"}),
+        normalize_profile({"id": "c", "city": "Karachi"}),
+        normalize_profile({"id": "d", "city": "Karachi", "budget_pkr": 21000,
+                           "anchor_location": {"label": "x", "lat": None, "lng": None}}),
+    ]
+    retr = CandidateRetrieval(_DS(profiles))
+    config = RetrievalConfig()
+
+    for query in (
+        {"city": "Lahore", "budget_pkr": 20000, "role": "student"},
+        {"city": "Lahore", "budget_pkr": 20000, "role": "professional"},
+        {"city": "Quetta", "budget_pkr": 90000},
+        {"city": "Karachi", "budget_pkr": 20000, "anchor_location": {"lat": 24.9, "lng": 67.1}},
+        {},
+    ):
+        got, meta = retr.retrieve(copy.deepcopy(query), top_n=10, mode="degraded")
+        want, want_meta = _reference_retrieve(query, profiles, config, top_n=10)
+        assert _ids(got) == _ids(want), query
+        assert meta == want_meta, query
+
+
+def test_empty_snapshot_returns_pool_any():
+    got, meta = CandidateRetrieval(_DS([])).retrieve({"city": "Lahore"}, mode="degraded")
+    assert got == []
+    assert meta["fallback"] == "pool_any"
+
+
+def test_budget_window_matches_budget_close():
+    budgets = [0, 12000, 14000, 20000, 28000, 33333, 33334, 50000, -5, 9999]
+    profiles = [{"id": str(i), "city": "Lahore", "budget_pkr": b} for i, b in enumerate(budgets)]
+    index = ProfileIndex.build(profiles)
+    for q in (20000, 1, 50000, 0, None):
+        for tol in (0.0, 0.3, 0.4, 1.0):
+            want = [i for i, b in enumerate(budgets) if budget_close(q, b, tol)]
+            assert index.budget_window(q, tol).tolist() == want, (q, tol)
+            assert index.budget_window(q, tol, index.city_code("lhr")).tolist() == want, (q, tol)
+
+
+def test_anchor_grid_within_matches_brute_force():
+    rng = random.Random(7)
+    points = [(rng.uniform(23.0, 36.0), rng.uniform(60.0, 78.0)) for _ in range(400)]
+    points += [(10.0, 179.95), (10.0, -179.95), (89.9, 0.0)]
+    profiles = [{"id": str(i), "anchor_location": {"lat": la, "lng": lo}} for i, (la, lo) in enumerate(points)]
+    profiles.append({"id": "bad", "anchor_location": {"lat": None, "lng": None}})
+    index = ProfileIndex.build(profiles)
+
+    for q, radius in (((31.5, 74.3), 20.0), ((24.9, 67.1), 150.0), ((10.0, 179.99), 30.0), ((89.95, 10.0), 50.0)):
+        loc = {"lat": q[0], "lng": q[1]}
+        rows, dist = index.anchor_grid.within(loc, radius)
+        want = [i for i, p in enumerate(profiles[:-1]) if haversine_km(loc, p["anchor_location"]) <= radius]
+        assert rows.tolist() == want, q
+        assert np.allclose(dist, [haversine_km(loc, profiles[i]["anchor_location"]) for i in want])
+
+
+class _FakeFirestore:
+    """Answers pushed-down queries from raw documents the way Firestore would."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def __call__(self, filters, limit, descending=False):
+        self.calls.append(filters)
+        hits = [(doc_id, d) for doc_id, d in sorted(self.docs.items()) if _matches(d, filters)]
+        ranged = [f for f, op, _ in filters if op in (">=", "<=", ">", "<")]
+        if ranged:
+            # A range filter orders the results by that field.
+            hits.sort(key=lambda kv: (kv[1][ranged[0]], kv[0]), reverse=descending)
+        return [(doc_id, normalize_profile(d)) for doc_id, d in hits[:limit]]
+
+
+def test_pushdown_matches_in_memory_retrieval():
+    raw = {
+        "a": {"id": "a", "city": "Lahore", "budget_pkr": 20000, "role": "student"},
+        "b": {"id": "b", "city": "lhr", "budget_pkr": 60000, "role": "student"},
+        "c": {"id": "c", "city": "Karachi", "budget_pkr": 15000},
+        "d": {"id": "d", "city": "Karachi", "budget_pkr": 21000, "anchor_location": {"lat": 24.9, "lng": 67.0}},
+        "e": {"id": "e", "city": "LAHORE", "budget_pkr": 24000, "role": "professional"},
+        "f": {"id": "f", "city": "Islamabad", "budget_pkr": 90000},
+        "g": {"id": "g", "city": "Lahore", "budget_pkr": 21000, "role": "Student"},
+        "h": {"id": "h", "city": "lahore", "budget_pkr": 19000, "role": "undergrad"},
+    }
+    profiles = [normalize_profile(raw[k]) for k in sorted(raw)]
+    memory = CandidateRetrieval(_DS(profiles))
+    for query in (
+        {"city": "Lahore", "budget_pkr": 20000, "role": "student"},
+        {"city": "Lahore", "budget_pkr": 20000, "role": "engineer"},
+        {"city": "Quetta", "budget_pkr": 90000},
+        {"city": "Quetta", "budget_pkr": 5},
+        {"city": "Karachi", "budget_pkr": 20000, "anchor_location": {"lat": 24.9, "lng": 67.1}},
+        {"budget_pkr": 22000},
+        # No usable budget: every profile is "close", so broadening reaches all of them.
+        {"city": "Lahore", "role": "engineer"},
+        {"city": "Lahore", "budget_pkr": None, "role": "student"},
+        {"city": "Quetta"},
+        {"city": "Karachi", "budget_pkr": 0, "role": "professional"},
+        {},
+    ):
+        fake = _FakeFirestore(raw)
+        got, meta = PushdownRetrieval(fake).retrieve(copy.deepcopy(query), top_n=10, mode="degraded")
+        want, want_meta = memory.retrieve(copy.deepcopy(query), top_n=10, mode="degraded")
+        assert _ids(got) == _ids(want), query
+        assert meta.get("fallback") == want_meta.get("fallback"), query
+        assert meta["method"] == "firestore_pushdown" and meta["pushdown_queries"] == len(fake.calls)
+
+    # A first pass that finds something is the only pass issued: the budget window
+    # as two halves with city and budget pushed down; role is matched in memory.
+    fake = _FakeFirestore(raw)
+    PushdownRetrieval(fake).retrieve({"city": "Lahore", "budget_pkr": 20000, "role": "student"})
+    assert len(fake.calls) == 2
+    assert all({f[0] for f in call} == {"city", "budget_pkr"} for call in fake.calls)
+
+
+def test_pushdown_limit_keeps_the_budgets_closest_to_the_query():
+    raw = {f"p{i:03d}": {"id": f"p{i:03d}", "city": "Lahore", "budget_pkr": 12000 + 200 * i} for i in range(80)}
+    profiles = [normalize_profile(raw[k]) for k in sorted(raw)]
+    memory = CandidateRetrieval(_DS(profiles))
+    for budget in (20000, 13000, 27500):
+        query = {"city": "Lahore", "budget_pkr": budget}
+        matching = sum(1 for p in profiles if budget_close(budget, p["budget_pkr"], RetrievalConfig().budget_tol))
+        fake = _FakeFirestore(raw)
+        got, _ = PushdownRetrieval(fake, limit=10).retrieve(copy.deepcopy(query), top_n=5, mode="degraded")
+        want, _ = memory.retrieve(copy.deepcopy(query), top_n=5, mode="degraded")
+        assert matching > 10 and _ids(got) == _ids(want), budget
+
+
+def test_city_spellings_cover_normalize_city():
+    for city in ("lahore", "karachi", "rawalpindi"):
+        for spelling in city_spellings(city):
+            assert normalize_city(spelling) == city
+    assert {"lhr", "LHR", "Lahore"} <= set(city_spellings("lahore"))
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+
+from app.services.snapshot_cache import SnapshotCache
+
+
+def _wait_for(cond, timeout=5.0):
+    deadline = time.time() + timeout
+    while not cond():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_stale_reads_serve_last_snapshot_while_refreshing():
+    release = threading.Event()
+    builds = []
+
+    def build():
+        if builds:
+            assert release.wait(5)
+        builds.append(len(builds))
+        return {"version": len(builds)}
+
+    cache = SnapshotCache(build, ttl_sec=0.05)
+    first = cache.get()
+    assert first == {"version": 1}
+
+    time.sleep(0.06)
+    # The rebuild blocks on ``release``; stale reads keep returning the old snapshot.
+    assert cache.get() is first
+    assert cache.get() is first
+    assert cache.stats()["refresh_in_flight"]
+
+    release.set()
+    _wait_for(lambda: cache.snapshot != first)
+    assert cache.snapshot == {"version": 2}
+    assert len(builds) == 2
+    stats = cache.stats()
+    assert stats["refreshes"] == 2 and stats["refresh_failures"] == 0
+    assert stats["last_refresh_duration_ms"] is not None
+
+
+def test_failed_refresh_keeps_last_good_snapshot():
+    calls = {"n": 0}
+
+    def build():
+        calls["n"] += 1
+        if calls["n"] > 1:
+            raise RuntimeError("firestore down")
+        return ["ok"]
+
+    cache = SnapshotCache(build, ttl_sec=0.0, retry_sec=60)
+    good = cache.get()
+    assert cache.refresh() is good
+    stats = cache.stats()
+    assert stats["refresh_failures"] == 1 and stats["consecutive_refresh_failures"] == 1
+    assert "firestore down" in stats["last_refresh_error"]
+
+    # Backing off: stale reads do not hammer the backend after a failure.
+    assert cache.get() is good
+    assert not cache.stats()["refresh_in_flight"] and calls["n"] == 2
+
+
+def test_first_load_failure_raises():
+    def build():
+        raise RuntimeError("no data")
+
+    with pytest.raises(RuntimeError):
+        SnapshotCache(build, ttl_sec=10).get()
+
+
+def test_background_refresher_swaps_snapshots():
+    versions = iter(range(100))
+    cache = SnapshotCache(lambda: next(versions), ttl_sec=60)
+    assert cache.get() == 0
+    cache.start(interval_sec=0)   # clamped to one second
+    try:
+        assert cache.stats()["background_refresher"]
+        _wait_for(lambda: cache.snapshot >= 1)
+    finally:
+        cache.stop()
+    assert not cache.stats()["background_refresher"]
+
+
+def test_empty_indexes_are_reused(monkeypatch):
+    import app.main as main
+
+    empty = main._index_snapshot([], [])
+    monkeypatch.setattr(main.ProfileIndex, "build", lambda *a, **k: pytest.fail("rebuilt an empty index"))
+    monkeypatch.setattr(main.ListingIndex, "build", lambda *a, **k: pytest.fail("rebuilt an empty index"))
+    again = main._index_snapshot([], [], profile_index=empty.profile_index, listing_index=empty.listing_index)
+    assert again.profile_index is empty.profile_index and again.listing_index is empty.listing_index
+
+
+def test_snapshot_build_encodes_match_codes_off_the_request_path():
+    import app.main as main
+    from app.services.firestore import fetch_all_profiles
+
+    snap = main._index_snapshot(fetch_all_profiles(), [])
+    builds = []
+    codes = snap.profile_index.derived("match_codes", lambda ps: builds.append(1))
+    assert not builds and len(codes) == len(snap.profiles)
+
+
+def test_derived_artefacts_are_built_once_under_concurrency():
+    from app.services.profile_index import ProfileIndex
+
+    index = ProfileIndex.build([{"id": "a"}, {"id": "b"}])
+    gate, calls = threading.Barrier(4, timeout=5), []
+
+    def build(profiles):
+        calls.append(1)
+        time.sleep(0.05)
+        return len(profiles)
+
+    def worker():
+        gate.wait()
+        return index.derived("codes", build)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == [1] and index.derived("codes", build) == 2
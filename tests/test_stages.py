@@ -0,0 +1,97 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app.utils.stages import Stage, run_stages
+
+
+def _diamond(log):
+    def step(name, value):
+        def fn(done):
+            log.append(name)
+            return value(done)
+        return fn
+
+    return [
+        Stage("d", step("d", lambda done: done["b"] + done["c"]), after=("b", "c")),
+        Stage("b", step("b", lambda done: done["a"] * 2), after=("a",)),
+        Stage("a", step("a", lambda done: 1)),
+        Stage("c", step("c", lambda done: done["a"] + 10), after=("a",)),
+    ]
+
+
+@pytest.mark.parametrize("workers", [0, 1, 3])
+def test_stages_run_after_their_dependencies(workers):
+    log = []
+    pool = ThreadPoolExecutor(workers) if workers else None
+    results, wall_ms = run_stages(_diamond(log), pool)
+    assert results == {"a": 1, "b": 2, "c": 11, "d": 13}
+    assert log[0] == "a" and log[-1] == "d"
+    assert set(wall_ms) == {"a", "b", "c", "d"}
+
+
+def test_independent_stages_overlap():
+    both = threading.Barrier(2, timeout=5)
+    stages = [Stage("x", lambda done: both.wait()), Stage("y", lambda done: both.wait())]
+    results, _ = run_stages(stages, ThreadPoolExecutor(2))
+    assert sorted(results.values()) == [0, 1]
+
+
+def test_stage_errors_propagate_and_skip_dependents():
+    ran = []
+
+    def boom(done):
+        raise RuntimeError("boom")
+
+    stages = [Stage("a", boom), Stage("b", lambda done: ran.append("b"), after=("a",))]
+    with pytest.raises(RuntimeError):
+        run_stages(stages, ThreadPoolExecutor(2))
+    assert ran == []
+    with pytest.raises(ValueError):
+        run_stages([Stage("a", lambda done: 1, after=("missing",))])
+
+
+def test_inline_stages_run_on_the_calling_thread():
+    caller = threading.get_ident()
+    stages = [
+        Stage("a", lambda done: threading.get_ident(), inline=True),
+        Stage("b", lambda done: threading.get_ident(), after=("a",), inline=True),
+        Stage("side", lambda done: threading.get_ident()),
+    ]
+    results, _ = run_stages(stages, ThreadPoolExecutor(1))
+    assert results["a"] == results["b"] == caller
+    assert results["side"] != caller
+
+
+def test_forked_child_gets_a_working_stage_pool(monkeypatch):
+    import os
+    import time
+
+    from app.utils import stages
+
+    if not hasattr(os, "fork"):
+        pytest.skip("needs os.fork")
+    monkeypatch.setenv("PIPELINE_WORKERS", "2")
+    monkeypatch.setattr(stages, "_POOL", None)
+    side = [Stage("side", lambda done: 1)]
+    assert run_stages(side, stages.shared_pool())[0] == {"side": 1}   # parent threads started
+
+    pid = os.fork()
+    if pid == 0:  # child
+        try:
+            results, _ = run_stages(side, stages.shared_pool())
+            os._exit(0 if results == {"side": 1} else 1)
+        finally:
+            os._exit(2)
+    deadline = time.time() + 5
+    while True:
+        done, status = os.waitpid(pid, os.WNOHANG)
+        if done:
+            break
+        if time.time() > deadline:
+            os.kill(pid, 9)
+            os.waitpid(pid, 0)
+            pytest.fail("forked child hung on the inherited stage pool")
+        time.sleep(0.01)
+    assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+
+from app.utils.topk import top_k_indices, top_k_lexsort
+
+
+@pytest.mark.parametrize("k", [0, 1, 3, 17, 50, 200])
+def test_partial_selection_matches_stable_sort(k):
+    rng = np.random.default_rng(5)
+    for _ in range(20):
+        n = int(rng.integers(0, 120))
+        scores = rng.integers(0, 6, n).astype(float)   # plenty of ties
+        gaps = rng.integers(0, 3, n) / 4.0
+        rows = rng.permutation(n)
+
+        assert top_k_indices(scores, k).tolist() == np.argsort(-scores, kind="stable")[:k].tolist()
+        keys = (rows, gaps, -scores)
+        assert top_k_lexsort(keys, k).tolist() == np.lexsort(keys)[:k].tolist()